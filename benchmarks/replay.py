@@ -0,0 +1,505 @@
+"""
+Генератор нагрузки воспроизведением записанных запросов.
+
+Запросы загружаются из коллекции Postman v2.1 (--postman, папки коллекции разворачиваются, адрес сервера
+игнорируется) и/или из журнала JSONL (--log): по одному JSON-объекту на строку с полями method, path (либо url),
+необязательными body (объект или строка), user (идентификатор сессии) и ts (время запроса в секундах).
+Строки без method и path пропускаются.
+
+Каждый виртуальный пользователь регистрируется, входит в систему (cookie сессии хранятся отдельно для каждого)
+и создаёт собственные категории и операции. Идентификаторы записанных запросов (категорий, операций, заданий
+отчётов - в пути, параметрах и теле) заменяются идентификаторами объектов виртуального пользователя: каждому
+записанному идентификатору один раз сопоставляется случайный объект, созданные при воспроизведении объекты
+добавляются к выбору, удалённые - исключаются. Запросы входа выполняются с учётными данными виртуального
+пользователя, после завершения сессии (/auth/logout) вход повторяется перед следующим запросом (вне замеров).
+Адреса e-mail регистрации и имена создаваемых категорий дополняются номером пользователя и прохода журнала,
+поэтому конфликты имён внутри одного прохода сохраняются, а повторные проходы их не накапливают.
+
+Запросы подаются по открытой модели: моменты отправки задаются расписанием (--rate запросов в секунду,
+равномерно или по Пуассону, либо по меткам ts журнала с ускорением --speed) и не зависят от ответов сервера.
+Запросы одного виртуального пользователя выполняются по порядку, задержка отсчитывается от запланированного
+момента, поэтому включает ожидание в очереди генератора. Журнал воспроизводится по кругу в течение --duration
+секунд (или --passes проходов). По каждому эндпоинту выводятся количество, пропускная способность, коды ответов,
+p50/p95/p99 и гистограмма задержек, результаты сохраняются в JSON (--output).
+
+Без --url приложение запускается на копии example.db так же, как в нагрузочном стенде (benchmarks/stress.py).
+
+Запуск из корня проекта:
+    $ python benchmarks/replay.py --postman "API test requests.postman_collection.json" --rate 100 --duration 30
+    $ python benchmarks/replay.py --log access.jsonl --speed 2 --url http://127.0.0.1:5000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from time import perf_counter, sleep
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from stress import Client, local_server, percentile
+
+# Границы корзин гистограммы задержек, мс (последняя корзина - больше 5000 мс)
+HISTOGRAM = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# Идентификаторы в пути запроса: вид объекта по префиксу пути
+PATH_IDS = (
+    (re.compile(r'^/categories/(\d+)'), 'category'),
+    (re.compile(r'^/transactions/(\d+)'), 'operation'),
+    (re.compile(r'^/reports/jobs/([^/]+)'), 'job'),
+)
+# Идентификаторы категорий в параметрах и теле запроса
+CATEGORY_FIELDS = ('category_id', 'parent_id', 'reassign_to')
+# Запросы, не требующие сессии
+PUBLIC_PATHS = ('/register', '/auth/login', '/auth/logout')
+# Сегменты пути, заменяемые в названии эндпоинта: числа и шестнадцатеричные идентификаторы
+ROUTE_ID = re.compile(r'^(\d+|[0-9a-f]{16,})$')
+
+
+# Загрузка запросов
+
+def load_postman(path):
+    """
+    Загрузка запросов коллекции Postman v2.1.
+
+    :param path: путь к файлу коллекции
+    :return: список запросов (method, path, body)
+    """
+    with open(path, encoding='utf-8') as file:
+        collection = json.load(file)
+    records = []
+
+    def walk(items):
+        for item in items:
+            if 'item' in item:
+                walk(item['item'])
+                continue
+            request = item.get('request') or {}
+            url = request.get('url') or {}
+            if isinstance(url, str):
+                parts = urlsplit(url)
+                target = parts.path + (f'?{parts.query}' if parts.query else '')
+            else:
+                target = '/' + '/'.join(url.get('path') or ())
+                query = [(param['key'], param.get('value') or '') for param in url.get('query') or ()
+                         if not param.get('disabled')]
+                if query:
+                    target += '?' + urlencode(query)
+            raw = ((request.get('body') or {}).get('raw') or '').strip()
+            records.append({'method': request.get('method', 'GET').upper(), 'path': target, 'body': parse_body(raw)})
+
+    walk(collection.get('item') or ())
+    return records
+
+
+def load_log(path):
+    """
+    Загрузка запросов журнала JSONL.
+
+    :param path: путь к файлу журнала
+    :return: (список запросов (method, path, body, user, ts), количество пропущенных строк)
+    """
+    records = []
+    skipped = 0
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            target = item.get('path') or item.get('url') if isinstance(item, dict) else None
+            if not target or not item.get('method'):
+                skipped += 1
+                continue
+            parts = urlsplit(target)
+            body = item.get('body')
+            record = {
+                'method': str(item['method']).upper(),
+                'path': parts.path + (f'?{parts.query}' if parts.query else ''),
+                'body': parse_body(body) if isinstance(body, str) else body,
+            }
+            if item.get('user') is not None:
+                record['user'] = item['user']
+            if item.get('ts') is not None:
+                record['ts'] = float(item['ts'])
+            records.append(record)
+    return records, skipped
+
+
+def parse_body(raw):
+    """
+    :param raw: тело запроса в виде строки
+    :return: разобранный JSON, исходная строка, если это не JSON, либо None для пустого тела
+    """
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw
+
+
+def route(method, path):
+    """
+    :param method: метод запроса
+    :param path: путь запроса
+    :return: название эндпоинта (метод и путь без параметров, идентификаторы заменены на <id>)
+    """
+    segments = urlsplit(path).path.split('/')
+    return f'{method} ' + '/'.join('<id>' if ROUTE_ID.match(segment) else segment for segment in segments)
+
+
+# Виртуальные пользователи
+
+class ReplayUser:
+    """
+    Виртуальный пользователь воспроизведения: собственная сессия и объекты, сопоставление
+    записанных идентификаторов идентификаторам его объектов.
+    """
+    def __init__(self, number, client, options, rnd):
+        self.number = number
+        self.client = client
+        self.options = options
+        self.rnd = rnd
+        self.email = f'replay-{options.seed}-{os.getpid()}-{number}@example.com'
+        self.pools = {'category': [], 'operation': [], 'job': []}
+        self.ids = {kind: {} for kind in self.pools}
+        self.logged_in = False
+        self.lock = threading.Lock()
+
+    def setup(self):
+        self.client.request('POST', '/register', {
+            'first_name': 'replay', 'last_name': 'replay', 'email': self.email, 'password': 'replay',
+        })
+        self.login()
+        if not self.logged_in:
+            return
+        for index in range(self.options.categories):
+            status, payload = self.client.request('POST', '/categories', {'name': f'replay-category-{index}'})
+            if status == 201:
+                self.pools['category'].append(json.loads(payload)['id'])
+        for index in range(self.options.operations):
+            self._seed_operation(index)
+
+    def login(self):
+        status, payload = self.client.request('POST', '/auth/login', {'email': self.email, 'password': 'replay'})
+        self.logged_in = status == 200
+        return status, payload
+
+    def _seed_operation(self, index):
+        data = {
+            'type': self.rnd.randint(0, 1),
+            'amount': f'{self.rnd.randint(1, 100000) / 100:.2f}',
+            'description': f'replay operation {index}',
+            'date': self.rnd.randint(1500000000, 1600000000),
+        }
+        if self.pools['category']:
+            data['category_id'] = self.rnd.choice(self.pools['category'])
+        status, payload = self.client.request('POST', '/transactions', data)
+        if status == 201:
+            self.pools['operation'].append(json.loads(payload)['id'])
+
+    def _map(self, kind, value):
+        """
+        Сопоставление записанного идентификатора идентификатору объекта пользователя.
+
+        :param kind: вид объекта
+        :param value: записанный идентификатор
+        :return: идентификатор объекта пользователя (записанный, если объектов этого вида нет)
+        """
+        if self.options.keep_ids or value is None or isinstance(value, bool):
+            return value
+        mapped = self.ids[kind].get(value)
+        if mapped is None:
+            if kind == 'operation' and not self.pools['operation']:
+                # Пополнение операций, удалённых воспроизведением (вне замеров)
+                self._seed_operation(0)
+            if not self.pools[kind]:
+                return value
+            mapped = self.ids[kind][value] = self.rnd.choice(self.pools[kind])
+        return mapped
+
+    def prepare(self, record, iteration):
+        """
+        Подготовка записанного запроса к отправке от имени пользователя.
+
+        :param record: записанный запрос
+        :param iteration: номер прохода журнала
+        :return: (метод, путь, тело, (вид, идентификатор) объекта из пути или None)
+        """
+        method = record['method']
+        parts = urlsplit(record['path'])
+        path = parts.path
+        target = None
+        for pattern, kind in PATH_IDS:
+            match = pattern.match(path)
+            if match:
+                value = match.group(1)
+                mapped = self._map(kind, int(value) if kind != 'job' else value)
+                path = path[:match.start(1)] + str(mapped) + path[match.end(1):]
+                target = (kind, mapped)
+                break
+        if parts.query:
+            query = [(key, str(self._map('category', int(value))) if key in CATEGORY_FIELDS and value.isdigit()
+                      else value) for key, value in parse_qsl(parts.query, keep_blank_values=True)]
+            path += '?' + urlencode(query)
+
+        body = record['body']
+        if isinstance(body, dict):
+            body = dict(body)
+            for field in CATEGORY_FIELDS:
+                if isinstance(body.get(field), int):
+                    body[field] = self._map('category', body[field])
+            suffix = f'{self.number}-{iteration}'
+            if path == '/auth/login':
+                body.update(email=self.email, password='replay')
+            elif path == '/register' and isinstance(body.get('email'), str):
+                body['email'] = f'replay-{self.options.seed}-{os.getpid()}-{suffix}-{body["email"]}'
+            elif path == '/categories' and method == 'POST' and isinstance(body.get('name'), str) and iteration:
+                body['name'] = f'{body["name"]} #{suffix}'
+        return method, path, body, target
+
+    def observe(self, method, path, status, payload, target):
+        """
+        Учёт ответа: сессия, созданные и удалённые объекты.
+        """
+        if path == '/auth/login':
+            self.logged_in = status == 200
+        elif path == '/auth/logout' and status == 200:
+            self.logged_in = False
+        elif method == 'POST' and status in (201, 202):
+            kind = {'/categories': 'category', '/transactions': 'operation', '/reports/jobs': 'job'}.get(path)
+            if kind:
+                self.pools[kind].append(json.loads(payload)['id'])
+        elif method == 'DELETE' and status == 200 and target:
+            kind, value = target
+            if value in self.pools[kind]:
+                self.pools[kind].remove(value)
+            self.ids[kind] = {key: mapped for key, mapped in self.ids[kind].items() if mapped != value}
+
+    def send(self, record, iteration):
+        """
+        Отправка записанного запроса.
+
+        :param record: записанный запрос
+        :param iteration: номер прохода журнала
+        :return: код ответа (0 при ошибке соединения)
+        """
+        path = urlsplit(record['path']).path
+        try:
+            if not self.logged_in and path not in PUBLIC_PATHS:
+                self.login()
+            method, target_path, body, target = self.prepare(record, iteration)
+            status, payload = self.client.request(method, target_path, body)
+            self.observe(method, path, status, payload, target)
+        except OSError:
+            status = 0
+        return status
+
+
+# Расписание и подача нагрузки
+
+def schedule(records, users, options):
+    """
+    Расписание отправки запросов.
+
+    :param records: записанные запросы
+    :param users: количество виртуальных пользователей
+    :param options: параметры воспроизведения
+    :return: генератор (момент отправки относительно начала, номер пользователя, запрос, номер прохода)
+    """
+    sessions = {}
+    if any('user' in record for record in records):
+        # Запросы одной записанной сессии выполняет один виртуальный пользователь
+        stream = [(sessions.setdefault(record.get('user'), len(sessions)) % users, record) for record in records]
+    else:
+        # Каждый виртуальный пользователь воспроизводит журнал целиком, пользователи чередуются
+        stream = [(number, record) for record in records for number in range(users)]
+
+    timed = options.rate is None and all('ts' in record for record in records)
+    rnd = random.Random(options.seed)
+    if timed:
+        start = min(record['ts'] for record in records)
+        span = (max(record['ts'] for record in records) - start) / options.speed
+        span += span / max(1, len(records) - 1)
+    rate = options.rate or 20
+    moment = 0.0
+    iteration = 0
+    while options.passes is None or iteration < options.passes:
+        for number, record in stream:
+            if timed:
+                moment = iteration * span + (record['ts'] - start) / options.speed
+            elif options.arrival == 'poisson':
+                moment += rnd.expovariate(rate)
+            else:
+                moment += 1 / rate
+            if moment >= options.duration:
+                return
+            yield moment, number, record, iteration
+        iteration += 1
+
+
+def replay(records, host, port, options):
+    """
+    Подготовка виртуальных пользователей и воспроизведение запросов по расписанию.
+
+    :param records: записанные запросы
+    :param host: адрес сервера
+    :param port: порт сервера
+    :param options: параметры воспроизведения
+    :return: (словарь {эндпоинт: [(задержка, ожидание отправки, код ответа)]}, длительность в секундах)
+    """
+    rnd = random.Random(options.seed)
+    users = [ReplayUser(number, Client(port, host), options, random.Random(rnd.random()))
+             for number in range(options.users)]
+    threads = [threading.Thread(target=user.setup) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    failed = sum(1 for user in users if not user.logged_in)
+    if failed:
+        raise RuntimeError(f'Не удалось войти в систему виртуальным пользователям: {failed}')
+
+    samples = defaultdict(list)
+    lock = threading.Lock()
+
+    def execute(user, record, iteration, scheduled):
+        with user.lock:
+            sent = perf_counter()
+            status = user.send(record, iteration)
+        finished = perf_counter()
+        with lock:
+            samples[route(record['method'], record['path'])].append((finished - scheduled, sent - scheduled, status))
+
+    started = perf_counter()
+    with ThreadPoolExecutor(options.concurrency) as executor:
+        for moment, number, record, iteration in schedule(records, len(users), options):
+            delay = started + moment - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            executor.submit(execute, users[number], record, iteration, started + moment)
+    return samples, perf_counter() - started
+
+
+def histogram(latencies):
+    """
+    :param latencies: задержки в секундах
+    :return: количество задержек по корзинам HISTOGRAM (последняя - больше последней границы)
+    """
+    counts = [0] * (len(HISTOGRAM) + 1)
+    for latency in latencies:
+        counts[bisect_left(HISTOGRAM, latency * 1e3)] += 1
+    return counts
+
+
+def summarize(samples, duration):
+    """
+    Сводка результатов по эндпоинтам.
+
+    :param samples: словарь {эндпоинт: [(задержка, ожидание отправки, код ответа)]}
+    :param duration: длительность воспроизведения в секундах
+    :return: словарь {эндпоинт: показатели}
+    """
+    result = {}
+    endpoints = sorted(samples)
+    for endpoint in [*endpoints, 'total']:
+        values = samples[endpoint] if endpoint != 'total' else [value for key in endpoints for value in samples[key]]
+        if not values:
+            continue
+        latencies = sorted(latency for latency, _, _ in values)
+        result[endpoint] = {
+            'requests': len(values),
+            'rps': len(values) / duration,
+            'statuses': dict(sorted(Counter(str(status) for _, _, status in values).items())),
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+            'send_delay_p99': percentile(sorted(delay for _, delay, _ in values), 0.99),
+            'histogram': histogram(latencies),
+        }
+    return result
+
+
+def print_results(results):
+    width = max(len(endpoint) for endpoint in results['endpoints'])
+    print(f'{"endpoint":<{width}} {"count":>7} {"rps":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}  '
+          f'statuses')
+    for endpoint, item in results['endpoints'].items():
+        statuses = ' '.join(f'{status}:{count}' for status, count in item['statuses'].items())
+        print(f'{endpoint:<{width}} {item["requests"]:>7} {item["rps"]:>8.1f} {item["p50"] * 1e3:>8.1f} '
+              f'{item["p95"] * 1e3:>8.1f} {item["p99"] * 1e3:>8.1f} {item["max"] * 1e3:>8.1f}  {statuses}')
+    print()
+    print(f'{"latency, ms":<{width}} ' + ' '.join(f'{"<=" + str(bound):>6}' for bound in HISTOGRAM) + f' {">5000":>6}')
+    for endpoint, item in results['endpoints'].items():
+        print(f'{endpoint:<{width}} ' + ' '.join(f'{count:>6}' for count in item['histogram']))
+    total = results['endpoints'].get('total')
+    if total:
+        print(f'\np99 send delay (generator saturation): {total["send_delay_p99"] * 1e3:.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--postman', action='append', default=[], help='коллекция Postman v2.1')
+    parser.add_argument('--log', action='append', default=[], help='журнал запросов JSONL')
+    parser.add_argument('--url', help='адрес запущенного сервера (по умолчанию запускается локальный)')
+    parser.add_argument('--users', type=int, default=8, help='количество виртуальных пользователей')
+    parser.add_argument('--rate', type=float, help='запросов в секунду (по умолчанию - по меткам ts либо 20)')
+    parser.add_argument('--arrival', choices=('uniform', 'poisson'), default='uniform')
+    parser.add_argument('--speed', type=float, default=1.0, help='ускорение воспроизведения по меткам ts')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--passes', type=int, help='количество проходов журнала')
+    parser.add_argument('--concurrency', type=int, default=64, help='максимум одновременных запросов')
+    parser.add_argument('--categories', type=int, default=5, help='категорий виртуального пользователя')
+    parser.add_argument('--operations', type=int, default=20, help='операций виртуального пользователя')
+    parser.add_argument('--keep-ids', action='store_true', help='не заменять записанные идентификаторы')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server', choices=('threaded', 'processes'), default='threaded')
+    parser.add_argument('--workers', type=int, default=4, help='количество процессов сервера (--server processes)')
+    parser.add_argument('--env', action='append', default=[], help='параметр локального приложения KEY=VALUE')
+    parser.add_argument('--output', help='сохранить результаты в JSON-файл')
+    options = parser.parse_args()
+
+    records = []
+    for path in options.postman:
+        records.extend(load_postman(path))
+    for path in options.log:
+        loaded, skipped = load_log(path)
+        records.extend(loaded)
+        if skipped:
+            print(f'{path}: пропущено строк без запроса: {skipped}', file=sys.stderr)
+    if not records:
+        parser.error('нет запросов для воспроизведения (--postman, --log)')
+
+    if options.url:
+        parts = urlsplit(options.url)
+        server = nullcontext(parts.port or 80)
+        host = parts.hostname
+    else:
+        env = dict(item.partition('=')[::2] for item in options.env)
+        server = local_server(options.server, options.workers, env)
+        host = '127.0.0.1'
+    with server as port:
+        samples, duration = replay(records, host, port, options)
+
+    results = {
+        'options': dict(vars(options)),
+        'duration': duration,
+        'endpoints': summarize(samples, duration),
+    }
+    print_results(results)
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(results, file, indent=2, ensure_ascii=False)
+            file.write('\n')
+
+
+if __name__ == '__main__':
+    main()
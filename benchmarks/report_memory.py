@@ -0,0 +1,130 @@
+"""
+Бенчмарк памяти страницы отчёта по операциям (tracemalloc): удерживаемый объём и пик выделений
+на одну операцию для компактных моделей отчёта (Operation в слотах, общий путь категорий операций
+одной категории) и для прежнего представления - словаря на каждую операцию с собственной копией
+пути категорий (воспроизводится разбором сериализованного отчёта).
+
+Запуск из корня проекта:
+    $ python benchmarks/report_memory.py --depth 6 --page-size 100 --page-size 1000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from werkzeug.datastructures import MultiDict  # noqa: E402
+
+
+def measure(build):
+    """
+    Измерение удерживаемого объёма и пика выделений при построении объекта.
+
+    :param build: функция построения объекта
+    :return: (объект, удерживаемый объём в байтах, пик выделений в байтах)
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, retained, peak
+
+
+def run(database, engine, depth, operations, page_sizes, seed):
+    os.environ['DB_CONNECTION'] = database
+    os.environ['STORAGE_ENGINE'] = engine
+    os.environ['PASSWORD_HASH_WORKERS'] = '0'
+
+    from app import create_app
+    from database import db
+    from services.categories import CategoriesService
+    from services.register import RegisterService
+    from services.serialization import json_dumps
+    from services.transactions import TransactionsService
+
+    app = create_app()
+    rnd = random.Random(seed)
+    results = []
+
+    with app.test_request_context():
+        with db.connection as connection:
+            user = RegisterService(connection).register({
+                'first_name': 'bench', 'last_name': 'bench',
+                'email': f'bench-memory-{engine}-{seed}@example.com', 'password': 'bench',
+            })
+        user_id = user['id']
+
+        # Несколько веток дерева категорий заданной глубины
+        leaves = []
+        with db.shard(user_id) as connection:
+            service = CategoriesService(connection)
+            for branch in range(4):
+                parent_id = None
+                for level in range(depth):
+                    data = {'name': f'category-{branch}-{level}', 'user_id': user_id}
+                    if parent_id is not None:
+                        data['parent_id'] = parent_id
+                    parent_id = service.create_category(data)['id']
+                leaves.append(parent_id)
+
+        with db.shard(user_id) as connection:
+            service = TransactionsService(connection)
+            for index in range(operations):
+                service.add_transaction({
+                    'user_id': user_id,
+                    'type': rnd.randint(0, 1),
+                    'amount': f'{rnd.randint(1, 100000) / 100:.2f}',
+                    'category_id': rnd.choice(leaves),
+                    'description': f'operation {index}',
+                    'date': 1500000000 + index,
+                })
+
+        for page_size in page_sizes:
+            filters = MultiDict({'page_size': str(page_size), 'running_balance': 'true'})
+            with db.read_shard(user_id) as connection:
+                service = TransactionsService(connection)
+                # Прогрев: соединение, подготовленные выражения и архивы не учитываются в измерении
+                service.get_transaction(filters, user_id, links=False)
+                report, retained, peak = measure(lambda: service.get_transaction(filters, user_id, links=False))
+            rows = len(report['operations'])
+            body = json_dumps(report)
+            _, dict_retained, _ = measure(lambda: json.loads(body))
+            results.append((page_size, rows, retained / rows, peak / rows, dict_retained / rows))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engine', choices=('sqlite', 'memory'), default='sqlite')
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--operations', type=int, default=2000)
+    parser.add_argument('--page-size', type=int, action='append')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    page_sizes = args.page_size or (100, 1000)
+
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example.db')
+    directory = tempfile.mkdtemp()
+    try:
+        database = os.path.join(directory, 'bench.db')
+        shutil.copy(source, database)
+        results = run(database, args.engine, args.depth, args.operations, page_sizes, args.seed)
+    finally:
+        shutil.rmtree(directory)
+
+    print(f'{"page_size":>9} {"rows":>6} {"models B/row":>13} {"peak B/row":>11} {"dicts B/row":>12}')
+    for page_size, rows, retained, peak, dict_retained in results:
+        print(f'{page_size:>9} {rows:>6} {retained:>13.0f} {peak:>11.0f} {dict_retained:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Бенчмарк формата ответа отчёта по операциям: размер ответа и время сериализации
+для полного формата (путь категорий в каждой операции) и компактного формата (format=compact),
+стандартным кодировщиком JSON и orjson (если установлен).
+
+Запуск из корня проекта:
+    $ python benchmarks/report_payload.py --depth 6 --page-size 20 --page-size 200
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from werkzeug.datastructures import MultiDict  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def build_reports(database, depth, operations, page_sizes, seed):
+    os.environ['DB_CONNECTION'] = database
+    os.environ['PASSWORD_HASH_WORKERS'] = '0'
+
+    from app import create_app
+    from database import db
+    from services.categories import CategoriesService
+    from services.register import RegisterService
+    from services.transactions import TransactionsService
+
+    app = create_app()
+    rnd = random.Random(seed)
+    reports = {}
+
+    with app.test_request_context():
+        with db.connection as connection:
+            user = RegisterService(connection).register({
+                'first_name': 'bench', 'last_name': 'bench',
+                'email': f'bench-payload-{seed}@example.com', 'password': 'bench',
+            })
+        user_id = user['id']
+
+        # Несколько веток дерева категорий заданной глубины
+        leaves = []
+        with db.shard(user_id) as connection:
+            service = CategoriesService(connection)
+            for branch in range(4):
+                parent_id = None
+                for level in range(depth):
+                    data = {'name': f'category-{branch}-{level}', 'user_id': user_id}
+                    if parent_id is not None:
+                        data['parent_id'] = parent_id
+                    parent_id = service.create_category(data)['id']
+                leaves.append(parent_id)
+
+        with db.shard(user_id) as connection:
+            service = TransactionsService(connection)
+            for index in range(operations):
+                service.add_transaction({
+                    'user_id': user_id,
+                    'type': rnd.randint(0, 1),
+                    'amount': f'{rnd.randint(1, 100000) / 100:.2f}',
+                    'category_id': rnd.choice(leaves),
+                    'description': f'operation {index}',
+                    'date': 1500000000 + index,
+                })
+
+        for page_size in page_sizes:
+            for report_format in ('full', 'compact'):
+                filters = MultiDict({'page_size': str(page_size), 'format': report_format})
+                with db.read_shard(user_id) as connection:
+                    reports[(page_size, report_format)] = TransactionsService(connection).get_transaction(
+                        filters, user_id
+                    )
+    return reports
+
+
+def measure(encode, report, repeat):
+    body = encode(report)
+    started = perf_counter()
+    for _ in range(repeat):
+        encode(report)
+    return len(body), (perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--operations', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, action='append')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    page_sizes = args.page_size or (20, 200)
+
+    from services.serialization import json_default
+
+    encoders = {
+        'json': lambda data: json.dumps(data, sort_keys=True, separators=(',', ':'), default=json_default).encode(),
+    }
+    if orjson is not None:
+        encoders['orjson'] = lambda data: orjson.dumps(data, default=json_default, option=orjson.OPT_SORT_KEYS)
+
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example.db')
+    directory = tempfile.mkdtemp()
+    try:
+        database = os.path.join(directory, 'bench.db')
+        shutil.copy(source, database)
+        reports = build_reports(database, args.depth, args.operations, page_sizes, args.seed)
+    finally:
+        shutil.rmtree(directory)
+
+    print(f'{"page_size":>9} {"format":<8} {"encoder":<7} {"bytes":>9} {"us/op":>10}')
+    for (page_size, report_format), report in reports.items():
+        for name, encode in encoders.items():
+            size, seconds = measure(encode, report, args.repeat)
+            print(f'{page_size:>9} {report_format:<8} {name:<7} {size:>9} {seconds * 1e6:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
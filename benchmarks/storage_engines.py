@@ -0,0 +1,110 @@
+"""
+Бенчмарк сервисов поверх разных движков хранения (SQLite и хранение в памяти).
+Позволяет отделить стоимость бизнес-логики сервисов от стоимости хранения данных.
+
+Запуск из корня проекта:
+    $ python benchmarks/storage_engines.py --operations 5000 --reports 200
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from werkzeug.datastructures import MultiDict  # noqa: E402
+
+
+def run(engine, database, operations, reports, seed):
+    os.environ['DB_CONNECTION'] = database
+    os.environ['STORAGE_ENGINE'] = engine
+    os.environ['PASSWORD_HASH_WORKERS'] = '0'
+
+    from app import create_app
+    from database import db
+    from services.categories import CategoriesService
+    from services.register import RegisterService
+    from services.transactions import TransactionsService
+
+    app = create_app()
+    rnd = random.Random(seed)
+    timings = {}
+
+    with app.test_request_context():
+        with db.connection as connection:
+            user = RegisterService(connection).register({
+                'first_name': 'bench', 'last_name': 'bench',
+                'email': f'bench-{engine}-{seed}@example.com', 'password': 'bench',
+            })
+        user_id = user['id']
+
+        with db.shard(user_id) as connection:
+            service = CategoriesService(connection)
+            categories = []
+            for index in range(20):
+                parent_id = rnd.choice(categories) if categories and index % 3 else None
+                data = {'name': f'category-{index}', 'user_id': user_id}
+                if parent_id is not None:
+                    data['parent_id'] = parent_id
+                categories.append(service.create_category(data)['id'])
+
+        started = perf_counter()
+        for _ in range(operations):
+            with db.shard(user_id) as connection:
+                TransactionsService(connection).add_transaction({
+                    'user_id': user_id,
+                    'type': rnd.randint(0, 1),
+                    'amount': f'{rnd.randint(1, 100000) / 100:.2f}',
+                    'category_id': rnd.choice(categories + [None]),
+                    'date': rnd.randint(1500000000, 1600000000),
+                })
+        timings['add_transaction'] = (perf_counter() - started) / operations
+
+        started = perf_counter()
+        for _ in range(reports):
+            filters = MultiDict({'page_size': '50', 'category_id': str(rnd.choice(categories))})
+            with db.read_shard(user_id) as connection:
+                try:
+                    TransactionsService(connection).get_transaction(filters, user_id)
+                except Exception:
+                    pass
+        timings['get_transaction'] = (perf_counter() - started) / reports
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operations', type=int, default=2000)
+    parser.add_argument('--reports', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--engine', choices=('sqlite', 'memory'), action='append')
+    args = parser.parse_args()
+
+    # Настройки приложения читаются при импорте, поэтому каждый движок измеряется в отдельном процессе
+    engines = args.engine or ('sqlite', 'memory')
+    if len(engines) > 1:
+        for engine in engines:
+            subprocess.run([sys.executable, __file__, '--engine', engine, '--operations', str(args.operations),
+                            '--reports', str(args.reports), '--seed', str(args.seed)], check=True)
+        return
+
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example.db')
+    for engine in engines:
+        directory = tempfile.mkdtemp()
+        try:
+            database = os.path.join(directory, 'bench.db')
+            shutil.copy(source, database)
+            timings = run(engine, database, args.operations, args.reports, args.seed)
+        finally:
+            shutil.rmtree(directory)
+        for name, seconds in timings.items():
+            print(f'{engine:>8} {name:<16} {seconds * 1e6:10.1f} us/op')
+
+
+if __name__ == '__main__':
+    main()
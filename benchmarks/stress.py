@@ -0,0 +1,575 @@
+"""
+Нагрузочный стенд для воспроизведения конкуренции за блокировки БД и хвостовых задержек.
+
+Приложение (create_app) запускается в отдельном процессе многопоточным WSGI-сервером werkzeug
+(--server threaded) либо несколькими процессами с общим слушающим сокетом (--server processes,
+только POSIX), на копии example.db. Виртуальные пользователи регистрируются, входят в систему
+и в замкнутом цикле выполняют смесь запросов (регистрация, вход, категории, операции, отчёты)
+в заданных пропорциях. По каждому виду запросов выводятся p50/p95/p99 задержки и доля ошибок,
+по серверу - количество ошибок "database is locked", ожиданий и истечений ожидания соединений пулов,
+отклонённых по стоимости отчётов.
+
+Параметры нагрузки сохраняются в JSON-сценарий (--save) и загружаются из него (--scenario),
+результаты - в JSON (--output). При указании --baseline результаты сравниваются с сохранёнными ранее:
+при росте p95/p99 или доли ошибок больше допустимого (--tolerance) скрипт завершается с кодом 1.
+
+Запуск из корня проекта:
+    $ python benchmarks/stress.py --scenario benchmarks/scenarios/mixed.json
+    $ python benchmarks/stress.py --users 32 --duration 60 --mix report=5,add_operation=3 --save my.json
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from time import monotonic, perf_counter, sleep
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# Параметры сценария по умолчанию
+DEFAULT_SCENARIO = {
+    'users': 16,
+    'duration': 30,
+    'think': 0,
+    'seed': 1,
+    'server': 'threaded',
+    'workers': 4,
+    'env': {},
+    'setup': {'categories': 5, 'operations': 200},
+    'report': {'page_size': 50},
+    'mix': {
+        'register': 1,
+        'login': 1,
+        'create_category': 2,
+        'add_operation': 20,
+        'patch_operation': 5,
+        'delete_operation': 3,
+        'report': 20,
+    },
+}
+
+# Счётчики сервера: ошибки блокировки БД, истечения ожидания соединения пула, прочие ошибки, ожидания пулов,
+# отклонённые по стоимости отчёты
+SERVER_COUNTERS = ('lock_errors', 'pool_timeouts', 'errors', 'pool_waits', 'report_throttled')
+STATS_PATH = '/__stress__/stats'
+
+
+# Сервер
+
+class ErrorCounter(logging.Handler):
+    """
+    Обработчик журнала приложения, классифицирующий необработанные исключения запросов.
+    """
+    def __init__(self, counters):
+        super().__init__(logging.ERROR)
+        self.counters = counters
+
+    def emit(self, record):
+        import sqlite3
+
+        error = record.exc_info[1] if record.exc_info else None
+        if isinstance(error, sqlite3.OperationalError) and 'locked' in str(error):
+            self.counters.add('lock_errors')
+        else:
+            self.counters.add('errors')
+
+
+class SharedCounters:
+    """
+    Счётчики сервера в общей памяти процессов (у каждого процесса-обработчика - своя строка).
+    """
+    def __init__(self, workers):
+        import multiprocessing
+
+        self.array = multiprocessing.Array('q', workers * len(SERVER_COUNTERS))
+        self.row = 0
+
+    def add(self, name, value=1):
+        index = self.row * len(SERVER_COUNTERS) + SERVER_COUNTERS.index(name)
+        with self.array.get_lock():
+            self.array[index] += value
+
+    def set(self, name, value):
+        index = self.row * len(SERVER_COUNTERS) + SERVER_COUNTERS.index(name)
+        with self.array.get_lock():
+            self.array[index] = value
+
+    def totals(self):
+        with self.array.get_lock():
+            values = list(self.array)
+        size = len(SERVER_COUNTERS)
+        return {name: sum(values[index::size]) for index, name in enumerate(SERVER_COUNTERS)}
+
+
+def instrument(app, counters):
+    """
+    Обёртка приложения: учёт ошибок и ожиданий пулов соединений, выдача счётчиков по STATS_PATH.
+
+    :param app: приложение Flask
+    :param counters: счётчики сервера
+    :return: WSGI-приложение
+    """
+    from database import db
+    from services.admission import report_admission
+
+    app.logger.addHandler(ErrorCounter(counters))
+
+    def application(environ, start_response):
+        if environ.get('PATH_INFO') == STATS_PATH:
+            body = json.dumps(counters.totals()).encode()
+            start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+            return [body]
+        try:
+            return app.wsgi_app(environ, start_response)
+        finally:
+            pools = list(db._pools.values())
+            counters.set('pool_waits', sum(pool.waits for pool in pools))
+            # Исчерпание пула обрабатывается приложением (ответ 503) и учитывается по счётчику пулов
+            counters.set('pool_timeouts', sum(pool.timeouts for pool in pools))
+            metrics = report_admission.metrics()
+            counters.set('report_throttled', metrics['throttled_concurrency'] + metrics['throttled_budget'])
+
+    return application
+
+
+def serve(port, server, workers):
+    """
+    Запуск приложения WSGI-сервером werkzeug (выполняется в отдельном процессе стенда).
+
+    :param port: порт
+    :param server: threaded - один многопоточный процесс, processes - workers многопоточных процессов
+    :param workers: количество процессов
+    :return: nothing
+    """
+    sys.path.insert(0, SRC)
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    workers = workers if server == 'processes' else 1
+    counters = SharedCounters(workers)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(128)
+
+    # Приложение создаётся в каждом процессе после fork: пулы соединений не разделяются между процессами
+    for row in range(1, workers):
+        if os.fork() == 0:
+            counters.row = row
+            break
+
+    from app import create_app
+
+    application = instrument(create_app(), counters)
+    make_server('127.0.0.1', port, application, threaded=True, request_handler=QuietHandler,
+                fd=listener.fileno()).serve_forever()
+
+
+# Клиент
+
+class Client:
+    """
+    HTTP-клиент виртуального пользователя с хранением cookie сессии.
+    Тело запроса - данные для сериализации в JSON либо уже сериализованная строка.
+    """
+    def __init__(self, port, host='127.0.0.1'):
+        self.host = host
+        self.port = port
+        self.cookies = {}
+
+    def request(self, method, path, data=None, headers=None):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = dict(headers or {})
+        body = None
+        if data is not None:
+            body = data if isinstance(data, str) else json.dumps(data)
+            headers['Content-Type'] = 'application/json'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{key}={value}' for key, value in self.cookies.items())
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            payload = response.read()
+            for header in response.headers.get_all('Set-Cookie') or ():
+                key, _, value = header.split(';', 1)[0].partition('=')
+                self.cookies[key.strip()] = value
+            return response.status, payload
+        finally:
+            connection.close()
+
+
+class VirtualUser:
+    """
+    Виртуальный пользователь: собственная учётная запись, категории и операции.
+    """
+    def __init__(self, number, port, scenario, rnd):
+        self.number = number
+        self.scenario = scenario
+        self.rnd = rnd
+        self.client = Client(port)
+        self.email = f'stress-{scenario["seed"]}-{os.getpid()}-{number}@example.com'
+        self.categories = []
+        self.operations = []
+        self.sequence = 0
+        self.ready = False
+
+    def setup(self):
+        self.client.request('POST', '/register', self._credentials())
+        status, _ = self.login()
+        if status != 200:
+            return
+        for _ in range(self.scenario['setup']['categories']):
+            self.create_category()
+        for _ in range(self.scenario['setup']['operations']):
+            self.add_operation()
+        self.ready = True
+
+    def _credentials(self, email=None):
+        return {'first_name': 'stress', 'last_name': 'stress', 'email': email or self.email, 'password': 'stress'}
+
+    def _name(self):
+        self.sequence += 1
+        return f'{self.number}-{self.sequence}'
+
+    def register(self):
+        return self.client.request('POST', '/register', self._credentials(f'stress-{self._name()}-{self.email}'))
+
+    def login(self):
+        return self.client.request('POST', '/auth/login', {'email': self.email, 'password': 'stress'})
+
+    def create_category(self):
+        data = {'name': f'category-{self._name()}'}
+        if self.categories and self.rnd.random() < 0.5:
+            data['parent_id'] = self.rnd.choice(self.categories)
+        status, payload = self.client.request('POST', '/categories', data)
+        if status == 201:
+            self.categories.append(json.loads(payload)['id'])
+        return status, payload
+
+    def _operation(self):
+        data = {
+            'type': self.rnd.randint(0, 1),
+            'amount': f'{self.rnd.randint(1, 100000) / 100:.2f}',
+            'description': f'operation {self._name()}',
+            'date': self.rnd.randint(1500000000, 1600000000),
+        }
+        if self.categories:
+            data['category_id'] = self.rnd.choice(self.categories)
+        return data
+
+    def add_operation(self):
+        status, payload = self.client.request('POST', '/transactions', self._operation())
+        if status == 201:
+            self.operations.append(json.loads(payload)['id'])
+        return status, payload
+
+    def patch_operation(self):
+        if not self.operations:
+            return self.add_operation()
+        # Изменение операции заменяет все её поля
+        operation_id = self.rnd.choice(self.operations)
+        return self.client.request('PATCH', f'/transactions/{operation_id}', self._operation())
+
+    def delete_operation(self):
+        if not self.operations:
+            return self.add_operation()
+        operation_id = self.operations.pop(self.rnd.randrange(len(self.operations)))
+        return self.client.request('DELETE', f'/transactions/{operation_id}')
+
+    def report(self):
+        params = dict(self.scenario['report'])
+        if self.categories and self.rnd.random() < 0.5:
+            params['category_id'] = self.rnd.choice(self.categories)
+        query = '&'.join(f'{key}={value}' for key, value in params.items())
+        return self.client.request('GET', f'/transactions?{query}')
+
+
+ACTIONS = ('register', 'login', 'create_category', 'add_operation', 'patch_operation', 'delete_operation', 'report')
+
+
+def percentile(values, share):
+    """
+    Перцентиль (по ближайшему рангу) отсортированного списка.
+
+    :param values: отсортированный список
+    :param share: доля (0..1)
+    :return: значение перцентиля или None для пустого списка
+    """
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(share * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def drive(port, scenario):
+    """
+    Подготовка данных виртуальных пользователей и подача нагрузки в течение заданного времени.
+
+    :param port: порт сервера
+    :param scenario: сценарий
+    :return: (словарь {вид запроса: [(задержка в секундах, код ответа или 0 при ошибке соединения)]},
+             длительность нагрузки в секундах)
+    """
+    rnd = random.Random(scenario['seed'])
+    users = [VirtualUser(number, port, scenario, random.Random(rnd.random())) for number in range(scenario['users'])]
+    threads = [threading.Thread(target=user.setup) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    failed = sum(1 for user in users if not user.ready)
+    if failed:
+        raise RuntimeError(f'Не удалось войти в систему виртуальным пользователям: {failed}')
+
+    actions = [action for action in ACTIONS if scenario['mix'].get(action)]
+    weights = [scenario['mix'][action] for action in actions]
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    started = monotonic()
+    deadline = started + scenario['duration']
+
+    def loop(user):
+        local = defaultdict(list)
+        while monotonic() < deadline:
+            action = user.rnd.choices(actions, weights)[0]
+            started = perf_counter()
+            try:
+                status, _ = getattr(user, action)()
+            except OSError:
+                status = 0
+            local[action].append((perf_counter() - started, status))
+            if scenario['think']:
+                sleep(scenario['think'])
+        with lock:
+            for action, values in local.items():
+                samples[action].extend(values)
+
+    threads = [threading.Thread(target=loop, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, monotonic() - started
+
+
+def summarize(samples, duration):
+    """
+    Сводка результатов по видам запросов.
+
+    :param samples: словарь {вид запроса: [(задержка, код ответа)]}
+    :param duration: длительность нагрузки в секундах
+    :return: словарь {вид запроса: показатели}
+    """
+    result = {}
+    for action in [*ACTIONS, 'total']:
+        values = samples.get(action) if action != 'total' else [value for items in samples.values() for value in items]
+        if not values:
+            continue
+        latencies = sorted(latency for latency, _ in values)
+        errors = sum(1 for _, status in values if status == 0 or status >= 500)
+        result[action] = {
+            'requests': len(values),
+            'rps': len(values) / duration,
+            'error_rate': errors / len(values),
+            'client_errors': sum(1 for _, status in values if 400 <= status < 500),
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+        }
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Сравнение результатов с сохранёнными ранее.
+
+    :param results: результаты текущего запуска
+    :param baseline: сохранённые результаты
+    :param tolerance: допустимый относительный рост задержек
+    :return: список описаний регрессий
+    """
+    regressions = []
+    for action, current in results['requests'].items():
+        previous = baseline['requests'].get(action)
+        if previous is None:
+            continue
+        for metric in ('p95', 'p99'):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f'{action} {metric}: {previous[metric] * 1e3:.1f} -> {current[metric] * 1e3:.1f} ms')
+        if current['error_rate'] > previous['error_rate'] + 0.01:
+            regressions.append(f'{action} error_rate: {previous["error_rate"]:.2%} -> {current["error_rate"]:.2%}')
+    for name in ('lock_errors', 'pool_timeouts', 'errors'):
+        if results['server'].get(name, 0) > baseline['server'].get(name, 0):
+            regressions.append(f'server {name}: {baseline["server"].get(name, 0)} -> {results["server"][name]}')
+    return regressions
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(port, process, timeout=30):
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Сервер завершился при запуске')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            sleep(0.1)
+    raise RuntimeError('Сервер не запустился')
+
+
+@contextmanager
+def local_server(server='threaded', workers=1, env=None):
+    """
+    Контекстный менеджер запуска приложения в отдельном процессе на копии example.db.
+
+    :param server: threaded - один многопоточный процесс, processes - workers многопоточных процессов
+    :param workers: количество процессов сервера
+    :param env: дополнительные параметры приложения (переменные окружения)
+    :return: порт сервера
+    """
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example.db')
+    directory = tempfile.mkdtemp()
+    port = free_port()
+    try:
+        database = os.path.join(directory, 'stress.db')
+        shutil.copy(source, database)
+        environ = dict(os.environ, PYTHONPATH=SRC, DB_CONNECTION=database,
+                       DB_SHARD_PATH=os.path.join(directory, 'shard_{generation}_{index}.db'),
+                       DB_ARCHIVE_PATH=os.path.join(directory, '{database}_archive.db'),
+                       REPORT_JOBS_DB=os.path.join(directory, 'report_jobs.db'))
+        environ.update({key: str(value) for key, value in (env or {}).items()})
+        with open(os.path.join(directory, 'server.log'), 'wb') as log:
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '--serve', str(port),
+                 '--server', server, '--workers', str(workers)],
+                cwd=SRC, env=environ, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+            )
+            try:
+                wait_ready(port, process)
+                yield port
+            finally:
+                os.killpg(process.pid, signal.SIGTERM)
+                process.wait()
+    finally:
+        shutil.rmtree(directory)
+
+
+def server_stats(port, host='127.0.0.1'):
+    """
+    Счётчики сервера, запущенного стендом (см. instrument).
+
+    :param port: порт сервера
+    :param host: адрес сервера
+    :return: словарь счётчиков
+    """
+    _, payload = Client(port, host).request('GET', STATS_PATH)
+    return json.loads(payload)
+
+
+def run(scenario):
+    """
+    Запуск сервера на копии БД, подача нагрузки и сбор результатов.
+
+    :param scenario: сценарий
+    :return: результаты (сценарий, показатели запросов, счётчики сервера)
+    """
+    with local_server(scenario['server'], scenario['workers'], scenario['env']) as port:
+        samples, duration = drive(port, scenario)
+        server = server_stats(port)
+    return {'scenario': scenario, 'requests': summarize(samples, duration), 'server': server}
+
+
+def print_results(results):
+    print(f'{"request":<17} {"count":>7} {"rps":>8} {"err%":>6} {"4xx":>6} '
+          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for action, item in results['requests'].items():
+        print(f'{action:<17} {item["requests"]:>7} {item["rps"]:>8.1f} {item["error_rate"] * 100:>6.2f} '
+              f'{item["client_errors"]:>6} {item["p50"] * 1e3:>8.1f} {item["p95"] * 1e3:>8.1f} '
+              f'{item["p99"] * 1e3:>8.1f} {item["max"] * 1e3:>8.1f}')
+    print('server: ' + ', '.join(f'{name}={value}' for name, value in results['server'].items()))
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        action, _, weight = item.partition('=')
+        if action not in ACTIONS:
+            raise argparse.ArgumentTypeError(f'неизвестный вид запроса: {action}')
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', help='JSON-файл сценария')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--duration', type=float)
+    parser.add_argument('--think', type=float, help='пауза виртуального пользователя между запросами, с')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--server', choices=('threaded', 'processes'))
+    parser.add_argument('--workers', type=int, help='количество процессов сервера (--server processes)')
+    parser.add_argument('--mix', type=parse_mix, help='пропорции запросов, например report=5,add_operation=3')
+    parser.add_argument('--env', action='append', default=[], help='параметр приложения KEY=VALUE')
+    parser.add_argument('--save', help='сохранить сценарий в JSON-файл')
+    parser.add_argument('--output', help='сохранить результаты в JSON-файл')
+    parser.add_argument('--baseline', help='JSON-файл результатов для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимый рост p95/p99 (доля)')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.server, args.workers)
+        return
+
+    scenario = json.loads(json.dumps(DEFAULT_SCENARIO))
+    if args.scenario:
+        with open(args.scenario) as file:
+            scenario.update(json.load(file))
+    for key in ('users', 'duration', 'think', 'seed', 'server', 'workers', 'mix'):
+        if getattr(args, key) is not None:
+            scenario[key] = getattr(args, key)
+    for item in args.env:
+        key, _, value = item.partition('=')
+        scenario['env'][key] = value
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(scenario, file, indent=2)
+            file.write('\n')
+
+    results = run(scenario)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+            file.write('\n')
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f'regression: {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,17 @@
+from blueprints.analytics import bp as analytics_bp
 from blueprints.auth import bp as auth_bp
 from blueprints.categories import bp as categories_bp
 from blueprints.register import bp as register_bp
+from blueprints.reports import bp as reports_bp
 from blueprints.transactions import bp as transactions_bp
+from commands import archive_cli, categories_cli, maintenance_cli, shards_cli
 from database import db
 from flask import Flask
+from services.admission import report_admission
+from services.passwords import hasher
+from services.report_jobs import report_jobs
+from services.serialization import JSONEncoder
+from services.storage import load_memory_storage
 
 
 def create_app():
@@ -14,12 +22,22 @@ def create_app():
     """
     app = Flask(__name__)
     app.config.from_object('config.Config')
+    app.json_encoder = JSONEncoder
     app.register_blueprint(categories_bp, url_prefix='/categories')
     app.register_blueprint(register_bp, url_prefix='/register')
     app.register_blueprint(transactions_bp, url_prefix='/transactions')
     app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(analytics_bp, url_prefix='/analytics')
+    app.register_blueprint(reports_bp, url_prefix='/reports')
     app.register_blueprint(transactions_bp, url_prefix='/transactions')
 
-    db.init_app(app)
+    db.init_app(app, load_memory_storage)
+    hasher.init_app(app)
+    report_jobs.init_app(app)
+    report_admission.init_app(app)
+    app.cli.add_command(shards_cli)
+    app.cli.add_command(archive_cli)
+    app.cli.add_command(maintenance_cli)
+    app.cli.add_command(categories_cli)
 
     return app
@@ -0,0 +1,51 @@
+from database import db
+from flask import (
+    Blueprint,
+    request,
+    jsonify
+)
+from flask.views import MethodView
+from services.analytics import (
+    AnalyticsService,
+    AnalyticsInvalidParameterError
+)
+from services.decorators import auth_required
+from services.transactions import (
+    CategoryDoesNotExistError,
+    CategoryAccessDeniedError,
+    TransactionInvalidPeriodError
+)
+
+bp = Blueprint('analytics', __name__)
+
+
+class AnalyticsView(MethodView):
+    """
+    Класс, представляющий часть API, отвечающую за аналитику по операциям пользователя.
+    """
+    @auth_required
+    def get(self, user):
+        """
+        Обработчик GET-запроса на получение аналитики по операциям.
+
+        :param user: параметры авторизации
+        :return: сформированный ответ
+        """
+        query_str = request.args
+        with db.read_shard(user['id']) as connection:
+            service = AnalyticsService(connection)
+            try:
+                analytics = service.get_analytics(query_str, user['id'])
+            except CategoryDoesNotExistError:
+                return '', 404
+            except CategoryAccessDeniedError:
+                return '', 403
+            except TransactionInvalidPeriodError:
+                return '', 400
+            except AnalyticsInvalidParameterError:
+                return '', 400
+            else:
+                return jsonify(analytics), 200, {'Content-Type': 'application/json'}
+
+
+bp.add_url_rule('', view_func=AnalyticsView.as_view('analytics'))
@@ -9,6 +9,7 @@ from services.auth import (
     AuthorizationFailedError,
     UserDoesNotExistError
 )
+from services.passwords import PasswordHasherOverloadedError
 
 bp = Blueprint('auth', __name__)
 
@@ -28,18 +29,23 @@ def login():
 
     email = data.get('email')
     password = data.get('password')
-    with db.connection as con:
-        service = AuthService(con)
-        # Попытка авторизации
-        try:
-            user_id = service.login(email, password)
-        except UserDoesNotExistError:
-            return '', 401
-        except AuthorizationFailedError:
-            return '', 401
-        else:
-            session['user_id'] = user_id
-            return '', 200
+    # Попытка авторизации: соединения с БД берутся только на время поиска пользователя
+    # и записи пересчитанного хеша, проверка пароля выполняется без соединения
+    try:
+        with db.transient(read_only=True) as con:
+            user = AuthService(con).find_user(email)
+        password_hash = AuthService.check_password(user, password)
+    except UserDoesNotExistError:
+        return '', 401
+    except AuthorizationFailedError:
+        return '', 401
+    except PasswordHasherOverloadedError:
+        return '', 503, {'Retry-After': '1'}
+    if password_hash is not None:
+        with db.transient() as con:
+            AuthService(con).set_password(user['id'], password_hash)
+    session['user_id'] = user['id']
+    return '', 200
 
 
 @bp.route('/logout', methods=['POST'])
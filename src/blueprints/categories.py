@@ -41,7 +41,7 @@ class CategoriesView(MethodView):
 
         data['user_id'] = user['id']
 
-        with db.connection as con:
+        with db.shard(user['id']) as con:
             service = CategoriesService(con)
             try:
                 created = service.create_category(data)
@@ -73,7 +73,7 @@ class CategoriesView(MethodView):
 
         data['user_id'] = user['id']
 
-        with db.connection as con:
+        with db.read_shard(user['id']) as con:
             service = CategoriesService(con)
             try:
                 category = service.get_category(data)
@@ -100,12 +100,22 @@ class CategoryView(MethodView):
         :param user: параметры авторизации
         :return: сформированный ответ
         """
+        # Некорректная категория для переноса операций - ошибка запроса (а не открепление операций)
+        reassign_to = request.args.get('reassign_to', None)
+        if reassign_to is not None:
+            try:
+                reassign_to = int(reassign_to)
+            except ValueError:
+                return '', 400
+
         data = {
             'user_id': user['id'],
-            'category_id': category_id
+            'category_id': category_id,
+            'recursive': request.args.get('recursive', 'false').lower() in ('1', 'true'),
+            'reassign_to': reassign_to
         }
 
-        with db.connection as con:
+        with db.shard(user['id']) as con:
             service = CategoriesService(con)
 
             try:
@@ -138,7 +148,7 @@ class CategoryView(MethodView):
         if data.get('parent_id', -1) == category_id:
             return '', 409
 
-        with db.connection as con:
+        with db.shard(user['id']) as con:
             service = CategoriesService(con)
             try:
                 category = service.patch_category(data, category_id, user['id'])
@@ -9,6 +9,7 @@ from services.register import (
     RegisterService,
     RegistrationFailedError
 )
+from services.passwords import PasswordHasherOverloadedError
 
 bp = Blueprint('register', __name__)
 
@@ -26,10 +27,15 @@ class RegisterView(MethodView):
         if not data:
             return '', 400
 
-        with db.connection as con:
+        # Хеширование пароля - без соединения с БД, запись - на время короткой транзакции
+        try:
+            data = RegisterService.hash_password(data)
+        except PasswordHasherOverloadedError:
+            return '', 503, {'Retry-After': '1'}
+        with db.transient() as con:
             service = RegisterService(con)
             try:
-                new_user = service.register(data)
+                new_user = service.add_user(data)
             except RegistrationFailedError:
                 return '', 409
             else:
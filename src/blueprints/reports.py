@@ -0,0 +1,147 @@
+from database import db
+from flask import (
+    Blueprint,
+    request,
+    jsonify,
+    url_for
+)
+from flask.views import MethodView
+from services.decorators import auth_required
+from services.report_jobs import (
+    report_jobs,
+    ReportJobDoesNotExistError,
+    ReportJobAccessDeniedError,
+    ReportJobInvalidFiltersError,
+    ReportJobNotReadyError,
+    ReportPageDoesNotExistError,
+    ReportJobsOverloadedError
+)
+from services.serialization import raw_json_response
+from services.transactions import (
+    TransactionsService,
+    TransactionInvalidPeriodError,
+    TransactionInvalidFilterError,
+    NegativeValue,
+    CategoryDoesNotExistError,
+    CategoryAccessDeniedError
+)
+
+bp = Blueprint('reports', __name__)
+
+
+class ReportJobsView(MethodView):
+    """
+    Класс, представляющий часть API, отвечающую за постановку отчётов по операциям в очередь фоновых заданий.
+    """
+    @auth_required
+    def post(self, user):
+        """
+        Обработчик POST-запроса на создание задания формирования отчёта.
+        Тело запроса - фильтры отчёта (как query-параметры GET /transactions).
+
+        :param user: параметры авторизации
+        :return: параметры задания
+        """
+        data = request.get_json(silent=True)
+        if data is None:
+            data = {}
+
+        with db.read_shard(user['id']) as connection:
+            service = TransactionsService(connection)
+            try:
+                filters = report_jobs.normalize_filters(data)
+                service.check_report_filters(filters, user['id'])
+                job = report_jobs.submit(user['id'], filters)
+            except ReportJobInvalidFiltersError:
+                return '', 400
+            except TransactionInvalidPeriodError:
+                return '', 400
+            except TransactionInvalidFilterError:
+                return '', 400
+            except NegativeValue:
+                return '', 400
+            except CategoryDoesNotExistError:
+                return '', 404
+            except CategoryAccessDeniedError:
+                return '', 403
+            except ReportJobsOverloadedError:
+                return '', 503, {'Retry-After': '1'}
+            else:
+                location = url_for('reports.job', job_id=job['id'], _external=True)
+                return jsonify(job), 202, {'Content-Type': 'application/json', 'Location': location}
+
+
+class ReportJobView(MethodView):
+    """
+    Класс, представляющий часть API, отвечающую за получение статуса и удаление задания формирования отчёта.
+    """
+    @auth_required
+    def get(self, job_id, user):
+        """
+        Обработчик GET-запроса на получение статуса задания.
+        Параметр wait - время ожидания завершения задания в секундах (long polling).
+
+        :param job_id: идентификатор задания
+        :param user: параметры авторизации
+        :return: параметры задания
+        """
+        wait = request.args.get('wait', 0, type=float)
+        try:
+            job = report_jobs.get_job(job_id, user['id'], wait)
+        except ReportJobDoesNotExistError:
+            return '', 404
+        except ReportJobAccessDeniedError:
+            return '', 403
+        else:
+            return jsonify(job), 200, {'Content-Type': 'application/json'}
+
+    @auth_required
+    def delete(self, job_id, user):
+        """
+        Обработчик DELETE-запроса на удаление задания и его результатов.
+
+        :param job_id: идентификатор задания
+        :param user: параметры авторизации
+        :return: сформированный ответ
+        """
+        try:
+            report_jobs.delete_job(job_id, user['id'])
+        except ReportJobDoesNotExistError:
+            return '', 404
+        except ReportJobAccessDeniedError:
+            return '', 403
+        else:
+            return '', 200
+
+
+class ReportPageView(MethodView):
+    """
+    Класс, представляющий часть API, отвечающую за получение готовых страниц отчёта задания.
+    """
+    @auth_required
+    def get(self, job_id, page, user):
+        """
+        Обработчик GET-запроса на получение страницы отчёта.
+
+        :param job_id: идентификатор задания
+        :param page: номер страницы
+        :param user: параметры авторизации
+        :return: страница отчёта
+        """
+        try:
+            body = report_jobs.get_page(job_id, user['id'], page)
+        except ReportJobDoesNotExistError:
+            return '', 404
+        except ReportJobAccessDeniedError:
+            return '', 403
+        except ReportPageDoesNotExistError:
+            return '', 404
+        except ReportJobNotReadyError:
+            return '', 409
+        else:
+            return raw_json_response(body), 200, {'Content-Type': 'application/json'}
+
+
+bp.add_url_rule('/jobs', view_func=ReportJobsView.as_view('jobs'))
+bp.add_url_rule('/jobs/<job_id>', view_func=ReportJobView.as_view('job'))
+bp.add_url_rule('/jobs/<job_id>/pages/<int:page>', view_func=ReportPageView.as_view('page'))
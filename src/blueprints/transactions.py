@@ -5,17 +5,21 @@ from flask import (
     jsonify
 )
 from flask.views import MethodView
+from services.admission import ReportThrottledError, report_admission
 from services.decorators import auth_required
+from services.serialization import json_response
 from services.transactions import (
     TransactionsService,
     TransactionDoesNotExistError,
     TransactionAccessDeniedError,
     TransactionInvalidPeriodError,
+    TransactionInvalidFilterError,
     MissingRequiredFields,
     NegativeValue,
     CategoryDoesNotExistError,
     CategoryAccessDeniedError,
     EmptyReportError,
+    InvalidIdempotencyKey,
     PageReportNotExist,
     DataBaseConflictError
 )
@@ -37,6 +41,7 @@ class TransactionsView(MethodView):
         :return: параметры новой операции
         """
         data = request.json
+        idempotency_key = request.headers.get('Idempotency-Key')
 
         # Проверка на пустое тело запроса
         if not data:
@@ -44,11 +49,13 @@ class TransactionsView(MethodView):
 
         data['user_id'] = user['id']
 
-        with db.connection as connection:
-            service = TransactionsService(connection)
+        with db.shard(user['id']) as connection:
+            service = TransactionsService(connection, db.write_queue(user['id']))
 
             try:
-                new_transaction = service.add_transaction(data)
+                new_transaction = service.add_transaction(data, idempotency_key)
+            except InvalidIdempotencyKey:
+                return '', 400
             except MissingRequiredFields:
                 return '', 400
             except CategoryDoesNotExistError:
@@ -71,10 +78,15 @@ class TransactionsView(MethodView):
         :return: сформированный ответ
         """
         query_str = request.args
-        with db.connection as connection:
+        with db.read_shard(user['id']) as connection:
             service = TransactionsService(connection)
             try:
-                report = service.get_transaction(query_str, user['id'])
+                # Допуск отчёта по оценке его стоимости (бюджет и одновременные отчёты пользователя)
+                scope = service.report_scope(query_str, user['id'])
+                with report_admission.admit(user['id'], scope):
+                    report = service.get_transaction(query_str, user['id'], scope=scope)
+            except ReportThrottledError as error:
+                return '', 429, {'Retry-After': str(error.retry_after)}
             except CategoryDoesNotExistError:
                 return '', 404
             except CategoryAccessDeniedError:
@@ -85,8 +97,12 @@ class TransactionsView(MethodView):
                 return '', 404
             except TransactionInvalidPeriodError:
                 return '', 400
+            except TransactionInvalidFilterError:
+                return '', 400
+            except NegativeValue:
+                return '', 400
             else:
-                return jsonify(report), 200, {'Content-Type': 'application/json'}
+                return json_response(report), 200, {'Content-Type': 'application/json'}
 
 
 class TransactionView(MethodView):
@@ -110,7 +126,7 @@ class TransactionView(MethodView):
         if not data:
             return '', 400
 
-        with db.connection as con:
+        with db.shard(user['id']) as con:
             service = TransactionsService(con)
             try:
                 response = service.patch_transaction(transaction_id, user['id'], data)
@@ -142,7 +158,7 @@ class TransactionView(MethodView):
         data['user_id'] = user['id']
         data['transaction_id'] = transaction_id
 
-        with db.connection as connection:
+        with db.shard(user['id']) as connection:
             service = TransactionsService(connection)
             try:
                 service.delete_transaction(data)
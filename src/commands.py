@@ -0,0 +1,122 @@
+import click
+from database import db
+from flask.cli import AppGroup
+
+shards_cli = AppGroup('shards', help='Управление шардированием категорий и операций пользователей.')
+archive_cli = AppGroup('archive', help='Архивация старых операций пользователей.')
+maintenance_cli = AppGroup('maintenance', help='Обслуживание БД без остановки приложения.')
+categories_cli = AppGroup('categories', help='Миграции категорий пользователей.')
+
+
+@shards_cli.command('reshard')
+@click.argument('count', type=int)
+def reshard(count):
+    """
+    Перераспределение данных пользователей по COUNT шардам (0 - хранение в справочной БД).
+    Команду следует выполнять при остановленном приложении. При переходе к шардам категории и операции
+    удаляются из справочной БД после переключения раскладки. Откат - "flask shards reshard 0"
+    (данные возвращаются в справочную БД) или восстановление резервной копии "flask maintenance backup".
+    """
+    previous = db.reshard(count)
+    click.echo(f'Раскладка: {db.shards} шард(ов), поколение {db.generation}')
+    for path in previous:
+        click.echo(f'Файл предыдущей раскладки можно удалить: {path}')
+
+
+@shards_cli.command('status')
+def status():
+    """
+    Вывод текущей раскладки шардов.
+    """
+    click.echo(f'Раскладка: {db.shards} шард(ов), поколение {db.generation}')
+    for index in range(db.shards):
+        click.echo(f'{index}: {db.shard_path(index)}')
+    stale = {table: count for table, count in db.stale_rows().items() if count}
+    if stale:
+        click.echo('В справочной БД остались устаревшие строки (не используются, удаляются следующим reshard): '
+                   + ', '.join(f'{table} - {count}' for table, count in stale.items()))
+
+
+@archive_cli.command('run')
+@click.option('--horizon', type=int, default=None, help='Горизонт архивации в днях.')
+def archive_run(horizon):
+    """
+    Перенос операций старше горизонта архивации в годовые таблицы архивов.
+    """
+    moved = db.archive(horizon)
+    for path, count in moved.items():
+        click.echo(f'{path}: перенесено операций - {count}')
+    if not moved:
+        click.echo('Нет операций для архивации')
+
+
+@archive_cli.command('compact')
+def archive_compact():
+    """
+    Уплотнение БД и архивов (VACUUM). Команду следует выполнять при остановленном приложении.
+    """
+    for path, (before, after) in db.compact().items():
+        click.echo(f'{path}: {before} -> {after} байт')
+
+
+@maintenance_cli.command('backup')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--pages', type=int, default=None, help='Количество страниц за один шаг копирования.')
+@click.option('--pause', type=float, default=None, help='Пауза между шагами, с.')
+def maintenance_backup(directory, pages, pause):
+    """
+    Резервное копирование БД, шардов и архивов в директорию DIRECTORY порциями страниц.
+    """
+    for path, target in db.backup(directory, pages, pause).items():
+        click.echo(f'{path} -> {target}')
+
+
+@maintenance_cli.command('optimize')
+@click.option('--full', is_flag=True, help='Анализировать все индексированные таблицы (ANALYZE).')
+@click.option('--limit', type=int, default=None, help='Ограничение анализа (PRAGMA analysis_limit), 0 - без него.')
+@click.option('--pause', type=float, default=None, help='Пауза между таблицами, с.')
+def maintenance_optimize(full, limit, pause):
+    """
+    Обновление статистики планировщика запросов (PRAGMA optimize или ANALYZE).
+    """
+    for path, tables in db.optimize(full, limit, pause).items():
+        click.echo(f'{path}: ' + ('PRAGMA optimize' if tables is None else f'проанализировано таблиц - {tables}'))
+
+
+@maintenance_cli.command('vacuum')
+@click.option('--pages', type=int, default=None, help='Количество освобождаемых страниц за одну транзакцию.')
+@click.option('--pause', type=float, default=None, help='Пауза между транзакциями, с.')
+@click.option('--migrate', is_flag=True,
+              help='Однократно перевести файлы без инкрементального режима в него (полный VACUUM файла, '
+                   'на время которого запись в файл блокируется).')
+def maintenance_vacuum(pages, pause, migrate):
+    """
+    Инкрементальное освобождение места после удаления данных (PRAGMA incremental_vacuum).
+
+    Файлы БД, созданные до появления инкрементального режима (в том числе example.db), пропускаются.
+    Их нужно однократно перевести в этот режим: запустить команду с ключом --migrate в период низкой
+    нагрузки (каждый файл пересобирается VACUUM, запись в него на это время блокируется, чтение
+    продолжается) или выполнить "flask archive compact" при остановленном приложении.
+    """
+    for path, freed in db.vacuum(pages, pause, migrate).items():
+        if freed is None:
+            click.echo(f'{path}: инкрементальный режим не включён, выполните однократно '
+                       f'"flask maintenance vacuum --migrate"')
+        else:
+            click.echo(f'{path}: освобождено страниц - {freed}')
+
+
+@categories_cli.command('migrate')
+def categories_migrate():
+    """
+    Создание уникального индекса имён категорий (category_user_id_name_idx) в справочной БД и шардах.
+    Повторяющиеся имена в дереве пользователя не изменяются: при их наличии команда выводит их
+    и завершается с ошибкой, повторы нужно устранить вручную (переименовать или удалить категории).
+    """
+    duplicates = db.migrate_categories()
+    for path, found in duplicates.items():
+        for user_id, name, ids in found:
+            click.echo(f'{path}: user_id={user_id} name={name!r} id={", ".join(map(str, ids))}')
+    if duplicates:
+        raise click.ClickException('Индекс не создан: имена категорий повторяются')
+    click.echo('Индекс category_user_id_name_idx создан')
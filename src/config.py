@@ -9,3 +9,35 @@ class Config:
     """
     DB_CONNECTION = os.getenv('DB_CONNECTION', '../example.db')
     SECRET_KEY = os.getenv('SECRET_KEY', 'secret_key').encode()
+    STORAGE_ENGINE = os.getenv('STORAGE_ENGINE', 'sqlite')
+    DB_SHARD_PATH = os.getenv('DB_SHARD_PATH', '../shards/shard_{generation}_{index}.db')
+    DB_ARCHIVE_PATH = os.getenv('DB_ARCHIVE_PATH', '../archive/{database}_archive.db')
+    DB_ARCHIVE_HORIZON = int(os.getenv('DB_ARCHIVE_HORIZON', 730))
+    DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'wal')
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 4))
+    DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', 16))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+    DB_WRITE_BEHIND = os.getenv('DB_WRITE_BEHIND', '0').lower() in ('1', 'true')
+    DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 256))
+    DB_WRITE_BATCH_WINDOW = float(os.getenv('DB_WRITE_BATCH_WINDOW', 0.002))
+    DB_MAINTENANCE_PAGES = int(os.getenv('DB_MAINTENANCE_PAGES', 256))
+    DB_MAINTENANCE_PAUSE = float(os.getenv('DB_MAINTENANCE_PAUSE', 0.05))
+    DB_ANALYSIS_LIMIT = int(os.getenv('DB_ANALYSIS_LIMIT', 400))
+    REPORT_JOBS_DB = os.getenv('REPORT_JOBS_DB', '../jobs/report_jobs.db')
+    REPORT_JOB_WORKERS = int(os.getenv('REPORT_JOB_WORKERS', 2))
+    REPORT_JOB_QUEUE_LIMIT = int(os.getenv('REPORT_JOB_QUEUE_LIMIT', 16))
+    REPORT_JOB_PAGE_SIZE = int(os.getenv('REPORT_JOB_PAGE_SIZE', 1000))
+    REPORT_JOB_TTL = int(os.getenv('REPORT_JOB_TTL', 86400))
+    REPORT_JOB_WAIT_LIMIT = float(os.getenv('REPORT_JOB_WAIT_LIMIT', 30))
+    REPORT_ADMISSION = os.getenv('REPORT_ADMISSION', '1').lower() in ('1', 'true')
+    REPORT_USER_CONCURRENCY = int(os.getenv('REPORT_USER_CONCURRENCY', 2))
+    REPORT_BUDGET_RATE = float(os.getenv('REPORT_BUDGET_RATE', 50000))
+    REPORT_BUDGET_BURST = float(os.getenv('REPORT_BUDGET_BURST', 200000))
+    REPORT_COST_RANGE_DAYS = float(os.getenv('REPORT_COST_RANGE_DAYS', 365))
+    REPORT_COST_SUBTREE = float(os.getenv('REPORT_COST_SUBTREE', 10))
+    IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))
+    IDEMPOTENCY_PURGE_INTERVAL = int(os.getenv('IDEMPOTENCY_PURGE_INTERVAL', 300))
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:150000')
+    PASSWORD_SALT_LENGTH = int(os.getenv('PASSWORD_SALT_LENGTH', 8))
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', 32))
@@ -1,37 +1,1232 @@
+import calendar
+import json
+import logging
+import os
 import sqlite3 as sqlite
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from decimal import Decimal
+from queue import LifoQueue, Queue, Empty
+from threading import Lock, Thread
+from time import monotonic, sleep, time
+from urllib.request import pathname2url
+
+from flask import g
+
+logger = logging.getLogger(__name__)
+
+# Денежные суммы хранятся в БД в текстовом виде
+sqlite.register_adapter(Decimal, str)
+
+# Инструкции INSERT/UPDATE ... RETURNING поддерживаются начиная с SQLite 3.35.0,
+# в более ранних версиях записанная строка выбирается отдельным запросом
+RETURNING_SUPPORTED = sqlite.sqlite_version_info >= (3, 35, 0)
+
+# Столбцы, добавляемые к существующим таблицам: сохранённый путь категории до корня дерева (JSON)
+# и вычисляемая сумма операции в копейках для фильтров и индексов
+ADDED_COLUMNS = {
+    'category': {
+        'path': 'TEXT',
+    },
+    'operation': {
+        'amount_cents': 'INTEGER GENERATED ALWAYS AS (CAST(ROUND(amount * 100) AS INTEGER)) VIRTUAL',
+    },
+}
+
+
+def operation_schema(table):
+    """
+    Функция для получения индексов таблицы операций и её полнотекстового индекса описаний,
+    который синхронизируется триггерами.
+
+    :param table: имя таблицы операций
+    :return: DDL-инструкции
+    """
+    return (
+        f'CREATE INDEX IF NOT EXISTS {table}_category_id_idx ON {table} (category_id)',
+        f'CREATE INDEX IF NOT EXISTS {table}_user_id_date_idx ON {table} (user_id, date)',
+        f'CREATE INDEX IF NOT EXISTS {table}_user_id_type_amount_idx ON {table} (user_id, type, amount_cents)',
+        f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts
+        USING fts5(description, content='{table}', content_rowid='id')
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO {table}_fts (rowid, description) VALUES (NEW.id, NEW.description);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO {table}_fts ({table}_fts, rowid, description) VALUES ('delete', OLD.id, OLD.description);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF description ON {table}
+        BEGIN
+            INSERT INTO {table}_fts ({table}_fts, rowid, description) VALUES ('delete', OLD.id, OLD.description);
+            INSERT INTO {table}_fts (rowid, description) VALUES (NEW.id, NEW.description);
+        END
+        ''',
+    )
+
+
+# Имена категорий уникальны в пределах дерева пользователя. Индекс создаётся при инициализации только для БД
+# без повторяющихся имён, для остальных - командой "flask categories migrate" после устранения повторов
+CATEGORY_NAME_INDEX = 'CREATE UNIQUE INDEX IF NOT EXISTS category_user_id_name_idx ON category (user_id, name)'
+
+# Идемпотентные DDL-инструкции, применяемые к БД при инициализации приложения
+SCHEMA = (
+    *operation_schema('operation'),
+    'CREATE INDEX IF NOT EXISTS category_parent_id_idx ON category (parent_id)',
+    # Версия данных пользователя, увеличивается при любом изменении его категорий и операций
+    '''
+    CREATE TABLE IF NOT EXISTS data_version (
+        user_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    *(
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_data_version AFTER {event} ON {table}
+        BEGIN
+            INSERT INTO data_version (user_id, version) VALUES ({row}.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+        END
+        '''
+        for table in ('operation', 'category')
+        for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))
+    ),
+    # Ключи идемпотентности создания операций: ответ на первый запрос с ключом хранится до истечения срока expires.
+    # Поиск - по первичному ключу, удаление истёкших ключей - пакетно по индексу expires.
+    # При перераспределении шардов ключи не переносятся (хранятся ограниченное время)
+    '''
+    CREATE TABLE IF NOT EXISTS idempotency_key (
+        user_id INTEGER NOT NULL,
+        key TEXT NOT NULL,
+        operation TEXT NOT NULL,
+        expires INTEGER NOT NULL,
+        PRIMARY KEY (user_id, key)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idempotency_key_expires_idx ON idempotency_key (expires)',
+    # Годовые таблицы архивов операций, перенесённых из БД (см. SqliteDB.archive)
+    '''
+    CREATE TABLE IF NOT EXISTS archive (
+        path TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        from_date INTEGER NOT NULL,
+        to_date INTEGER NOT NULL,
+        PRIMARY KEY (path, year)
+    )
+    ''',
+)
+
+# Схема файла-шарда: категории и операции пользователей, чей идентификатор отображается на шард
+SHARD_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS category (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        parent_id INTEGER REFERENCES category (id),
+        path TEXT
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS operation (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type INTEGER NOT NULL,
+        amount TEXT NOT NULL,
+        amount_cents {ADDED_COLUMNS['operation']['amount_cents']},
+        description TEXT,
+        date INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        category_id INTEGER REFERENCES category (id)
+    )
+    ''',
+    *SCHEMA,
+)
+
+# Схема справочной БД: пользователи и авторизация, а также текущая раскладка шардов
+DIRECTORY_SCHEMA = (
+    *SCHEMA,
+    '''
+    CREATE TABLE IF NOT EXISTS shard_layout (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        shards INTEGER NOT NULL,
+        generation INTEGER NOT NULL
+    )
+    ''',
+)
+
+# Поля таблиц, переносимых между шардами
+SHARDED_TABLES = {
+    'category': 'id, name, user_id, parent_id, path',
+    'operation': 'id, type, amount, description, date, user_id, category_id',
+}
+
+
+def select_row(table, columns, id, connection):
+    """
+    Функция для получения записи таблицы БД по идентификатору
+    (используется, если SQLite не поддерживает RETURNING).
+
+    :param table: имя таблицы
+    :param columns: выбираемые поля
+    :param id: идентификатор записи
+    :param connection: соединение с БД
+    :return: словарь полей записи или None
+    """
+    row = connection.execute(f'SELECT {", ".join(columns)} FROM {table} WHERE id = ?', (id,)).fetchone()
+    return dict(row) if row is not None else None
+
+
+def category_paths(categories, known=None):
+    """
+    Функция для построения путей категорий до корня дерева.
+
+    :param categories: категории (id, name, parent_id), пути которых требуется построить
+    :param known: уже известные пути категорий, не входящих в categories (id -> путь)
+    :return: словарь id -> список категорий (id, name) от категории до корня дерева
+    """
+    known = dict(known or {})
+    nodes = {category['id']: category for category in categories}
+    for category in categories:
+        # Подъём до корня, либо до категории с известным путём (защита от циклов - по посещённым)
+        chain = []
+        visited = set()
+        node = category
+        parent_id = None
+        while node is not None and node['id'] not in known and node['id'] not in visited:
+            chain.append(node)
+            visited.add(node['id'])
+            parent_id = node['parent_id']
+            node = nodes.get(parent_id)
+        path = known.get(parent_id, [])
+        for node in reversed(chain):
+            path = [{'id': node['id'], 'name': node['name']}] + path
+            known[node['id']] = path
+    return {category_id: known[category_id] for category_id in nodes}
+
+
+def archive_schema(year):
+    """
+    Функция для получения схемы годовой таблицы архива: операции за один год, перенесённые
+    из справочной БД или шарда (категории остаются в исходной БД).
+
+    :param year: год
+    :return: DDL-инструкции
+    """
+    table = f'operation_{year}'
+    return (
+        f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            type INTEGER NOT NULL,
+            amount TEXT NOT NULL,
+            amount_cents {ADDED_COLUMNS['operation']['amount_cents']},
+            description TEXT,
+            date INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            category_id INTEGER
+        )
+        ''',
+        *operation_schema(table),
+    )
+
+
+def category_duplicates(connection):
+    """
+    Функция для поиска повторяющихся имён категорий в деревьях пользователей (препятствуют созданию
+    уникального индекса category_user_id_name_idx).
+
+    :param connection: соединение с БД
+    :return: список (идентификатор пользователя, имя, [идентификаторы категорий])
+    """
+    cur = connection.execute(
+        '''
+        SELECT user_id, name, group_concat(id) FROM category
+        GROUP BY user_id, name HAVING COUNT(*) > 1
+        ORDER BY user_id, name
+        '''
+    )
+    return [(user_id, name, sorted(int(id) for id in ids.split(','))) for user_id, name, ids in cur.fetchall()]
+
+
+def apply_schema(connection, statements):
+    """
+    Функция для применения DDL-инструкций к БД. Недостающие столбцы добавляются к существующим
+    таблицам и заполняются, полнотекстовые индексы, созданные для уже заполненных таблиц операций,
+    перестраиваются. Уникальный индекс имён категорий создаётся, только если в БД нет повторяющихся
+    имён, иначе в журнал записывается предупреждение (уровень WARNING), данные не изменяются.
+
+    :param connection: соединение с БД
+    :param statements: DDL-инструкции
+    :return: nothing
+    """
+    fts_query = "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE '%\\_fts' ESCAPE '\\'"
+    fts_tables = {name for (name,) in connection.execute(fts_query)}
+    with connection:
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row[1] for row in connection.execute(f'PRAGMA table_xinfo({table})')}
+            if not existing:
+                continue    # таблица ещё не создана, столбцы входят в её определение
+            for column, definition in columns.items():
+                if column not in existing:
+                    connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        for statement in statements:
+            connection.execute(statement)
+        for (name,) in connection.execute(fts_query).fetchall():
+            if name not in fts_tables:
+                connection.execute(f"INSERT INTO {name} ({name}) VALUES ('rebuild')")
+
+        cur = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'category'")
+        if cur.fetchone() is None:
+            return
+
+        # Повторяющиеся имена категорий (созданные до появления индекса) приложение не изменяет
+        cur = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'category_user_id_name_idx'")
+        if cur.fetchone() is None:
+            duplicates = category_duplicates(connection)
+            if duplicates:
+                logger.warning('category_user_id_name_idx is not created: %s duplicated category names, '
+                               'see "flask categories migrate"', len(duplicates))
+            else:
+                connection.execute(CATEGORY_NAME_INDEX)
+
+        # Заполнение путей категорий, созданных до появления столбца path
+        if connection.execute('SELECT 1 FROM category WHERE path IS NULL LIMIT 1').fetchone() is not None:
+            cur = connection.execute('SELECT id, name, parent_id FROM category')
+            categories = [dict(zip(('id', 'name', 'parent_id'), row)) for row in cur.fetchall()]
+            paths = category_paths(categories)
+            connection.executemany(
+                'UPDATE category SET path = ? WHERE id = ?',
+                ((json.dumps(path, ensure_ascii=False), category_id) for category_id, path in paths.items()),
+            )
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class WriteQueueTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Пул соединений с БД. Соединения создаются по мере необходимости,
+    но не более size штук; при исчерпании пула запрос ожидает освобождения соединения.
+    Количество ожиданий и истечений времени ожидания (waits, timeouts) накапливается
+    для диагностики конкуренции за соединения (см. benchmarks/stress.py).
+    """
+    def __init__(self, database, size, timeout, read_only=False):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.read_only = read_only
+        self.waits = 0
+        self.timeouts = 0
+        self._idle = LifoQueue()
+        self._created = 0
+        self._lock = Lock()
+
+    def acquire(self):
+        """
+        Метод для получения соединения из пула.
+
+        :return: соединение с БД
+        """
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        with self._lock:
+            self.waits += 1
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except Empty:
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeoutError(self.database)
+
+    def release(self, connection):
+        """
+        Метод для возврата соединения в пул. Незавершённая транзакция откатывается.
+
+        :param connection: соединение с БД
+        :return: nothing
+        """
+        if connection.in_transaction:
+            connection.rollback()
+        self._idle.put(connection)
+
+    def close(self):
+        """
+        Метод для закрытия всех свободных соединений пула.
+
+        :return: nothing
+        """
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except Empty:
+                break
+            connection.close()
+            with self._lock:
+                self._created -= 1
+
+    def _connect(self):
+        if self.read_only:
+            # Соединение только для чтения: не может взять блокировку на запись
+            database = f'file:{pathname2url(os.path.abspath(self.database))}?mode=ro'
+        else:
+            database = self.database
+        connection = sqlite.connect(
+            database,
+            detect_types=sqlite.PARSE_DECLTYPES | sqlite.PARSE_COLNAMES,
+            check_same_thread=False,
+            uri=self.read_only
+        )
+        connection.row_factory = sqlite.Row
+        if self.read_only:
+            connection.execute('PRAGMA query_only = ON')
+        return connection
+
+
+class WriteQueue:
+    """
+    Очередь отложенной записи (group commit). Вставки из всех потоков обрабатываются
+    единственным потоком-писателем: накопленные за короткое окно записи фиксируются
+    одной транзакцией (один fsync на пакет). Поток запроса ожидает фиксации своей записи,
+    поэтому гарантии сохранности данных для каждого запроса не меняются.
+    Ошибка фиксации пакета передаётся ожидающим его записи потокам, поток-писатель продолжает работу
+    (и перезапускается при следующей записи, если всё же завершился). Ожидание записи ограничено
+    таймаутом: запись, не взятая в работу за это время, отменяется (WriteQueueTimeoutError).
+    """
+    def __init__(self, database, batch_size, batch_window, timeout=None):
+        self.database = database
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self._queue = Queue()
+        self._thread = None
+        self._lock = Lock()
+
+    def insert(self, table, data, returning=None):
+        """
+        Метод для записи данных в таблицу БД через очередь.
+
+        :param table: имя таблицы
+        :param data: словарь с записываемыми данными
+        :param returning: поля записанной строки, возвращаемые вместо идентификатора записи
+        :return: идентификатор записи (или словарь полей returning), None при нарушении ограничений БД
+                 or raise WriteQueueTimeoutError
+        """
+        future = Future()
+        self._start()
+        self._queue.put((table, data, returning, future))
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            # Запись ещё в очереди - отменяется; уже фиксируемая запись дожидается завершения транзакции
+            if future.cancel():
+                raise WriteQueueTimeoutError(self.database)
+        return future.result()
+
+    def stop(self):
+        """
+        Метод для остановки потока-писателя после обработки уже поставленных в очередь записей.
+
+        :return: nothing
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        connection = None
+        stopped = False
+        try:
+            while not stopped:
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                # Накопление пакета: до batch_size записей в пределах окна batch_window
+                batch = [item]
+                deadline = monotonic() + self.batch_window
+                while len(batch) < self.batch_size:
+                    timeout = deadline - monotonic()
+                    try:
+                        item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                    except Empty:
+                        break
+                    if item is None:
+                        stopped = True
+                        break
+                    batch.append(item)
+
+                # Отменённые по таймауту записи не выполняются
+                batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                try:
+                    if connection is None:
+                        connection = sqlite.connect(self.database, isolation_level=None)
+                        connection.row_factory = sqlite.Row
+                        connection.execute('PRAGMA foreign_keys = ON')
+                    self._commit(connection, batch)
+                except Exception as error:
+                    # Ошибка соединения (или отката транзакции): пакет завершается ошибкой,
+                    # для следующего пакета соединение открывается заново
+                    for _, _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(error)
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+        finally:
+            if connection is not None:
+                connection.close()
+
+    @staticmethod
+    def _commit(connection, batch):
+        """
+        Метод для записи пакета одной транзакцией. Каждая запись выполняется в собственной
+        точке сохранения, поэтому ошибка одной записи не отменяет остальные.
+
+        :param connection: соединение потока-писателя
+        :param batch: список кортежей (таблица, данные, возвращаемые поля, future)
+        :return: nothing
+        """
+        results = []
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for table, data, returning, future in batch:
+                keys = ', '.join(data.keys())
+                placeholders = ', '.join('?' for _ in data)
+                sql = f'INSERT INTO {table} ({keys}) VALUES ({placeholders})'
+                connection.execute('SAVEPOINT item')
+                try:
+                    if returning is not None and RETURNING_SUPPORTED:
+                        result = dict(connection.execute(f'{sql} RETURNING {", ".join(returning)}',
+                                                         tuple(data.values())).fetchall()[0])
+                    else:
+                        result = connection.execute(sql, tuple(data.values())).lastrowid
+                        if returning is not None:
+                            result = select_row(table, returning, result, connection)
+                except sqlite.IntegrityError:
+                    connection.execute('ROLLBACK TO item')
+                    results.append((future, None))
+                else:
+                    results.append((future, result))
+                connection.execute('RELEASE item')
+            connection.execute('COMMIT')
+        except Exception as error:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            for _, _, _, future in batch:
+                future.set_exception(error)
+        else:
+            for future, result in results:
+                future.set_result(result)
 
 
 class SqliteDB:
     """
     Вспомогательный класс для упрощения работы с БД.
+    Соединения выдаются из пулов и закрепляются за контекстом приложения:
+    connection - соединение для изменения данных,
+    read_connection - соединение только для чтения (отчёты и прочие GET-запросы).
+
+    Пользователи и авторизация хранятся в справочной БД (DB_CONNECTION). Категории и операции
+    при включённом шардировании хранятся в файлах-шардах, шард выбирается по остатку от деления
+    идентификатора пользователя на количество шардов (см. shard и read_shard).
+    При включённом режиме DB_WRITE_BEHIND вставки операций выполняются через write_queue.
+
+    Операции старше DB_ARCHIVE_HORIZON дней переносятся командой "flask archive run" в годовые таблицы
+    архива БД (см. archive), отчёты используют архив только при пересечении с запрошенным периодом.
+
+    При STORAGE_ENGINE = 'memory' вместо соединений выдаётся общее хранилище в памяти,
+    заполняемое при запуске данными из DB_CONNECTION и её архивов (изменения в БД не сохраняются).
+    Хранилище создаётся переданной в init_app функцией (слой сервисов), для модуля БД оно - непрозрачный
+    объект, блок with которого аналогичен транзакции.
     """
+    # Разрядность номера шарда и количества записей в диапазоне идентификаторов шарда
+    SHARD_BITS = 8
+    SHARD_ID_BITS = 36
+
     def __init__(self, app=None):
-        self._connection = None
         self._app = None
+        self._pools = dict()
+        self._write_queues = dict()
+        self._lock = Lock()
+        self.shards = 0
+        self.generation = 0
+        self.memory = None
         if app is not None:
             self.init_app(app)
 
-    def init_app(self, app):
+    def init_app(self, app, memory_factory=None):
         self._app = app
         self._app.teardown_appcontext(self.close_db)
+        self._app.register_error_handler(PoolTimeoutError, self.overloaded)
+        self._app.register_error_handler(WriteQueueTimeoutError, self.overloaded)
+        if self._app.config['STORAGE_ENGINE'] == 'memory':
+            self.init_memory(memory_factory)
+        else:
+            self.init_schema()
+
+    def init_memory(self, factory):
+        """
+        Метод для создания хранилища в памяти (непрозрачный для модуля БД объект, выдаваемый вместо соединений).
+
+        :param factory: функция создания хранилища по пути к справочной БД (см. services.storage.load_memory_storage)
+        :return: nothing
+        """
+        self.memory = factory(self._app.config['DB_CONNECTION'])
+
+    def init_schema(self):
+        """
+        Метод для приведения схемы справочной БД к актуальному состоянию (индексы и т.п.)
+        и чтения текущей раскладки шардов.
+
+        :return: nothing
+        """
+        config = self._app.config
+        connection = sqlite.connect(config['DB_CONNECTION'])
+        try:
+            # Для новой БД - возможность освобождать место после удалений без остановки приложения (см. vacuum)
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            # В режиме WAL читатели не блокируют запись и наоборот
+            connection.execute(f'PRAGMA journal_mode = {config["DB_JOURNAL_MODE"]}')
+            apply_schema(connection, DIRECTORY_SCHEMA)
+            with connection:
+                # По умолчанию шардирование выключено, раскладка меняется командой "flask shards reshard"
+                connection.execute('INSERT OR IGNORE INTO shard_layout (id, shards, generation) VALUES (1, 0, 0)')
+            self.shards, self.generation = connection.execute(
+                'SELECT shards, generation FROM shard_layout WHERE id = 1'
+            ).fetchone()
+        finally:
+            connection.close()
 
     @property
     def connection(self):
-        self._connect()
-        return self._connection
+        return self._get_connection(self._app.config['DB_CONNECTION'])
 
-    def _connect(self):
-        connection_string = self._app.config['DB_CONNECTION']
-        self._connection = sqlite.connect(
-            connection_string,
-            detect_types=sqlite.PARSE_DECLTYPES | sqlite.PARSE_COLNAMES
-        )
-        self._connection.row_factory = sqlite.Row
+    @property
+    def read_connection(self):
+        return self._get_connection(self._app.config['DB_CONNECTION'], read_only=True)
+
+    @contextmanager
+    def transient(self, read_only=False):
+        """
+        Контекстный менеджер соединения со справочной БД на время блока with. В отличие от connection
+        и read_connection соединение не закрепляется за контекстом приложения, а сразу после блока
+        возвращается в пул (транзакция фиксируется), поэтому не удерживается во время долгих операций
+        запроса - хеширования пароля, ожидания завершения задания и т.п.
+
+        :param read_only: соединение только для чтения
+        :return: соединение с БД (хранилище в памяти - с захваченной блокировкой)
+        """
+        if self.memory is not None:
+            with self.memory:
+                yield self.memory
+            return
+
+        pool = self._get_pool(self._app.config['DB_CONNECTION'], read_only)
+        connection = pool.acquire()
+        try:
+            with connection:
+                yield connection
+        finally:
+            pool.release(connection)
+
+    def shard(self, user_id):
+        """
+        Метод для получения соединения (для изменения данных) с шардом пользователя.
+
+        :param user_id: идентификатор пользователя
+        :return: соединение с БД
+        """
+        return self._get_connection(self.shard_path(user_id))
+
+    def read_shard(self, user_id):
+        """
+        Метод для получения соединения (только для чтения) с шардом пользователя.
+
+        :param user_id: идентификатор пользователя
+        :return: соединение с БД
+        """
+        return self._get_connection(self.shard_path(user_id), read_only=True)
+
+    def write_queue(self, user_id):
+        """
+        Метод для получения очереди отложенной записи шарда пользователя.
+
+        :param user_id: идентификатор пользователя
+        :return: WriteQueue или None, если режим отложенной записи выключен
+        """
+        config = self._app.config
+        if not config['DB_WRITE_BEHIND'] or self.memory is not None:
+            return None
+        database = self.shard_path(user_id)
+        with self._lock:
+            queue = self._write_queues.get(database)
+            if queue is None:
+                self._init_shard(database)
+                queue = WriteQueue(database, config['DB_WRITE_BATCH_SIZE'], config['DB_WRITE_BATCH_WINDOW'],
+                                   config['DB_POOL_TIMEOUT'])
+                self._write_queues[database] = queue
+            return queue
+
+    def shard_path(self, user_id, shards=None, generation=None):
+        """
+        Метод для получения пути к файлу шарда пользователя.
+
+        :param user_id: идентификатор пользователя
+        :param shards: количество шардов (по умолчанию - текущая раскладка)
+        :param generation: поколение раскладки (по умолчанию - текущая раскладка)
+        :return: путь к файлу БД
+        """
+        shards = self.shards if shards is None else shards
+        generation = self.generation if generation is None else generation
+        if not shards:
+            return self._app.config['DB_CONNECTION']
+        return self._app.config['DB_SHARD_PATH'].format(generation=generation, index=user_id % shards)
+
+    def reshard(self, shards):
+        """
+        Метод для перераспределения категорий и операций пользователей по новому количеству шардов.
+        Данные копируются в файлы нового поколения раскладки с сохранением идентификаторов,
+        после чего раскладка в справочной БД переключается. При переходе к шардам перенесённые
+        категории и операции удаляются из справочной БД только после переключения (при ошибке
+        копирования раскладка и справочная БД не меняются). Выполняется при остановленном приложении.
+
+        :param shards: новое количество шардов (0 - хранение в справочной БД)
+        :return: список файлов предыдущей раскладки, которые можно удалить
+        """
+        if not 0 <= shards < 2 ** self.SHARD_BITS:
+            raise ValueError(shards)
+
+        directory = self._app.config['DB_CONNECTION']
+        if not shards and not self.shards:
+            return []
+
+        generation = self.generation + 1
+        sources = self._layout_files(self.shards, self.generation)
+        targets = self._layout_files(shards, generation)
+
+        for index, target in enumerate(targets):
+            if target == directory:
+                self._clear_directory()
+            else:
+                # Файлы нового поколения не используются приложением, остатки неудачной попытки удаляются
+                for path in (target, f'{target}-wal', f'{target}-shm'):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._init_shard(target, generation, index)
+
+            # Пользователи, отображаемые на целевой шард
+            condition = f'user_id % {shards} = {index}' if shards else '1'
+            connection = sqlite.connect(target, isolation_level=None)
+            try:
+                for source in sources:
+                    connection.execute('ATTACH DATABASE ? AS source', (source,))
+                    connection.execute('BEGIN IMMEDIATE')
+                    for table, columns in SHARDED_TABLES.items():
+                        connection.execute(f'''
+                            INSERT INTO main.{table} ({columns})
+                            SELECT {columns} FROM source.{table}
+                            WHERE {condition}
+                            ORDER BY id
+                        ''')
+                    # Архивы содержат операции всех пользователей исходной БД, поэтому подключаются к каждому шарду
+                    connection.execute('INSERT OR IGNORE INTO main.archive SELECT * FROM source.archive')
+                    connection.execute('COMMIT')
+                    connection.execute('DETACH DATABASE source')
+            finally:
+                connection.close()
+
+        # Переключение раскладки
+        connection = sqlite.connect(directory)
+        try:
+            with connection:
+                connection.execute(
+                    'UPDATE shard_layout SET shards = ?, generation = ? WHERE id = 1',
+                    (shards, generation),
+                )
+        finally:
+            connection.close()
+
+        self.shards, self.generation = shards, generation
+        if shards:
+            # Копии в справочной БД больше не обслуживаются, их изменения были бы потеряны при обратном переносе
+            self._clear_directory()
+        return [source for source in sources if source != directory]
+
+    def stale_rows(self):
+        """
+        Метод для подсчёта категорий и операций, оставшихся в справочной БД при хранении данных в шардах
+        (раскладка переключена версией без очистки справочной БД). Такие строки приложением не читаются
+        и удаляются следующим перераспределением.
+
+        :return: словарь {таблица: количество строк}
+        """
+        if not self.shards:
+            return dict()
+        connection = sqlite.connect(self._app.config['DB_CONNECTION'])
+        try:
+            return {
+                table: connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in SHARDED_TABLES
+            }
+        finally:
+            connection.close()
+
+    def archive_path(self, database):
+        """
+        Метод для получения пути к файлу архива БД.
+
+        :param database: путь к файлу справочной БД или шарда
+        :return: путь к файлу архива
+        """
+        name = os.path.splitext(os.path.basename(database))[0]
+        return os.path.abspath(self._app.config['DB_ARCHIVE_PATH'].format(database=name))
+
+    def archive(self, horizon=None):
+        """
+        Метод для переноса операций старше горизонта архивации из справочной БД и шардов
+        в годовые таблицы их архивов. Архив каждой БД - отдельный файл, подключаемый к соединению
+        одной командой ATTACH. Перенос каждого года выполняется одной транзакцией,
+        годовая таблица регистрируется в исходной БД.
+
+        :param horizon: горизонт архивации в днях (по умолчанию - DB_ARCHIVE_HORIZON)
+        :return: словарь {путь к архиву: количество перенесённых операций}
+        """
+        horizon = self._app.config['DB_ARCHIVE_HORIZON'] if horizon is None else horizon
+        cutoff = int(time()) - horizon * 86400
+        columns = SHARDED_TABLES['operation']
+
+        result = dict()
+        for database in self._layout_files(self.shards, self.generation):
+            connection = sqlite.connect(database, isolation_level=None)
+            try:
+                cur = connection.execute(
+                    "SELECT DISTINCT CAST(strftime('%Y', date, 'unixepoch') AS INTEGER) FROM operation WHERE date < ?",
+                    (cutoff,),
+                )
+                path = self.archive_path(database)
+                for (year,) in cur.fetchall():
+                    table = f'operation_{year}'
+                    self._init_archive(path, year)
+                    from_date = calendar.timegm((year, 1, 1, 0, 0, 0))
+                    to_date = calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+                    params = (from_date, min(to_date, cutoff))
+
+                    connection.execute('ATTACH DATABASE ? AS archive_db', (path,))
+                    try:
+                        connection.execute('BEGIN IMMEDIATE')
+                        try:
+                            moved = connection.execute(
+                                f'''
+                                INSERT INTO archive_db.{table} ({columns})
+                                SELECT {columns} FROM main.operation
+                                WHERE date >= ? AND date < ?
+                                ORDER BY id
+                                ''',
+                                params,
+                            ).rowcount
+                            connection.execute('DELETE FROM main.operation WHERE date >= ? AND date < ?', params)
+                            connection.execute(
+                                'INSERT OR IGNORE INTO main.archive VALUES (?, ?, ?, ?)',
+                                (path, year, from_date, to_date),
+                            )
+                        except sqlite.Error:
+                            connection.execute('ROLLBACK')
+                            raise
+                        connection.execute('COMMIT')
+                    finally:
+                        connection.execute('DETACH DATABASE archive_db')
+                    result[path] = result.get(path, 0) + moved
+            finally:
+                connection.close()
+        return result
+
+    def compact(self):
+        """
+        Метод для уплотнения справочной БД, шардов и их архивов: слияние сегментов
+        полнотекстового индекса, пересборка файлов БД (VACUUM) и обновление статистики планировщика.
+        Файлы БД переводятся в режим инкрементального освобождения места (см. vacuum).
+        Выполняется при остановленном приложении.
+
+        :return: словарь {путь к файлу БД: (размер до, размер после)}
+        """
+        result = dict()
+        for database in self._maintained_files():
+            size = os.path.getsize(database)
+            connection = sqlite.connect(database, isolation_level=None)
+            try:
+                cur = connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE '%\\_fts' ESCAPE '\\'"
+                )
+                for (name,) in cur.fetchall():
+                    connection.execute(f"INSERT INTO {name} ({name}) VALUES ('optimize')")
+                connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                connection.execute('VACUUM')
+                connection.execute('PRAGMA optimize')
+                connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            finally:
+                connection.close()
+            result[database] = (size, os.path.getsize(database))
+        return result
+
+    def backup(self, directory, pages=None, pause=None):
+        """
+        Метод для резервного копирования справочной БД, шардов и их архивов без остановки приложения.
+        Копирование выполняется через backup API SQLite порциями по pages страниц с паузой pause секунд
+        между порциями, поэтому блокировки удерживаются недолго. В режиме WAL копия снимается
+        с одного снимка БД (транзакция чтения удерживается до конца копирования): запись не блокируется
+        и не приводит к перезапуску копирования. Копия сначала пишется во временный файл.
+
+        :param directory: директория для копий (имена файлов копий совпадают с именами файлов БД)
+        :param pages: количество страниц за один шаг (по умолчанию - DB_MAINTENANCE_PAGES)
+        :param pause: пауза между шагами в секундах (по умолчанию - DB_MAINTENANCE_PAUSE)
+        :return: словарь {путь к файлу БД: путь к копии}
+        """
+        pages, pause = self._maintenance_throttle(pages, pause)
+        databases = self._maintained_files()
+        targets = [os.path.join(directory, os.path.basename(database)) for database in databases]
+        if len(set(targets)) != len(targets):
+            raise ValueError(directory)
+        os.makedirs(directory, exist_ok=True)
+
+        result = dict()
+        for database, target in zip(databases, targets):
+            temporary = f'{target}.tmp'
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            source = self._maintenance_connection(database)
+            copy = sqlite.connect(temporary)
+            try:
+                snapshot = source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+                if snapshot:
+                    source.execute('BEGIN')
+                    source.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+                source.backup(copy, pages=pages, progress=lambda *_: sleep(pause))
+                if snapshot:
+                    source.execute('COMMIT')
+            finally:
+                copy.close()
+                source.close()
+            os.replace(temporary, target)
+            result[database] = target
+        return result
+
+    def optimize(self, full=False, limit=None, pause=None):
+        """
+        Метод для обновления статистики планировщика запросов справочной БД, шардов и их архивов.
+        По умолчанию выполняется PRAGMA optimize (анализируются только таблицы, статистика которых
+        устарела), при full - ANALYZE каждой индексированной таблицы отдельной транзакцией с паузой
+        pause секунд между таблицами. Анализ ограничен limit строками индекса (PRAGMA analysis_limit).
+
+        :param full: анализировать все индексированные таблицы
+        :param limit: ограничение анализа (по умолчанию - DB_ANALYSIS_LIMIT, 0 - без ограничения)
+        :param pause: пауза между таблицами в секундах (по умолчанию - DB_MAINTENANCE_PAUSE)
+        :return: словарь {путь к файлу БД: количество проанализированных таблиц или None для PRAGMA optimize}
+        """
+        _, pause = self._maintenance_throttle(None, pause)
+        limit = self._app.config['DB_ANALYSIS_LIMIT'] if limit is None else limit
+
+        result = dict()
+        for database in self._maintained_files():
+            connection = self._maintenance_connection(database)
+            try:
+                connection.execute(f'PRAGMA analysis_limit = {int(limit)}')
+                if not full:
+                    connection.execute('PRAGMA optimize')
+                    result[database] = None
+                    continue
+                cur = connection.execute(
+                    "SELECT DISTINCT tbl_name FROM sqlite_master WHERE type = 'index' ORDER BY tbl_name"
+                )
+                tables = [name for (name,) in cur.fetchall()]
+                for table in tables:
+                    connection.execute(f'ANALYZE "{table}"')
+                    sleep(pause)
+                result[database] = len(tables)
+            finally:
+                connection.close()
+        return result
+
+    def vacuum(self, pages=None, pause=None, migrate=False):
+        """
+        Метод для освобождения места, оставшегося после удаления данных, в справочной БД, шардах
+        и их архивах без остановки приложения (PRAGMA incremental_vacuum). Свободные страницы
+        возвращаются порциями по pages страниц, каждая порция - отдельная короткая транзакция,
+        между порциями выдерживается пауза pause секунд. Файлы, созданные до перехода на инкрементальный
+        режим, пропускаются (их свободные страницы повторно используются при записи, но файл не уменьшается).
+        При migrate такие файлы однократно переводятся в инкрементальный режим полной пересборкой (VACUUM):
+        на время пересборки файла запись в него блокируется (чтение в режиме WAL продолжается),
+        поэтому миграцию следует запускать в период низкой нагрузки.
+
+        :param pages: количество страниц за одну транзакцию (по умолчанию - DB_MAINTENANCE_PAGES)
+        :param pause: пауза между транзакциями в секундах (по умолчанию - DB_MAINTENANCE_PAUSE)
+        :param migrate: перевести файлы без инкрементального режима в него (однократная пересборка)
+        :return: словарь {путь к файлу БД: количество освобождённых страниц или None, если режим не включён}
+        """
+        pages, pause = self._maintenance_throttle(pages, pause)
+
+        result = dict()
+        for database in self._maintained_files():
+            connection = self._maintenance_connection(database)
+            try:
+                freed = 0
+                if connection.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                    if not migrate:
+                        result[database] = None
+                        continue
+                    # Режим auto_vacuum существующего файла меняется только пересборкой
+                    freed = connection.execute('PRAGMA freelist_count').fetchone()[0]
+                    connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                    connection.execute('VACUUM')
+                free = connection.execute('PRAGMA freelist_count').fetchone()[0]
+                while free:
+                    # execute выполняет один шаг инструкции (одна страница), executescript - до завершения
+                    connection.executescript(f'PRAGMA incremental_vacuum({min(pages, free)})')
+                    left = connection.execute('PRAGMA freelist_count').fetchone()[0]
+                    if left >= free:
+                        break
+                    freed += free - left
+                    free = left
+                    sleep(pause)
+                # Файл БД в режиме WAL уменьшается при переносе журнала, ожидающие читатели не блокируются
+                connection.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchall()
+                result[database] = freed
+            finally:
+                connection.close()
+        return result
+
+    def migrate_categories(self):
+        """
+        Метод для создания уникального индекса имён категорий в справочной БД и шардах, созданных
+        до его появления. Повторяющиеся имена не изменяются: если они есть хотя бы в одной БД, индекс
+        не создаётся ни в одной из них, а повторы возвращаются для ручного устранения (переименование
+        или удаление категорий через API).
+
+        :return: словарь {путь к файлу БД: список повторов (см. category_duplicates)}, пустой - индекс создан
+        """
+        databases = self._layout_files(self.shards, self.generation)
+        directory = self._app.config['DB_CONNECTION']
+        if directory not in databases:
+            databases = [directory, *databases]
+
+        duplicates = dict()
+        for database in databases:
+            connection = sqlite.connect(database)
+            try:
+                found = category_duplicates(connection)
+            finally:
+                connection.close()
+            if found:
+                duplicates[database] = found
+        if duplicates:
+            return duplicates
+
+        for database in databases:
+            connection = sqlite.connect(database, timeout=self._app.config['DB_POOL_TIMEOUT'])
+            try:
+                with connection:
+                    connection.execute(CATEGORY_NAME_INDEX)
+            finally:
+                connection.close()
+        return duplicates
+
+    @staticmethod
+    def overloaded(error):
+        """
+        Обработчик исчерпания пула соединений (и таймаута очереди записи): запрос можно повторить позже.
+
+        :param error: PoolTimeoutError или WriteQueueTimeoutError
+        :return: ответ 503
+        """
+        return '', 503, {'Retry-After': '1'}
 
     def close_db(self, exception):
-        if self._connection is not None:
-            self._connection.close()
-            self._connection = None
+        connections = g.pop('_db_connections', dict())
+        for key, connection in connections.items():
+            self._pools[key].release(connection)
+
+    def _get_connection(self, database, read_only=False):
+        """
+        Метод для получения соединения с БД, закреплённого за контекстом приложения.
+
+        :param database: путь к файлу БД
+        :param read_only: соединение только для чтения
+        :return: соединение с БД
+        """
+        if self.memory is not None:
+            return self.memory
+
+        key = (database, read_only)
+        connections = g.setdefault('_db_connections', dict())
+        if key not in connections:
+            connections[key] = self._get_pool(database, read_only).acquire()
+        return connections[key]
+
+    def _get_pool(self, database, read_only):
+        key = (database, read_only)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                config = self._app.config
+                if database != config['DB_CONNECTION']:
+                    self._init_shard(database)
+                size = config['DB_READ_POOL_SIZE'] if read_only else config['DB_POOL_SIZE']
+                pool = ConnectionPool(database, size, config['DB_POOL_TIMEOUT'], read_only=read_only)
+                self._pools[key] = pool
+            return pool
+
+    def _init_shard(self, database, generation=None, index=None):
+        """
+        Метод для создания файла шарда и приведения его схемы к актуальному состоянию.
+        Каждому шарду каждого поколения раскладки выделяется собственный диапазон идентификаторов,
+        поэтому при последующих перераспределениях идентификаторы не пересекаются.
+
+        :param database: путь к файлу шарда
+        :param generation: поколение раскладки (по умолчанию - текущая раскладка)
+        :param index: номер шарда в раскладке
+        :return: nothing
+        """
+        generation = self.generation if generation is None else generation
+        if index is None:
+            index = self._layout_files(self.shards, generation).index(database)
+        base = ((generation << self.SHARD_BITS) | index) << self.SHARD_ID_BITS
+
+        directory = os.path.dirname(os.path.abspath(database))
+        os.makedirs(directory, exist_ok=True)
+        connection = sqlite.connect(database)
+        try:
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.execute(f'PRAGMA journal_mode = {self._app.config["DB_JOURNAL_MODE"]}')
+            apply_schema(connection, SHARD_SCHEMA)
+            with connection:
+                for table in SHARDED_TABLES:
+                    connection.execute(
+                        '''
+                        INSERT INTO sqlite_sequence (name, seq)
+                        SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)
+                        ''',
+                        (table, base, table),
+                    )
+        finally:
+            connection.close()
+
+    def _init_archive(self, database, year):
+        """
+        Метод для создания файла архива и его годовой таблицы.
+
+        :param database: путь к файлу архива
+        :param year: год
+        :return: nothing
+        """
+        os.makedirs(os.path.dirname(database), exist_ok=True)
+        connection = sqlite.connect(database)
+        try:
+            connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            connection.execute(f'PRAGMA journal_mode = {self._app.config["DB_JOURNAL_MODE"]}')
+            apply_schema(connection, archive_schema(year))
+        finally:
+            connection.close()
+
+    def _maintained_files(self):
+        """
+        Метод для получения списка существующих файлов справочной БД, шардов и их архивов.
+
+        :return: список путей к файлам БД
+        """
+        databases = self._layout_files(self.shards, self.generation)
+        # Справочная БД (пользователи, раскладка шардов) обслуживается и при хранении данных в шардах
+        directory = self._app.config['DB_CONNECTION']
+        if directory not in databases:
+            databases = [directory, *databases]
+        archives = set()
+        for database in databases:
+            connection = sqlite.connect(database)
+            try:
+                archives.update(path for (path,) in connection.execute('SELECT path FROM archive'))
+            finally:
+                connection.close()
+        return [database for database in [*databases, *sorted(archives)] if os.path.exists(database)]
+
+    def _maintenance_connection(self, database):
+        """
+        Метод для открытия соединения обслуживания БД (в режиме автофиксации, с ожиданием блокировок).
+
+        :param database: путь к файлу БД
+        :return: соединение с БД
+        """
+        return sqlite.connect(database, isolation_level=None, timeout=self._app.config['DB_POOL_TIMEOUT'])
+
+    def _maintenance_throttle(self, pages, pause):
+        config = self._app.config
+        pages = config['DB_MAINTENANCE_PAGES'] if pages is None else pages
+        pause = config['DB_MAINTENANCE_PAUSE'] if pause is None else pause
+        if pages <= 0 or pause < 0:
+            raise ValueError(pages, pause)
+        return pages, pause
+
+    def _layout_files(self, shards, generation):
+        """
+        Метод для получения списка файлов раскладки шардов.
+
+        :param shards: количество шардов
+        :param generation: поколение раскладки
+        :return: список путей к файлам БД (индекс в списке - номер шарда)
+        """
+        if not shards:
+            return [self._app.config['DB_CONNECTION']]
+        return [self.shard_path(index, shards, generation) for index in range(shards)]
+
+    def _clear_directory(self):
+        """
+        Метод для очистки устаревших категорий и операций в справочной БД
+        перед переносом в неё данных из шардов и после переноса данных в шарды.
+
+        :return: nothing
+        """
+        connection = sqlite.connect(self._app.config['DB_CONNECTION'])
+        try:
+            with connection:
+                for table in ('operation', 'category'):
+                    connection.execute(f'DELETE FROM {table}')
+        finally:
+            connection.close()
 
 
 db = SqliteDB()
@@ -0,0 +1,157 @@
+from contextlib import contextmanager
+from math import ceil
+from threading import Lock
+from time import monotonic, time
+
+from exceptions import ServiceError
+from flask import current_app
+
+
+class AdmissionServiceError(ServiceError):
+    service = 'admission'
+
+
+class ReportThrottledError(AdmissionServiceError):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason, retry_after)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ReportAdmission:
+    """
+    Вспомогательный класс для допуска запросов отчёта по операциям с учётом их стоимости.
+
+    Стоимость отчёта оценивается в строках: количество строк до конца запрошенной страницы
+    (page * page_size, с учётом сдвига страницы), умноженное на долю периода отчёта от REPORT_COST_RANGE_DAYS
+    (1 для неограниченного снизу периода) и на (1 + количество категорий отбора / REPORT_COST_SUBTREE).
+    У каждого пользователя ограничено количество одновременно формируемых отчётов (REPORT_USER_CONCURRENCY)
+    и бюджет стоимости - "ведро токенов" ёмкостью REPORT_BUDGET_BURST, пополняемое со скоростью
+    REPORT_BUDGET_RATE строк в секунду. Запрос сверх ограничений сразу отклоняется с указанием
+    времени, через которое его можно повторить.
+    """
+    # Количество отслеживаемых пользователей, при превышении которого удаляются полные вёдра
+    PRUNE_THRESHOLD = 4096
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.concurrency = 0
+        self.rate = 0
+        self.burst = 0
+        self.range = 0
+        self.subtree = 0
+        self._in_flight = {}
+        self._buckets = {}
+        self._metrics = dict.fromkeys(
+            ('admitted', 'throttled_concurrency', 'throttled_budget', 'throttled_cost', 'in_flight'), 0)
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['REPORT_ADMISSION']
+        self.concurrency = config['REPORT_USER_CONCURRENCY']
+        self.rate = config['REPORT_BUDGET_RATE']
+        self.burst = config['REPORT_BUDGET_BURST']
+        self.range = config['REPORT_COST_RANGE_DAYS'] * 86400
+        self.subtree = config['REPORT_COST_SUBTREE']
+
+    def cost(self, scope):
+        """
+        Метод для оценки стоимости отчёта.
+
+        :param scope: параметры отчёта (page, page_size, from_date, to_date, categories - список категорий
+                      отбора, см. TransactionsService.report_scope)
+        :return: стоимость отчёта в строках (не больше ёмкости бюджета, чтобы отчёт мог быть допущен)
+        """
+        rows = max(scope['page'], 1) * max(scope['page_size'], 1)
+        share = 1
+        if scope['from_date'] and self.range:
+            width = (scope['to_date'] or int(time())) - scope['from_date']
+            share = min(1, max(width, 86400) / self.range)
+        cost = rows * share * (1 + len(scope['categories']) / self.subtree)
+        return min(max(1, cost), self.burst)
+
+    @contextmanager
+    def admit(self, user_id, scope):
+        """
+        Контекстный менеджер допуска отчёта пользователя: бюджет списывается при допуске,
+        место среди одновременно формируемых отчётов занимается на время формирования.
+
+        :param user_id: идентификатор пользователя
+        :param scope: параметры отчёта (см. cost)
+        :return: nothing or raise ReportThrottledError
+        """
+        if not self.enabled:
+            yield
+            return
+        cost = self.cost(scope)
+        with self._lock:
+            reason, retry_after = self._reserve(user_id, cost)
+            if reason is not None:
+                self._metrics[f'throttled_{reason}'] += 1
+                self._metrics['throttled_cost'] += round(cost)
+            else:
+                self._metrics['admitted'] += 1
+                self._metrics['in_flight'] += 1
+        if reason is not None:
+            current_app.logger.warning('report throttled: user_id=%s reason=%s cost=%d retry_after=%d',
+                                       user_id, reason, cost, retry_after)
+            raise ReportThrottledError(reason, retry_after)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._metrics['in_flight'] -= 1
+                if self._in_flight[user_id] == 1:
+                    del self._in_flight[user_id]
+                else:
+                    self._in_flight[user_id] -= 1
+
+    def metrics(self):
+        """
+        Метод для получения счётчиков допуска отчётов (текущего процесса).
+
+        :return: словарь счётчиков: admitted, throttled_concurrency, throttled_budget,
+                 throttled_cost (суммарная стоимость отклонённых отчётов), in_flight
+        """
+        with self._lock:
+            return dict(self._metrics)
+
+    def _reserve(self, user_id, cost):
+        """
+        Метод для проверки ограничений и резервирования бюджета и места отчёта (под блокировкой).
+
+        :param user_id: идентификатор пользователя
+        :param cost: стоимость отчёта
+        :return: (причина отказа concurrency/budget или None, время до повтора в секундах)
+        """
+        if self._in_flight.get(user_id, 0) >= self.concurrency:
+            return 'concurrency', 1
+        now = monotonic()
+        tokens, updated = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < cost:
+            self._buckets[user_id] = (tokens, now)
+            return 'budget', ceil((cost - tokens) / self.rate)
+        if user_id not in self._buckets and len(self._buckets) >= self.PRUNE_THRESHOLD:
+            self._prune(now)
+        self._buckets[user_id] = (tokens - cost, now)
+        self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+        return None, 0
+
+    def _prune(self, now):
+        """
+        Метод для удаления вёдер, успевших пополниться полностью (равнозначны отсутствующим).
+
+        :param now: текущее время (monotonic)
+        :return: nothing
+        """
+        self._buckets = {
+            user_id: (tokens, updated) for user_id, (tokens, updated) in self._buckets.items()
+            if tokens + (now - updated) * self.rate < self.burst
+        }
+
+
+report_admission = ReportAdmission()
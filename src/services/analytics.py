@@ -0,0 +1,258 @@
+from collections import OrderedDict
+from decimal import Decimal
+from threading import Lock
+
+import numpy as np
+from exceptions import ServiceError
+from services.storage import get_storage
+from services.transactions import TransactionsService
+
+
+class AnalyticsServiceError(ServiceError):
+    service = 'analytics'
+
+
+class AnalyticsInvalidParameterError(AnalyticsServiceError):
+    pass
+
+
+class UserColumns:
+    """
+    Колоночное представление всех операций пользователя, отсортированных по дате.
+    Суммы хранятся в виде целого числа копеек со знаком (доход "+", расход "-").
+    """
+    __slots__ = ('dates', 'amounts', 'category_ids', 'category_names')
+
+    def __init__(self, dates, amounts, category_ids, category_names):
+        self.dates = dates
+        self.amounts = amounts
+        self.category_ids = category_ids
+        self.category_names = category_names
+
+
+class ColumnsCache:
+    """
+    Потокобезопасный LRU-кэш колоночных данных пользователей.
+    Запись актуальна, пока не изменилась версия данных пользователя.
+    """
+    def __init__(self, size=128):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None or item[0] != version:
+                return None
+            self._items.move_to_end(user_id)
+            return item[1]
+
+    def put(self, user_id, version, columns):
+        with self._lock:
+            self._items[user_id] = (version, columns)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+cache = ColumnsCache()
+
+
+class AnalyticsService:
+    # Допустимые интервалы группировки
+    BUCKETS = ('day', 'week', 'month')
+
+    def __init__(self, connection):
+        self.storage = get_storage(connection)
+        self._transactions = TransactionsService(connection)
+
+    def get_analytics(self, filters, user_id):
+        """
+        Метод, реализующий бизнес-логику эндпоинта получения аналитики по операциям пользователя.
+
+        :param filters: словарь, включающий в себя query-параметры
+        :param user_id: идентификатор авторизованного пользователя
+        :return:        Аналитика включает в себя:
+                        Итоговую сумму, сумму доходов и расходов, количество операций;
+                        Статистику расходов (среднее, медиана, процентиль);
+                        Статистику по интервалам группировки с остатком на конец интервала;
+                        Топ категорий по сумме расходов.
+        """
+        try:
+            category_id = filters.get('category_id', None, type=int)
+            from_date = filters.get('from', None, type=int)
+            to_date = filters.get('to', None, type=int)
+            top = int(filters.get('top', 5))
+            percentile = float(filters.get('percentile', 90))
+        except (TypeError, ValueError):
+            raise AnalyticsInvalidParameterError()
+
+        period = filters.get('period', None)
+        bucket = filters.get('bucket', 'month')
+        if bucket not in self.BUCKETS or top < 0 or not 0 <= percentile <= 100:
+            raise AnalyticsInvalidParameterError()
+
+        if period is not None:
+            period_range = self._transactions.get_period(period)
+            from_date = period_range['from']
+            to_date = period_range['to']
+
+        columns = self._get_columns(user_id)
+
+        # Фильтр по поддереву категорий
+        mask = np.ones(columns.dates.size, dtype=bool)
+        if category_id is not None:
+            subtree = self._transactions.get_categories(user_id, category_id)
+            mask &= np.isin(columns.category_ids, [category['id'] for category in subtree])
+
+        # Остаток считается по всей истории, а в отчёт попадает только запрошенный период
+        balance = np.cumsum(np.where(mask, columns.amounts, 0))
+        if from_date:
+            mask &= columns.dates >= from_date
+        if to_date:
+            mask &= columns.dates < to_date
+
+        dates = columns.dates[mask]
+        amounts = columns.amounts[mask]
+        category_ids = columns.category_ids[mask]
+        balance = balance[mask]
+        expenses = -amounts[amounts < 0]
+
+        return {
+            'total': self._money(amounts.sum()),
+            'income': self._money(amounts[amounts > 0].sum()),
+            'expense': self._money(expenses.sum()),
+            'count': int(amounts.size),
+            'expense_stats': self._stats(expenses, percentile),
+            'buckets': self._buckets(dates, amounts, balance, bucket, percentile),
+            'top_categories': self._top_categories(category_ids, amounts, columns.category_names, top, percentile),
+        }
+
+    def _get_columns(self, user_id):
+        """
+        Метод для получения колоночных данных пользователя из кэша,
+        либо их загрузки из БД одним запросом при изменении версии данных.
+
+        :param user_id: идентификатор пользователя
+        :return: UserColumns
+        """
+        version = self.storage.data_version(user_id)
+
+        columns = cache.get(user_id, version)
+        if columns is not None:
+            return columns
+
+        rows = self.storage.operation_columns(user_id)
+        data = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        names = {category['id']: category['name'] for category in self.storage.list_categories(user_id)}
+
+        columns = UserColumns(
+            dates=np.ascontiguousarray(data[:, 0]),
+            amounts=np.ascontiguousarray(data[:, 1]),
+            category_ids=np.ascontiguousarray(data[:, 2]),
+            category_names=names,
+        )
+        cache.put(user_id, version, columns)
+        return columns
+
+    def _buckets(self, dates, amounts, balance, bucket, percentile):
+        """
+        Метод для расчёта статистики по интервалам группировки.
+
+        :param dates: даты операций (timestamp, по возрастанию)
+        :param amounts: суммы операций в копейках со знаком
+        :param balance: остаток после каждой операции
+        :param bucket: интервал группировки (day, week, month)
+        :param percentile: процентиль расходов
+        :return: список интервалов в хронологическом порядке
+        """
+        if not dates.size:
+            return []
+
+        days = dates // 86400
+        if bucket == 'day':
+            keys = days
+        elif bucket == 'week':
+            keys = days - (days + 3) % 7    # 01.01.1970 - четверг, сдвиг к понедельнику
+        else:
+            keys = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+        starts, index, counts = np.unique(keys, return_index=True, return_counts=True)
+        ends = index + counts - 1
+
+        result = []
+        for start, first, last in zip(starts, index, ends):
+            chunk = amounts[first:last + 1]
+            if bucket == 'month':
+                start = np.datetime64(int(start), 'M').astype('datetime64[s]').astype(np.int64)
+            else:
+                start = start * 86400
+            result.append({
+                'from': int(start),
+                'count': int(chunk.size),
+                'income': self._money(chunk[chunk > 0].sum()),
+                'expense': self._money(-chunk[chunk < 0].sum()),
+                'balance': self._money(balance[last]),
+                'expense_stats': self._stats(-chunk[chunk < 0], percentile),
+            })
+        return result
+
+    def _top_categories(self, category_ids, amounts, names, top, percentile):
+        """
+        Метод для получения категорий с наибольшей суммой расходов.
+
+        :param category_ids: идентификаторы категорий операций (0 - без категории)
+        :param amounts: суммы операций в копейках со знаком
+        :param names: словарь имён категорий пользователя
+        :param top: количество категорий в ответе
+        :param percentile: процентиль расходов
+        :return: список категорий по убыванию суммы расходов
+        """
+        spent = (amounts < 0) & (category_ids != 0)
+        category_ids = category_ids[spent]
+        expenses = -amounts[spent]
+        if not expenses.size or not top:
+            return []
+
+        ids, inverse = np.unique(category_ids, return_inverse=True)
+        sums = np.bincount(inverse, weights=expenses)
+        order = np.argsort(-sums, kind='stable')[:top]
+
+        result = []
+        for position in order:
+            chunk = expenses[inverse == position]
+            result.append({
+                'id': int(ids[position]),
+                'name': names.get(int(ids[position])),
+                'expense': self._money(sums[position]),
+                'expense_stats': self._stats(chunk, percentile),
+            })
+        return result
+
+    def _stats(self, values, percentile):
+        """
+        Метод для расчёта статистики по набору сумм.
+
+        :param values: суммы в копейках
+        :param percentile: процентиль
+        :return: количество, среднее, медиана и процентиль
+        """
+        if not values.size:
+            return {'count': 0, 'mean': None, 'median': None, 'percentile': None}
+        return {
+            'count': int(values.size),
+            'mean': self._money(values.mean()),
+            'median': self._money(np.median(values)),
+            'percentile': self._money(np.percentile(values, percentile)),
+        }
+
+    @staticmethod
+    def _money(cents):
+        """
+        Утилита для преобразования суммы в копейках в строковое представление.
+
+        :param cents: сумма в копейках
+        :return: сумма в формате "рубли.копейки"
+        """
+        return str(Decimal(int(round(float(cents)))).scaleb(-2))
@@ -1,5 +1,9 @@
 from exceptions import ServiceError
-from werkzeug.security import check_password_hash
+from services.passwords import (
+    hasher,
+    PasswordHasherOverloadedError
+)
+from services.storage import get_storage
 
 
 class AuthServiceError(ServiceError):
@@ -15,21 +19,52 @@ class UserDoesNotExistError(AuthServiceError):
 
 
 class AuthService:
-    def __init__(self, connection):
-        self.connection = connection
+    """
+    Авторизация выполняется по шагам, чтобы соединение с БД не удерживалось во время хеширования пароля:
+    поиск пользователя (find_user), проверка пароля без обращения к БД (check_password)
+    и, при необходимости, запись пересчитанного хеша (set_password).
+    """
+    def __init__(self, connection=None):
+        self.storage = get_storage(connection) if connection is not None else None
 
-    def login(self, email, password):
+    def find_user(self, email):
         """
-        Метод авторизации пользователя.
+        Метод для поиска пользователя по логину.
 
         :param email: логин (e-mail)
-        :param password: пароль
-        :return: идентификатор пользователя
+        :return: параметры пользователя (id, password)
         """
-        cur = self.connection.execute(f'SELECT id, password FROM user WHERE email = "{email}"')
-        user = cur.fetchone()
+        user = self.storage.get_user_by_email(email)
         if user is None:
             raise UserDoesNotExistError(email)
-        if not check_password_hash(user['password'], password):
-            raise AuthorizationFailedError(email)
-        return user['id']
+        return user
+
+    @staticmethod
+    def check_password(user, password):
+        """
+        Метод для проверки пароля пользователя.
+
+        :param user: параметры пользователя (см. find_user)
+        :param password: пароль
+        :return: пересчитанный хеш пароля, если хеш требуется обновить (иначе None)
+        """
+        if not hasher.check(user['password'], password):
+            raise AuthorizationFailedError(user['id'])
+
+        # Пересчёт хеша при изменении настроек алгоритма/стоимости хеширования
+        if hasher.needs_rehash(user['password']):
+            try:
+                return hasher.hash(password)
+            except PasswordHasherOverloadedError:
+                pass    # Хеш будет пересчитан при следующей авторизации
+        return None
+
+    def set_password(self, user_id, password_hash):
+        """
+        Метод для записи пересчитанного хеша пароля.
+
+        :param user_id: идентификатор пользователя
+        :param password_hash: хеш пароля
+        :return: nothing
+        """
+        self.storage.set_password(user_id, password_hash)
@@ -1,10 +1,5 @@
-import sqlite3 as sqlite
 from exceptions import ServiceError
-from services.helper import (
-    insert,
-    update,
-    delete
-)
+from services.storage import get_storage
 
 
 class CategoryServiceError(ServiceError):
@@ -37,7 +32,7 @@ class CategoryAccessDeniedError(CategoryServiceError):
 
 class CategoriesService:
     def __init__(self, connection):
-        self.connection = connection
+        self.storage = get_storage(connection)
 
     def patch_category(self, data, category_id, user_id):
         """
@@ -48,34 +43,20 @@ class CategoriesService:
         :param user_id: идентификатор пользователя
         :return: параметры отредактированной категории
         """
-        # Проверка на существование категории и её принадлежность пользователю
-        self._is_owner(category_id, user_id)
-
-        # Получение полей запроса
-        name = data.get('name', None)
-        parent_id = data.get('parent_id', -1)
-
-        # Проверка наличия параметра "parent_id" в запросе
-        if parent_id is not None:
-            if parent_id > 0:
-                # Проверка на существование родительской категории и её принадлежность пользователю
+        # Обновление параметров категории одной инструкцией: категория и новая родительская категория должны
+        # принадлежать пользователю, дублирование имени в дереве пользователя отсекается уникальным индексом
+        patched = self.storage.update_category(category_id, data, user_id)
+        if patched is None:
+            # Выяснение причины отказа требует дополнительных запросов только в этом случае
+            self._is_owner(category_id, user_id)
+            parent_id = data.get('parent_id')
+            if parent_id is not None and parent_id > 0:
                 self._is_owner(parent_id, user_id)
-        else:
-            # В случае запроса на преобразование в категорию верхнего уровня (передано null)
-            data['parent_id'] = None
-
-        # Проверка наличия/дублирования категории с параметром "name" в дереве пользователя
-        if name is not None:
-            duplicate = self._duplicated_name(name, user_id, category_id)
-            if duplicate is not None:
-                raise CategoryPatchError
-
-        # Обновление параметров категории
-        is_patched = update('category', data, category_id, self.connection)
-        if not is_patched:
             raise CategoryPatchError
         else:
-            patched = self._get_category_by_id(category_id)
+            # Переименование и перенос меняют сохранённые пути категории и всех её подкатегорий
+            if 'name' in data or 'parent_id' in data:
+                self.storage.refresh_paths(user_id, category_id)
             patched.pop('user_id')
             return patched
 
@@ -91,33 +72,22 @@ class CategoriesService:
         user_id = data.get('user_id', None)
         parent_id = data.get('parent_id', None)
 
-        # Проверка на существование и принадлежность родительской категории пользователю
-        if parent_id is not None:
-            self._is_owner(parent_id, user_id)
-
-        # Поиск дублирующихся категорий по имени
-        category = self._duplicated_name(name, user_id)
-
-        # Проверка на полную копию
-        if category is not None:
-            if category['parent_id'] == parent_id:
-                raise CategoryFullCopyError     # Полная копия
-            else:
-                raise CategoryCreateError       # Конфликт полей parent_id
-
-        # Запись в БД
-        category_id = insert('category', data, self.connection)
+        # Запись в БД: проверка родительской категории и дубликата по имени выполняются при вставке
+        category_id = self.storage.add_category(data)
         if category_id is None:
-            raise CategoryCreateError
-
-        # Получение записанной категории из БД
-        created = self._get_category_by_id(category_id)
+            # Выяснение причины отказа требует дополнительных запросов только в этом случае
+            if parent_id is not None:
+                self._is_owner(parent_id, user_id)
+            category = self._duplicated_name(name, user_id)
+            if category is not None and category['parent_id'] == parent_id:
+                raise CategoryFullCopyError     # Полная копия
+            raise CategoryCreateError           # Конфликт полей parent_id
 
         # Формирование требуемого ответа
-        created.pop('user_id')
-        if created.get('parent_id') is None:
-            created.pop('parent_id')
-        return dict(created)
+        created = {'id': category_id, 'name': name}
+        if parent_id is not None:
+            created['parent_id'] = parent_id
+        return created
 
     def delete_category(self, category):
         """
@@ -133,22 +103,36 @@ class CategoriesService:
         # Проверка на существование и принадлежность категории пользователю
         self._is_owner(category_id, user_id)
 
-        # Переделываем все связанные операции в безкатегорийные
-        data = {'category_id': None}
-        success = update('operation', data, category_id, self.connection, 'category_id')
-        if not success:
-            raise CategoryDeleteError
+        # Удаление категории вместе со всеми её подкатегориями
+        if category.get('recursive'):
+            self._delete_subtree(category_id, user_id, category.get('reassign_to'))
+            return
 
-        # Делаем дочерние категории родительскими
-        data = {'parent_id': None}
-        success = update('category', data, category_id, self.connection, 'parent_id')
+        # Операции категории становятся безкатегорийными, дочерние категории - родительскими
+        success = self.storage.delete_category(category_id)
         if not success:
             raise CategoryDeleteError
 
-        # Удаляем категорию
-        success = delete('category', category_id, self.connection)
-        if not success:
-            raise CategoryDeleteError
+    def _delete_subtree(self, category_id, user_id, reassign_to=None):
+        """
+        Метод для удаления категории вместе со всеми её подкатегориями.
+        Операции удаляемого поддерева становятся безкатегорийными, либо переносятся
+        в категорию reassign_to. Все изменения выполняются в рамках одной транзакции.
+
+        :param category_id: идентификатор корня удаляемого поддерева
+        :param user_id: идентификатор пользователя
+        :param reassign_to: идентификатор категории для переноса операций (не обязательно)
+        :return: nothing
+        """
+        # Проверка категории для переноса операций: должна принадлежать пользователю и не входить в поддерево
+        if reassign_to is not None:
+            self._is_owner(reassign_to, user_id)
+            subtree = self.storage.subtree(user_id, category_id)
+            if any(category['id'] == reassign_to for category in subtree):
+                raise CategoryDeleteError(reassign_to)
+
+        if not self.storage.delete_subtree(user_id, category_id, reassign_to):
+            raise CategoryDeleteError(category_id)
 
     def get_category(self, data):
         """
@@ -180,12 +164,11 @@ class CategoriesService:
         user_id = category.get('user_id')
         name = category.get('name')
 
-        cur = self.connection.execute(f'SELECT * FROM category WHERE name = "{name}" AND user_id = "{user_id}"')
-        category = cur.fetchone()
+        category = self.storage.find_category(user_id, name)
         if not category:
-            raise CategoryDoesNotExistError(category)
+            raise CategoryDoesNotExistError(name)
         else:
-            return dict(category)
+            return category
 
     def _get_category_by_id(self, category_id):
         """
@@ -194,12 +177,11 @@ class CategoriesService:
         :param category_id: идентификатор категории
         :return: параметры запрашиваемой категории
         """
-        cur = self.connection.execute(f'SELECT * FROM category WHERE id = "{category_id}"')
-        category = cur.fetchone()
+        category = self.storage.get_category(category_id)
         if not category:
             raise CategoryDoesNotExistError(category_id)
         else:
-            return dict(category)
+            return category
 
     def _is_owner(self, category_id, user_id):
         """
@@ -222,17 +204,10 @@ class CategoriesService:
 
         :param name: имя категории
         :param user_id: идентификатор пользователя
+        :param category_id: идентификатор редактируемой категории (не считается дубликатом)
         :return: параметры категории или None
         """
-        data = dict()
-        data['name'] = name
-        data['user_id'] = user_id
-        try:
-            category = self._get_category(data)
-        except CategoryDoesNotExistError:
+        category = self.storage.find_category(user_id, name)
+        if category is None or category['id'] == category_id:
             return None
-        else:
-            if category['id'] == category_id:   # Если найденный дубликат является редактируемой категорией
-                return None
-            else:
-                return category
+        return category
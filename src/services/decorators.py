@@ -2,6 +2,7 @@ from functools import wraps
 
 from database import db
 from flask import session
+from services.storage import get_storage
 
 
 def auth_required(view_func):
@@ -10,14 +11,9 @@ def auth_required(view_func):
         user_id = session.get('user_id')
         if not user_id:
             return '', 401
-        with db.connection as con:
-            cur = con.execute(
-                'SELECT id '
-                'FROM user '
-                'WHERE id = ?',
-                (user_id,),
-            )
-            user = cur.fetchone()
+        # Соединение не закрепляется за запросом: обработчик может долго ждать (long polling заданий отчёта)
+        with db.transient(read_only=True) as con:
+            user = get_storage(con).get_user(user_id)
         if not user:
             return '', 403
         return view_func(*args, **kwargs, user=user)
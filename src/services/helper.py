@@ -1,7 +1,9 @@
 import sqlite3 as sqlite
 
+from database import RETURNING_SUPPORTED, select_row
 
-def insert(table, data, connection):
+
+def insert(table, data, connection, returning=None):
     """
     Функция для записи данных в таблицу БД через словарь, когда названия его ключей
     совпадают с названиями полей таблицы.
@@ -9,7 +11,8 @@ def insert(table, data, connection):
     :param table: имя таблицы
     :param data: словарь с записываемыми данными
     :param connection: соединение с БД
-    :return: идентификатор записи
+    :param returning: поля записанной строки, возвращаемые вместо идентификатора записи
+    :return: идентификатор записи (или словарь полей returning), None при нарушении ограничений БД
     """
     # Создание списков ключей и значений
     keys = ', '.join(f'{key}' for key in data.keys())
@@ -18,16 +21,21 @@ def insert(table, data, connection):
     # Попытка записи в БД
     try:
         connection.execute('PRAGMA foreign_keys = ON')
-        cur = connection.execute(f'INSERT INTO {table} ({keys}) VALUES ({values})')
+        sql = f'INSERT INTO {table} ({keys}) VALUES ({values})'
+        if returning is not None and RETURNING_SUPPORTED:
+            return dict(connection.execute(f'{sql} RETURNING {", ".join(returning)}').fetchall()[0])
+        cur = connection.execute(sql)
         instance_id = cur.lastrowid
     except sqlite.IntegrityError:
         connection.rollback()
         return None
     else:
+        if returning is not None:
+            return select_row(table, returning, instance_id, connection)
         return instance_id
 
 
-def update(table, data, id, connection, ref_id=None):
+def update(table, data, id, connection, ref_id=None, returning=None, where=None):
     """
     Функция для обновления данных в таблице БД через словарь, когда названия его ключей
     совпадают с названиями полей таблицы.
@@ -37,40 +45,50 @@ def update(table, data, id, connection, ref_id=None):
     :param id: идентификатор обновляемой записи
     :param connection: соединение с БД
     :param ref_id: поле, по которому проверяется условие (по умолчанию - "id")
-    :return: результат выполнения (True/False)
+    :param returning: поля обновлённой записи (по идентификатору), возвращаемые вместо результата выполнения
+    :param where: дополнительное условие обновления записи (например, принадлежность записи пользователю)
+    :return: результат выполнения (True/False) или словарь полей returning
+             (None при нарушении ограничений БД или отсутствии подходящей записи)
     """
     records = ', '.join(f'{key} = {quotes(value) if value is not None else "NULL"}' for key, value in data.items())
+    sql = f'''
+        UPDATE {table}
+        SET {records}
+        WHERE {quotes(ref_id) if ref_id is not None else "id"} = {id}{f" AND ({where})" if where else ""}
+    '''
     try:
         connection.execute('PRAGMA foreign_keys = ON')
-        connection.execute(f'''
-            UPDATE {table}
-            SET {records}
-            WHERE {quotes(ref_id) if ref_id is not None else "id"} = {id}
-        ''')
+        if returning is not None and RETURNING_SUPPORTED:
+            rows = connection.execute(f'{sql} RETURNING {", ".join(returning)}').fetchall()
+            return dict(rows[0]) if rows else None
+        cur = connection.execute(sql)
     except sqlite.IntegrityError:
         connection.rollback()
-        return False
+        return None if returning is not None else False
     else:
+        if returning is not None:
+            return select_row(table, returning, id, connection) if cur.rowcount else None
         return True
 
 
-def delete(table, id, connection):
+def delete(table, id, connection, where=None):
     """
     Функция для удаления сущности из таблицы БД по идентификатору.
 
     :param table: имя таблицы
     :param id: идентификатор записи
     :param connection: соединение с БД
-    :return: результат выполнения (True/False)
+    :param where: дополнительное условие удаления записи (например, принадлежность записи пользователю)
+    :return: результат выполнения (True/False); при заданном условии False - в том числе если запись не удалена
     """
     try:
         connection.execute('PRAGMA foreign_keys = ON')
-        connection.execute(f'DELETE FROM {table} WHERE id = {id}')
+        cur = connection.execute(f'DELETE FROM {table} WHERE id = {id}{f" AND ({where})" if where else ""}')
     except sqlite.IntegrityError:
         connection.rollback()
         return False
     else:
-        return True
+        return bool(cur.rowcount) if where else True
 
 
 def quotes(value):
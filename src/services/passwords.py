@@ -0,0 +1,108 @@
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+from exceptions import ServiceError
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash
+)
+
+
+class PasswordServiceError(ServiceError):
+    service = 'passwords'
+
+
+class PasswordHasherOverloadedError(PasswordServiceError):
+    pass
+
+
+class PasswordHasher:
+    """
+    Вспомогательный класс для хеширования и проверки паролей вне потока обработки запроса.
+    Вычисления выполняются в пуле процессов ограниченного размера, а количество ожидающих
+    задач ограничено: при переполнении очереди запрос сразу отклоняется.
+    """
+    def __init__(self, app=None):
+        self.method = None
+        self.salt_length = None
+        self.workers = 0
+        self._slots = None
+        self._executor = None
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.method = self._normalize(config['PASSWORD_HASH_METHOD'])
+        self.salt_length = config['PASSWORD_SALT_LENGTH']
+        self.workers = config['PASSWORD_HASH_WORKERS']
+        self._slots = BoundedSemaphore(config['PASSWORD_HASH_QUEUE_LIMIT'])
+
+    def hash(self, password):
+        """
+        Метод для получения хеша пароля с текущими настройками алгоритма и стоимости.
+
+        :param password: открытый пароль
+        :return: хеш пароля
+        """
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def check(self, password_hash, password):
+        """
+        Метод для проверки пароля по хешу.
+
+        :param password_hash: хеш пароля из БД
+        :param password: открытый пароль
+        :return: True/False
+        """
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        Метод для проверки соответствия хеша текущим настройкам алгоритма и стоимости.
+
+        :param password_hash: хеш пароля из БД
+        :return: True, если хеш требуется пересчитать
+        """
+        return password_hash.split('$', 1)[0] != self.method
+
+    def _run(self, func, *args):
+        """
+        Метод для выполнения функции хеширования в пуле процессов.
+
+        :param func: функция хеширования
+        :param args: аргументы функции
+        :return: результат выполнения функции
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherOverloadedError()
+        try:
+            if not self.workers:
+                return func(*args)
+            return self._get_executor().submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    @staticmethod
+    def _normalize(method):
+        """
+        Утилита для приведения метода к виду, в котором он записывается в хеш
+        (для pbkdf2 - с явным указанием количества итераций).
+
+        :param method: метод хеширования
+        :return: нормализованный метод хеширования
+        """
+        if method.startswith('pbkdf2:') and method.count(':') == 1:
+            method = f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+        return method
+
+
+hasher = PasswordHasher()
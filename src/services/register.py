@@ -1,6 +1,6 @@
 from exceptions import ServiceError
-from werkzeug.security import generate_password_hash
-from services.helper import insert
+from services.passwords import hasher
+from services.storage import get_storage
 
 
 class RegisterServiceError(ServiceError):
@@ -12,8 +12,8 @@ class RegistrationFailedError(RegisterServiceError):
 
 
 class RegisterService:
-    def __init__(self, connection):
-        self.connection = connection
+    def __init__(self, connection=None):
+        self.storage = get_storage(connection) if connection is not None else None
 
     def register(self, new_user):
         """
@@ -22,12 +22,29 @@ class RegisterService:
         :param new_user: параметры нового пользователя
         :return: новый пользователь
         """
-        # Замена открытого пароля на его хеш
-        password_hash = generate_password_hash(new_user['password'])
-        new_user['password'] = password_hash
+        return self.add_user(self.hash_password(new_user))
 
+    @staticmethod
+    def hash_password(new_user):
+        """
+        Метод для замены открытого пароля нового пользователя его хешем
+        (выполняется без соединения с БД, см. RegisterView.post).
+
+        :param new_user: параметры нового пользователя
+        :return: параметры нового пользователя с хешем пароля
+        """
+        new_user['password'] = hasher.hash(new_user['password'])
+        return new_user
+
+    def add_user(self, new_user):
+        """
+        Метод для записи нового пользователя с уже захешированным паролем.
+
+        :param new_user: параметры нового пользователя (см. hash_password)
+        :return: новый пользователь
+        """
         # Запись в БД
-        user_id = insert('user', new_user, self.connection)
+        user_id = self.storage.add_user(new_user)
         if user_id is None:
             raise RegistrationFailedError()
         else:
@@ -0,0 +1,364 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from threading import BoundedSemaphore, Condition, Lock
+from time import monotonic, time
+from uuid import uuid4
+
+from database import ConnectionPool, db
+from exceptions import ServiceError
+from services.serialization import json_dumps
+from services.transactions import PageReportNotExist, TransactionsService
+
+# Схема хранилища результатов заданий: параметры задания и готовые (сериализованные) страницы отчёта
+JOBS_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS report_job (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        filters TEXT NOT NULL,
+        status TEXT NOT NULL,
+        error TEXT,
+        created INTEGER NOT NULL,
+        finished INTEGER,
+        page_size INTEGER NOT NULL,
+        pages_ready INTEGER NOT NULL DEFAULT 0,
+        total_pages INTEGER,
+        total TEXT,
+        total_items INTEGER
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS report_job_created_idx ON report_job (created)',
+    '''
+    CREATE TABLE IF NOT EXISTS report_job_page (
+        job_id TEXT NOT NULL,
+        page INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (job_id, page)
+    ) WITHOUT ROWID
+    ''',
+)
+
+
+class ReportJobsServiceError(ServiceError):
+    service = 'report_jobs'
+
+
+class ReportJobDoesNotExistError(ReportJobsServiceError):
+    pass
+
+
+class ReportJobAccessDeniedError(ReportJobsServiceError):
+    pass
+
+
+class ReportJobInvalidFiltersError(ReportJobsServiceError):
+    pass
+
+
+class ReportJobNotReadyError(ReportJobsServiceError):
+    pass
+
+
+class ReportPageDoesNotExistError(ReportJobsServiceError):
+    pass
+
+
+class ReportJobsOverloadedError(ReportJobsServiceError):
+    pass
+
+
+class ReportJobs:
+    """
+    Вспомогательный класс для формирования отчётов по операциям в фоновых заданиях.
+    Отчёт формируется постранично в пуле потоков ограниченного размера, готовые страницы
+    сохраняются в сериализованном виде в хранилище результатов (отдельная БД SQLite),
+    поэтому повторное чтение страниц не требует обращения к данным пользователя.
+    Количество ожидающих заданий ограничено: при переполнении очереди задание сразу отклоняется.
+    """
+    # Статусы задания
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    # Интервал перепроверки статуса при ожидании (задание может выполняться другим процессом приложения)
+    POLL_INTERVAL = 1
+
+    def __init__(self, app=None):
+        self.database = None
+        self.workers = 0
+        self.page_size = None
+        self.ttl = None
+        self.wait_limit = 0
+        self._app = None
+        self._slots = None
+        self._executor = None
+        self._pool = None
+        self._lock = Lock()
+        self._finished = Condition()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self._app = app
+        self.database = config['REPORT_JOBS_DB']
+        self.workers = config['REPORT_JOB_WORKERS']
+        self.page_size = config['REPORT_JOB_PAGE_SIZE']
+        self.ttl = config['REPORT_JOB_TTL']
+        self.wait_limit = config['REPORT_JOB_WAIT_LIMIT']
+        self._slots = BoundedSemaphore(config['REPORT_JOB_QUEUE_LIMIT'])
+
+    def normalize_filters(self, data):
+        """
+        Метод для приведения фильтров задания из тела запроса к виду query-параметров отчёта.
+        Номер страницы и режим пагинации не указываются (формируются все страницы с подсчётом итогов),
+        размер страницы по умолчанию - REPORT_JOB_PAGE_SIZE.
+
+        :param data: словарь фильтров из тела запроса
+        :return: словарь строковых фильтров
+        """
+        if not isinstance(data, dict):
+            raise ReportJobInvalidFiltersError()
+        filters = {}
+        for key, value in data.items():
+            if value is None or key in ('page', 'pagination', 'with_total'):
+                continue
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            elif isinstance(value, (int, float, str)):
+                value = str(value)
+            else:
+                raise ReportJobInvalidFiltersError(key)
+            filters[key] = value
+        filters.setdefault('page_size', str(self.page_size))
+        return filters
+
+    def submit(self, user_id, filters):
+        """
+        Метод для постановки задания формирования отчёта в очередь.
+        Фильтры должны быть предварительно проверены (см. TransactionsService.check_report_filters).
+
+        :param user_id: идентификатор пользователя
+        :param filters: словарь строковых фильтров отчёта (см. normalize_filters)
+        :return: параметры задания
+        """
+        self.purge()
+        if not self._slots.acquire(blocking=False):
+            raise ReportJobsOverloadedError()
+        try:
+            job_id = uuid4().hex
+            with self._store() as connection:
+                connection.execute(
+                    '''
+                    INSERT INTO report_job (id, user_id, filters, status, created, page_size)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ''',
+                    (job_id, user_id, json.dumps(filters), self.QUEUED, int(time()), int(filters['page_size'])),
+                )
+            self._get_executor().submit(self._run, job_id, user_id, filters)
+        except Exception:
+            self._slots.release()
+            raise
+        return self.get_job(job_id, user_id)
+
+    def get_job(self, job_id, user_id, wait=0):
+        """
+        Метод для получения параметров задания. При wait > 0 ответ откладывается
+        до завершения задания, но не более чем на wait (и REPORT_JOB_WAIT_LIMIT) секунд.
+
+        :param job_id: идентификатор задания
+        :param user_id: идентификатор пользователя
+        :param wait: время ожидания завершения задания в секундах
+        :return: параметры задания
+        """
+        deadline = monotonic() + min(max(wait, 0), self.wait_limit)
+        job = self._get_job(job_id, user_id)
+        while job['status'] in (self.QUEUED, self.RUNNING):
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                break
+            with self._finished:
+                self._finished.wait(min(timeout, self.POLL_INTERVAL))
+            job = self._get_job(job_id, user_id)
+        return job
+
+    def get_page(self, job_id, user_id, page):
+        """
+        Метод для получения готовой страницы отчёта задания.
+
+        :param job_id: идентификатор задания
+        :param user_id: идентификатор пользователя
+        :param page: номер страницы
+        :return: сериализованная страница отчёта (JSON)
+        """
+        job = self._get_job(job_id, user_id)
+        with self._store() as connection:
+            row = connection.execute(
+                'SELECT data FROM report_job_page WHERE job_id = ? AND page = ?', (job_id, page)
+            ).fetchone()
+        if row is not None:
+            return row['data']
+        if job['status'] in (self.QUEUED, self.RUNNING):
+            raise ReportJobNotReadyError(job_id, page)
+        raise ReportPageDoesNotExistError(job_id, page)
+
+    def delete_job(self, job_id, user_id):
+        """
+        Метод для удаления задания и его результатов. Выполняющееся задание прекращается
+        после формирования текущей страницы.
+
+        :param job_id: идентификатор задания
+        :param user_id: идентификатор пользователя
+        :return: nothing
+        """
+        self._get_job(job_id, user_id)
+        with self._store() as connection:
+            connection.execute('DELETE FROM report_job_page WHERE job_id = ?', (job_id,))
+            connection.execute('DELETE FROM report_job WHERE id = ?', (job_id,))
+
+    def purge(self):
+        """
+        Метод для удаления заданий (и их результатов), созданных более REPORT_JOB_TTL секунд назад.
+
+        :return: количество удалённых заданий
+        """
+        expired = int(time()) - self.ttl
+        with self._store() as connection:
+            connection.execute(
+                'DELETE FROM report_job_page WHERE job_id IN (SELECT id FROM report_job WHERE created < ?)',
+                (expired,),
+            )
+            return connection.execute('DELETE FROM report_job WHERE created < ?', (expired,)).rowcount
+
+    def _run(self, job_id, user_id, filters):
+        """
+        Метод для постраничного формирования отчёта задания (выполняется в пуле потоков).
+        Готовые страницы сохраняются по мере формирования.
+
+        :param job_id: идентификатор задания
+        :param user_id: идентификатор пользователя
+        :param filters: словарь строковых фильтров отчёта
+        :return: nothing
+        """
+        try:
+            with self._app.app_context():
+                if not self._update_job(job_id, status=self.RUNNING):
+                    return
+                # Страницы формируются из одного снимка данных пользователя (одна выборка и один подсчёт суммы);
+                # снимок удерживается хранилищем до завершения выгрузки, а не блоком with на всё задание
+                service = TransactionsService(db.read_shard(user_id))
+                try:
+                    with closing(service.report_pages(filters, user_id)) as pages:
+                        for page, report in enumerate(pages, 1):
+                            if not self._put_page(job_id, page, report):
+                                return      # задание удалено
+                except PageReportNotExist:
+                    # Пустой отчёт
+                    self._update_job(job_id, total_pages=0, total='0', total_items=0)
+                self._update_job(job_id, status=self.DONE, finished=int(time()))
+        except Exception as error:
+            self._update_job(job_id, status=self.FAILED, error=type(error).__name__, finished=int(time()))
+        finally:
+            self._slots.release()
+            with self._finished:
+                self._finished.notify_all()
+
+    def _put_page(self, job_id, page, report):
+        """
+        Метод для сохранения готовой страницы отчёта.
+
+        :param job_id: идентификатор задания
+        :param page: номер страницы
+        :param report: страница отчёта
+        :return: True, если задание существует
+        """
+        with self._store() as connection:
+            cur = connection.execute(
+                '''
+                UPDATE report_job
+                SET pages_ready = ?, total_pages = ?, total = ?, total_items = ?
+                WHERE id = ?
+                ''',
+                (page, report['total_pages'], report['total'], report['total_items'], job_id),
+            )
+            if not cur.rowcount:
+                return False
+            connection.execute(
+                'INSERT INTO report_job_page (job_id, page, data) VALUES (?, ?, ?)', (job_id, page, json_dumps(report))
+            )
+        return True
+
+    def _update_job(self, job_id, **fields):
+        """
+        Метод для изменения параметров задания (статус, время завершения, итоги отчёта).
+
+        :param job_id: идентификатор задания
+        :param fields: изменяемые поля задания
+        :return: True, если задание существует
+        """
+        records = ', '.join(f'{key} = ?' for key in fields)
+        with self._store() as connection:
+            cur = connection.execute(f'UPDATE report_job SET {records} WHERE id = ?', (*fields.values(), job_id))
+            return bool(cur.rowcount)
+
+    def _get_job(self, job_id, user_id):
+        """
+        Метод для получения параметров задания с проверкой его принадлежности пользователю.
+
+        :param job_id: идентификатор задания
+        :param user_id: идентификатор пользователя
+        :return: параметры задания
+        """
+        with self._store() as connection:
+            row = connection.execute('SELECT * FROM report_job WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            raise ReportJobDoesNotExistError(job_id)
+        if row['user_id'] != user_id:
+            raise ReportJobAccessDeniedError(job_id)
+        job = dict(row)
+        job['filters'] = json.loads(job['filters'])
+        del job['user_id']
+        return job
+
+    @contextmanager
+    def _store(self):
+        """
+        Контекстный менеджер соединения с хранилищем результатов (изменения фиксируются при выходе).
+
+        :return: соединение с БД
+        """
+        pool = self._get_pool()
+        connection = pool.acquire()
+        try:
+            with connection:
+                yield connection
+        finally:
+            pool.release(connection)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                config = self._app.config
+                os.makedirs(os.path.dirname(os.path.abspath(self.database)), exist_ok=True)
+                pool = ConnectionPool(self.database, config['DB_POOL_SIZE'], config['DB_POOL_TIMEOUT'])
+                connection = pool.acquire()
+                try:
+                    connection.execute('PRAGMA journal_mode = WAL')
+                    with connection:
+                        for statement in JOBS_SCHEMA:
+                            connection.execute(statement)
+                finally:
+                    pool.release(connection)
+                self._pool = pool
+            return self._pool
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='report-job')
+            return self._executor
+
+
+report_jobs = ReportJobs()
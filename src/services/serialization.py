@@ -0,0 +1,72 @@
+import json
+
+from flask import current_app, jsonify
+from flask.json import JSONEncoder as BaseJSONEncoder
+from services.storage.models import Model
+
+try:
+    import orjson
+except ImportError:     # ускоренный кодировщик не установлен, используется стандартный
+    orjson = None
+
+
+class JSONEncoder(BaseJSONEncoder):
+    """
+    Кодировщик JSON приложения (jsonify) с поддержкой компактных моделей записей отчёта.
+    """
+    def default(self, o):
+        if isinstance(o, Model):
+            return o.as_dict()
+        return super().default(o)
+
+
+def json_default(value):
+    """
+    Функция для сериализации компактных моделей записей отчёта (параметр default json.dumps и orjson.dumps).
+
+    :param value: сериализуемое значение
+    :return: словарь полей модели
+    """
+    if isinstance(value, Model):
+        return value.as_dict()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def json_response(data):
+    """
+    Функция для формирования JSON-ответа. При наличии пакета orjson сериализация выполняется им
+    (порядок ключей и формат ответа совпадают с jsonify), иначе - стандартным jsonify.
+
+    :param data: данные ответа
+    :return: объект ответа
+    """
+    if orjson is None:
+        return jsonify(data)
+    return raw_json_response(json_dumps(data))
+
+
+def raw_json_response(body):
+    """
+    Функция для формирования JSON-ответа из уже сериализованных данных (например, сохранённых страниц отчёта).
+
+    :param body: сериализованные данные ответа
+    :return: объект ответа
+    """
+    return current_app.response_class(body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+def json_dumps(data):
+    """
+    Функция для сериализации данных в JSON (orjson при его наличии) с настройками ответов приложения.
+
+    :param data: данные
+    :return: сериализованные данные (bytes)
+    """
+    sort_keys = current_app.config['JSON_SORT_KEYS']
+    if orjson is None:
+        body = json.dumps(data, sort_keys=sort_keys, ensure_ascii=False, separators=(',', ':'), default=json_default)
+        return (body + '\n').encode()
+    option = orjson.OPT_APPEND_NEWLINE
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(data, default=json_default, option=option)
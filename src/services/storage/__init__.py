@@ -0,0 +1,48 @@
+import os
+import sqlite3
+
+from services.storage.base import Storage
+from services.storage.memory import MemoryStorage
+from services.storage.sqlite import SqliteStorage
+
+
+def get_storage(connection):
+    """
+    Функция для получения хранилища данных по переданному соединению:
+    хранилище возвращается как есть, соединение с БД SQLite оборачивается в SqliteStorage.
+
+    :param connection: соединение с БД или хранилище
+    :return: хранилище данных
+    """
+    if isinstance(connection, Storage):
+        return connection
+    return SqliteStorage(connection)
+
+
+def load_memory_storage(database):
+    """
+    Функция для создания хранилища в памяти и его заполнения данными из БД SQLite и её архивов
+    (передаётся в db.init_app для STORAGE_ENGINE = 'memory').
+
+    :param database: путь к справочной БД
+    :return: хранилище в памяти
+    """
+    storage = MemoryStorage()
+    if not os.path.exists(database):
+        return storage
+    connection = sqlite3.connect(database)
+    connection.row_factory = sqlite3.Row
+    try:
+        storage.load(connection)
+        cur = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archive'")
+        archives = connection.execute('SELECT path, year FROM archive ORDER BY year') if cur.fetchone() else ()
+        for path, year in list(archives):
+            archive = sqlite3.connect(path)
+            archive.row_factory = sqlite3.Row
+            try:
+                storage.load_operations(archive, f'operation_{year}')
+            finally:
+                archive.close()
+    finally:
+        connection.close()
+    return storage
@@ -0,0 +1,260 @@
+from abc import ABC, abstractmethod
+
+
+class Storage(ABC):
+    """
+    Интерфейс хранилища данных сервисов. Сервисы реализуют бизнес-логику и обращаются
+    к данным только через методы хранилища, поэтому движок хранения можно заменить
+    (SQLite, хранение в памяти) без изменения сервисов.
+
+    Записи возвращаются в виде словарей, поля которых совпадают с полями таблиц БД
+    (операции отчёта - в виде компактных моделей Operation).
+    Методы записи возвращают записанные строки (или идентификаторы, True), а при нарушении
+    ограничений целостности - None/False.
+    """
+
+    # Поля категорий и операций, возвращаемые методами чтения и записи
+    CATEGORY_COLUMNS = ('id', 'name', 'user_id', 'parent_id')
+    OPERATION_COLUMNS = ('id', 'type', 'amount', 'description', 'date', 'user_id', 'category_id')
+    # Поля операций отчёта
+    REPORT_COLUMNS = ('id', 'date', 'type', 'description', 'amount', 'category_id', 'category_path')
+
+    # Пользователи
+
+    @abstractmethod
+    def get_user(self, user_id):
+        """
+        :param user_id: идентификатор пользователя
+        :return: параметры пользователя или None
+        """
+
+    @abstractmethod
+    def get_user_by_email(self, email):
+        """
+        :param email: e-mail пользователя
+        :return: параметры пользователя или None
+        """
+
+    @abstractmethod
+    def add_user(self, data):
+        """
+        :param data: параметры пользователя
+        :return: идентификатор пользователя или None
+        """
+
+    @abstractmethod
+    def set_password(self, user_id, password_hash):
+        """
+        :param user_id: идентификатор пользователя
+        :param password_hash: новый хеш пароля
+        :return: nothing
+        """
+
+    # Категории
+
+    @abstractmethod
+    def get_category(self, category_id):
+        """
+        :param category_id: идентификатор категории
+        :return: параметры категории или None
+        """
+
+    @abstractmethod
+    def find_category(self, user_id, name):
+        """
+        :param user_id: идентификатор пользователя
+        :param name: имя категории
+        :return: параметры категории или None
+        """
+
+    @abstractmethod
+    def list_categories(self, user_id):
+        """
+        :param user_id: идентификатор пользователя
+        :return: список категорий пользователя (id, name)
+        """
+
+    @abstractmethod
+    def add_category(self, data):
+        """
+        Создание категории одной атомарной операцией. Категория не создаётся, если родительская категория
+        не существует или принадлежит другому пользователю, либо у пользователя уже есть категория с таким именем.
+        Путь новой категории строится из сохранённого пути родителя той же операцией.
+
+        :param data: параметры категории (name, user_id, parent_id)
+        :return: идентификатор категории или None
+        """
+
+    @abstractmethod
+    def update_category(self, category_id, data, user_id=None):
+        """
+        :param category_id: идентификатор категории
+        :param data: обновляемые поля
+        :param user_id: идентификатор пользователя: категория (и новая родительская категория)
+                        изменяется, только если принадлежит ему
+        :return: параметры категории после изменения или None
+                 (в том числе при совпадении имени с другой категорией пользователя)
+        """
+
+    @abstractmethod
+    def delete_category(self, category_id):
+        """
+        Удаление категории: операции категории становятся безкатегорийными,
+        дочерние категории - категориями верхнего уровня.
+
+        :param category_id: идентификатор категории
+        :return: True/False
+        """
+
+    @abstractmethod
+    def delete_subtree(self, user_id, category_id, reassign_to=None):
+        """
+        Удаление категории вместе со всеми подкатегориями: операции поддерева
+        становятся безкатегорийными либо переносятся в категорию reassign_to.
+
+        :param user_id: идентификатор пользователя
+        :param category_id: идентификатор корня поддерева
+        :param reassign_to: идентификатор категории для переноса операций
+        :return: True/False
+        """
+
+    @abstractmethod
+    def subtree(self, user_id, category_id):
+        """
+        :param user_id: идентификатор пользователя
+        :param category_id: идентификатор корня поддерева
+        :return: список категорий поддерева (id) в порядке обхода сверху вниз
+        """
+
+    @abstractmethod
+    def category_path(self, user_id, category_id):
+        """
+        :param user_id: идентификатор пользователя
+        :param category_id: идентификатор категории
+        :return: список категорий (id, name) от category_id до корня дерева
+        """
+
+    @abstractmethod
+    def refresh_paths(self, user_id, category_id):
+        """
+        Пересчёт сохранённых путей категории и всех её подкатегорий
+        (после переименования или переноса категории).
+
+        :param user_id: идентификатор пользователя
+        :param category_id: идентификатор корня поддерева
+        :return: nothing
+        """
+
+    # Операции
+
+    @abstractmethod
+    def get_operation(self, operation_id):
+        """
+        :param operation_id: идентификатор операции
+        :return: параметры операции или None
+        """
+
+    @abstractmethod
+    def add_operation(self, data):
+        """
+        :param data: параметры операции
+        :return: параметры созданной операции или None
+        """
+
+    @abstractmethod
+    def update_operation(self, operation_id, data, user_id=None):
+        """
+        :param operation_id: идентификатор операции
+        :param data: обновляемые поля
+        :param user_id: идентификатор пользователя: операция изменяется, только если она
+                        и её новая категория принадлежат ему
+        :return: параметры операции после изменения или None
+        """
+
+    @abstractmethod
+    def delete_operation(self, operation_id, user_id=None):
+        """
+        :param operation_id: идентификатор операции
+        :param user_id: идентификатор пользователя: операция удаляется, только если принадлежит ему
+        :return: True/False (при заданном user_id False - в том числе если операция не удалена)
+        """
+
+    @abstractmethod
+    def add_idempotent_operation(self, data, key, now, expires):
+        """
+        Создание операции вместе с ключом идемпотентности одной транзакцией. Если ключ уже записан
+        параллельным запросом, созданная операция отменяется.
+
+        :param data: параметры операции (в том числе user_id)
+        :param key: ключ идемпотентности
+        :param now: текущее время (timestamp); ключи со сроком не позже now считаются истёкшими
+        :param expires: срок хранения ключа (timestamp)
+        :return: параметры созданной операции, операции, сохранённой с ключом ранее, или None
+        """
+
+    @abstractmethod
+    def get_idempotent_operation(self, user_id, key, now):
+        """
+        :param user_id: идентификатор пользователя
+        :param key: ключ идемпотентности
+        :param now: текущее время (timestamp)
+        :return: параметры операции, созданной запросом с ключом (если ключ не истёк), или None
+        """
+
+    @abstractmethod
+    def purge_idempotency_keys(self, now, grace=0):
+        """
+        Пакетное удаление истёкших ключей идемпотентности. Удаление выполняется, только если
+        самый старый ключ истёк более grace секунд назад, поэтому за один раз удаляются ключи,
+        истёкшие как минимум за grace секунд.
+
+        :param now: текущее время (timestamp)
+        :param grace: задержка удаления истёкших ключей, с
+        :return: количество удалённых ключей
+        """
+
+    @abstractmethod
+    def report(self, user_id, category_ids, uncategorized, from_date, to_date, limit, offset,
+               running_balance=False, query=None, operation_type=None, min_amount=None, max_amount=None,
+               columns=None, summary=True, stream=False):
+        """
+        Выборка операций пользователя для отчёта, отсортированных по дате и идентификатору.
+
+        :param user_id: идентификатор пользователя
+        :param category_ids: идентификаторы категорий, операции которых включаются в отчёт
+        :param uncategorized: включать ли в отчёт безкатегорийные операции
+        :param from_date: начало периода (включительно) или None
+        :param to_date: конец периода (не включительно) или None
+        :param limit: количество операций на странице (None - все операции начиная со сдвига)
+        :param offset: сдвиг страницы
+        :param running_balance: добавлять ли к операциям нарастающий остаток
+        :param query: слова для поиска по описанию операции (все должны присутствовать); при поиске
+                      к операциям добавляется релевантность rank (чем меньше, тем релевантнее)
+        :param operation_type: тип операций (1 - доход, 0 - расход) или None
+        :param min_amount: минимальная сумма операции в копейках (включительно) или None
+        :param max_amount: максимальная сумма операции в копейках (включительно) или None
+        :param columns: поля операций в выборке из REPORT_COLUMNS (по умолчанию - все);
+                        идентификатор и дата операции выбираются всегда
+        :param summary: считать ли сумму и количество элементов по всему отчёту (при False - None)
+        :param stream: вернуть операции итератором, читающим выборку по мере обхода (для выгрузки
+                       отчёта целиком); сумма, количество и операции берутся из одного снимка данных.
+                       Итератор следует закрыть (close) после обхода
+        :return: {'operations': [...], 'total': сумма в копейках, 'total_items': количество};
+                 операции - модели Operation (см. services.storage.models) с сохранённым путём
+                 категории category_path (или None)
+        """
+
+    @abstractmethod
+    def operation_columns(self, user_id):
+        """
+        :param user_id: идентификатор пользователя
+        :return: список кортежей (дата, сумма в копейках со знаком, идентификатор категории или 0),
+                 отсортированный по дате и идентификатору
+        """
+
+    @abstractmethod
+    def data_version(self, user_id):
+        """
+        :param user_id: идентификатор пользователя
+        :return: версия данных пользователя, меняется при любом изменении его категорий и операций
+        """
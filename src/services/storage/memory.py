@@ -0,0 +1,450 @@
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+from decimal import Decimal
+from heapq import heappop, heappush
+from itertools import count
+from threading import RLock
+
+from database import category_paths
+from services.storage.base import Storage
+from services.storage.models import Operation
+
+
+class MemoryStorage(Storage):
+    """
+    Хранилище данных в памяти процесса: словари записей, отсортированные по дате индексы
+    операций пользователей и деревья категорий. Данные не сохраняются между перезапусками.
+
+    Используется для нагрузочного тестирования и бенчмарков (позволяет отделить стоимость
+    бизнес-логики сервисов от стоимости хранения), а также для небольших развёртываний.
+    Блок with захватывает общую блокировку хранилища - аналог транзакции.
+    """
+    def __init__(self):
+        self._lock = RLock()
+        self._sequences = defaultdict(lambda: count(1))
+        self._users = dict()
+        self._emails = dict()
+        self._categories = dict()
+        self._children = defaultdict(set)
+        self._names = dict()
+        self._paths = dict()                  # category_id -> путь категории до корня дерева
+        self._operations = dict()
+        self._dates = defaultdict(list)       # user_id -> [(date, id), ...] по возрастанию
+        self._versions = defaultdict(int)
+        self._idempotency = dict()            # (user_id, key) -> (операция, срок хранения ключа)
+        self._expirations = []                # [(срок хранения, user_id, key), ...] - куча по сроку
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self._lock.release()
+        return False
+
+    def load(self, connection):
+        """
+        Метод для загрузки данных из БД SQLite (например, для прогрева при запуске).
+
+        :param connection: соединение с БД
+        :return: nothing
+        """
+        with self._lock:
+            for row in connection.execute('SELECT * FROM user ORDER BY id'):
+                self._put_user(dict(row))
+            for row in connection.execute('SELECT id, name, user_id, parent_id FROM category ORDER BY id'):
+                self._put_category(dict(row))
+            self._paths.update(category_paths(list(self._categories.values())))
+            self.load_operations(connection)
+
+    def load_operations(self, connection, table='operation'):
+        """
+        Метод для загрузки операций из БД SQLite (в том числе из годовых таблиц архива операций).
+        Операции удалённых категорий загружаются как безкатегорийные.
+
+        :param connection: соединение с БД
+        :param table: имя таблицы операций
+        :return: nothing
+        """
+        with self._lock:
+            for row in connection.execute(
+                f'SELECT id, type, amount, description, date, user_id, category_id FROM {table} ORDER BY id'
+            ):
+                operation = dict(row)
+                if operation['category_id'] not in self._categories:
+                    operation['category_id'] = None
+                self._put_operation(operation)
+
+    # Пользователи
+
+    def get_user(self, user_id):
+        user = self._users.get(user_id)
+        return {'id': user['id']} if user is not None else None
+
+    def get_user_by_email(self, email):
+        user_id = self._emails.get(email)
+        if user_id is None:
+            return None
+        user = self._users[user_id]
+        return {'id': user['id'], 'password': user['password']}
+
+    def add_user(self, data):
+        required = ('first_name', 'last_name', 'email', 'password')
+        if any(data.get(field) is None for field in required) or data['email'] in self._emails:
+            return None
+        user = {field: data[field] for field in required}
+        user['id'] = self._next_id('user', data.get('id'))
+        self._put_user(user)
+        return user['id']
+
+    def set_password(self, user_id, password_hash):
+        self._users[user_id]['password'] = password_hash
+
+    # Категории
+
+    def get_category(self, category_id):
+        category = self._categories.get(category_id)
+        return dict(category) if category is not None else None
+
+    def find_category(self, user_id, name):
+        category_id = self._names.get((user_id, name))
+        return self.get_category(category_id)
+
+    def list_categories(self, user_id):
+        return [
+            {'id': category['id'], 'name': category['name']}
+            for category in self._categories.values()
+            if category['user_id'] == user_id
+        ]
+
+    def add_category(self, data):
+        if data.get('name') is None or data.get('user_id') not in self._users:
+            return None
+        if (data['user_id'], data['name']) in self._names:
+            return None
+        parent_id = data.get('parent_id')
+        if parent_id is not None and self._categories.get(parent_id, {}).get('user_id') != data['user_id']:
+            return None
+        category = {
+            'id': self._next_id('category', data.get('id')),
+            'name': data['name'],
+            'user_id': data['user_id'],
+            'parent_id': parent_id,
+        }
+        self._put_category(category)
+        # Путь новой категории - она сама и путь родителя
+        path = [{'id': category['id'], 'name': category['name']}]
+        self._paths[category['id']] = path + self._paths.get(parent_id, []) if parent_id is not None else path
+        self._touch(category['user_id'])
+        return category['id']
+
+    def update_category(self, category_id, data, user_id=None):
+        category = self._categories.get(category_id)
+        if category is None or user_id is not None and category['user_id'] != user_id:
+            return None
+        name = data.get('name', category['name'])
+        if name is None or self._names.get((category['user_id'], name), category_id) != category_id:
+            return None
+        parent_id = data.get('parent_id', category['parent_id'])
+        if parent_id is not None and parent_id not in self._categories:
+            return None
+        if user_id is not None and data.get('parent_id') is not None and not self._owned(parent_id, user_id):
+            return None
+
+        self._drop_category(category)
+        category.update({key: value for key, value in data.items() if key in ('name', 'parent_id')})
+        self._put_category(category)
+        self._touch(category['user_id'])
+        return dict(category)
+
+    def delete_category(self, category_id):
+        category = self._categories.get(category_id)
+        if category is None:
+            return True
+
+        # Операции категории становятся безкатегорийными, дочерние категории - категориями верхнего уровня
+        for _, operation_id in self._dates.get(category['user_id'], ()):
+            operation = self._operations[operation_id]
+            if operation['category_id'] == category_id:
+                operation['category_id'] = None
+        children = list(self._children.get(category_id, ()))
+        for child_id in children:
+            self._categories[child_id]['parent_id'] = None
+        self._children.pop(category_id, None)
+
+        self._drop_category(category)
+        del self._categories[category_id]
+        self._paths.pop(category_id, None)
+        for child_id in children:
+            self.refresh_paths(category['user_id'], child_id)
+        self._touch(category['user_id'])
+        return True
+
+    def delete_subtree(self, user_id, category_id, reassign_to=None):
+        subtree = {category['id'] for category in self.subtree(user_id, category_id)}
+        if reassign_to is not None and (reassign_to in subtree or reassign_to not in self._categories):
+            return False
+
+        for _, operation_id in self._dates.get(user_id, ()):
+            operation = self._operations[operation_id]
+            if operation['category_id'] in subtree:
+                operation['category_id'] = reassign_to
+        for subtree_id in subtree:
+            category = self._categories.pop(subtree_id)
+            self._drop_category(category)
+            self._children.pop(subtree_id, None)
+            self._paths.pop(subtree_id, None)
+        self._touch(user_id)
+        return True
+
+    def subtree(self, user_id, category_id):
+        category = self._categories.get(category_id)
+        if category is None or category['user_id'] != user_id:
+            return []
+        # Посещённые категории не обходятся повторно (защита от зацикленной цепочки parent_id)
+        visited = {category_id}
+        result = []
+        level = [category_id]
+        while level:
+            result.extend({'id': item} for item in level)
+            level = [child for item in level for child in sorted(self._children.get(item, ())) if child not in visited]
+            visited.update(level)
+        return result
+
+    def category_path(self, user_id, category_id):
+        category = self._categories.get(category_id)
+        if category is None or category['user_id'] != user_id:
+            return []
+        result = []
+        visited = set()
+        while category is not None and category['id'] not in visited:
+            visited.add(category['id'])
+            result.append({'id': category['id'], 'name': category['name']})
+            category = self._categories.get(category['parent_id'])
+        return result
+
+    def refresh_paths(self, user_id, category_id):
+        categories = [self._categories[category['id']] for category in self.subtree(user_id, category_id)]
+        if not categories:
+            return
+        parent_id = categories[0]['parent_id']
+        known = {parent_id: self._paths[parent_id]} if parent_id in self._paths else {}
+        self._paths.update(category_paths(categories, known))
+
+    # Операции
+
+    def get_operation(self, operation_id):
+        operation = self._operations.get(operation_id)
+        return dict(operation) if operation is not None else None
+
+    def add_operation(self, data):
+        if not self._valid_operation(data):
+            return None
+        operation = {
+            'id': self._next_id('operation', data.get('id')),
+            'type': data['type'],
+            'amount': str(data['amount']),
+            'description': data.get('description'),
+            'date': data['date'],
+            'user_id': data['user_id'],
+            'category_id': data.get('category_id'),
+        }
+        self._put_operation(operation)
+        self._touch(operation['user_id'])
+        return dict(operation)
+
+    def update_operation(self, operation_id, data, user_id=None):
+        operation = self._operations.get(operation_id)
+        if operation is None or user_id is not None and operation['user_id'] != user_id:
+            return None
+        category_id = data.get('category_id')
+        if user_id is not None and category_id is not None and not self._owned(category_id, user_id):
+            return None
+        changes = {key: value for key, value in data.items() if key in operation and key != 'id'}
+        if 'amount' in changes and changes['amount'] is not None:
+            changes['amount'] = str(changes['amount'])
+        if not self._valid_operation(dict(operation, **changes)):
+            return None
+
+        self._drop_operation(operation)
+        operation.update(changes)
+        self._put_operation(operation)
+        self._touch(operation['user_id'])
+        return dict(operation)
+
+    def delete_operation(self, operation_id, user_id=None):
+        operation = self._operations.get(operation_id)
+        if operation is None or user_id is not None and operation['user_id'] != user_id:
+            return user_id is None
+        del self._operations[operation_id]
+        self._drop_operation(operation)
+        self._touch(operation['user_id'])
+        return True
+
+    def add_idempotent_operation(self, data, key, now, expires):
+        stored = self.get_idempotent_operation(data['user_id'], key, now)
+        if stored is not None:
+            return stored
+        created = self.add_operation(data)
+        if created is not None:
+            self._idempotency[(data['user_id'], key)] = (dict(created), expires)
+            heappush(self._expirations, (expires, data['user_id'], key))
+        return created
+
+    def get_idempotent_operation(self, user_id, key, now):
+        entry = self._idempotency.get((user_id, key))
+        return dict(entry[0]) if entry is not None and entry[1] > now else None
+
+    def purge_idempotency_keys(self, now, grace=0):
+        if not self._expirations or self._expirations[0][0] > now - grace:
+            return 0
+        purged = 0
+        while self._expirations and self._expirations[0][0] <= now:
+            expires, user_id, key = heappop(self._expirations)
+            # Запись кучи устарела, если ключ после истечения был использован повторно
+            entry = self._idempotency.get((user_id, key))
+            if entry is not None and entry[1] == expires:
+                del self._idempotency[(user_id, key)]
+                purged += 1
+        return purged
+
+    def report(self, user_id, category_ids, uncategorized, from_date, to_date, limit, offset,
+               running_balance=False, query=None, operation_type=None, min_amount=None, max_amount=None,
+               columns=None, summary=True, stream=False):
+        if stream:
+            # Выгрузка строится целиком под блокировкой хранилища - снимок данных, обход которого
+            # не задерживает изменение данных
+            with self._lock:
+                report = self.report(user_id, category_ids, uncategorized, from_date, to_date, limit, offset,
+                                     running_balance, query, operation_type, min_amount, max_amount, columns, summary)
+            report['operations'] = (operation for operation in report['operations'])
+            return report
+        words = self._words(query) if query else None
+        columns = [column for column in (columns or self.REPORT_COLUMNS) if column in self.REPORT_COLUMNS]
+        keys = ['id', 'date', *(column for column in columns if column not in ('id', 'date', 'category_path'))]
+        category_ids = set(category_ids)
+        if uncategorized:
+            category_ids.add(None)
+
+        # Выборка диапазона дат по отсортированному индексу
+        index = self._dates.get(user_id, [])
+        start = bisect_left(index, (from_date,)) if from_date else 0
+        stop = bisect_left(index, (to_date,)) if to_date else len(index)
+
+        total = 0
+        rows = []
+        for _, operation_id in index[start:stop]:
+            operation = self._operations[operation_id]
+            if operation['category_id'] not in category_ids:
+                continue
+            if operation_type is not None and bool(operation['type']) != bool(operation_type):
+                continue
+            cents = abs(self._cents(operation))
+            if min_amount is not None and cents < min_amount:
+                continue
+            if max_amount is not None and cents > max_amount:
+                continue
+            rank = None
+            if words is not None:
+                # Все слова запроса должны присутствовать в описании, релевантность - число совпадений
+                description = self._words(operation['description'] or '')
+                if not all(word in description for word in words):
+                    continue
+                rank = -float(sum(description.count(word) for word in words))
+            total += self._cents(operation)
+            rows.append((operation, total, rank))
+            if not summary and limit is not None and len(rows) >= offset + limit:
+                break
+
+        # Путь категории строится один раз на категорию и используется всеми её операциями
+        paths = {}
+        operations = []
+        for operation, balance, rank in rows[offset:offset + limit if limit is not None else None]:
+            items = [(key, operation[key]) for key in keys]
+            if 'category_path' in columns:
+                category_id = operation['category_id']
+                if category_id not in paths:
+                    path = self._paths.get(category_id)
+                    paths[category_id] = [dict(item) for item in path] if path is not None else None
+                items.append(('category_path', paths[category_id]))
+            if words is not None:
+                items.append(('rank', rank))
+            if running_balance:
+                items.append(('running_balance', balance))
+            operations.append(Operation.from_items(items))
+
+        if not summary:
+            return {'operations': operations, 'total': None, 'total_items': None}
+        return {'operations': operations, 'total': total, 'total_items': len(rows)}
+
+    def operation_columns(self, user_id):
+        result = []
+        for _, operation_id in self._dates.get(user_id, ()):
+            operation = self._operations[operation_id]
+            result.append((operation['date'], self._cents(operation), operation['category_id'] or 0))
+        return result
+
+    def data_version(self, user_id):
+        return self._versions[user_id]
+
+    # Индексы
+
+    def _next_id(self, table, requested=None):
+        return requested if requested is not None else next(self._sequences[table])
+
+    def _put_user(self, user):
+        self._users[user['id']] = user
+        self._emails[user['email']] = user['id']
+        self._bump_sequence('user', user['id'])
+
+    def _put_category(self, category):
+        self._categories[category['id']] = category
+        self._names.setdefault((category['user_id'], category['name']), category['id'])
+        if category['parent_id'] is not None:
+            self._children[category['parent_id']].add(category['id'])
+        self._bump_sequence('category', category['id'])
+
+    def _drop_category(self, category):
+        if self._names.get((category['user_id'], category['name'])) == category['id']:
+            del self._names[(category['user_id'], category['name'])]
+        if category['parent_id'] is not None:
+            self._children[category['parent_id']].discard(category['id'])
+
+    def _put_operation(self, operation):
+        self._operations[operation['id']] = operation
+        insort(self._dates[operation['user_id']], (operation['date'], operation['id']))
+        self._bump_sequence('operation', operation['id'])
+
+    def _drop_operation(self, operation):
+        index = self._dates[operation['user_id']]
+        del index[bisect_left(index, (operation['date'], operation['id']))]
+
+    def _bump_sequence(self, table, instance_id):
+        # Идентификаторы, загруженные извне, не должны выдаваться повторно
+        sequence = self._sequences[table]
+        current = next(sequence)
+        self._sequences[table] = count(max(current, instance_id + 1))
+
+    def _touch(self, user_id):
+        self._versions[user_id] += 1
+
+    def _owned(self, category_id, user_id):
+        category = self._categories.get(category_id)
+        return category is not None and category['user_id'] == user_id
+
+    def _valid_operation(self, data):
+        if data.get('type') is None or data.get('amount') is None or data.get('date') is None:
+            return False
+        if data.get('user_id') not in self._users:
+            return False
+        return data.get('category_id') is None or data['category_id'] in self._categories
+
+    @staticmethod
+    def _words(text):
+        return re.findall(r'\w+', text.lower())
+
+    @staticmethod
+    def _cents(operation):
+        cents = int(Decimal(operation['amount']).scaleb(2).to_integral_value())
+        return cents if operation['type'] else -cents
@@ -0,0 +1,93 @@
+from decimal import Decimal
+
+# Признак незаполненного поля модели
+_MISSING = object()
+
+
+def money(cents):
+    """
+    Функция для перевода суммы в копейках в строковое представление денежной суммы.
+
+    :param cents: сумма в копейках
+    :return: строка вида '123.45'
+    """
+    return str(Decimal(cents).scaleb(-2))
+
+
+class Model:
+    """
+    Базовый класс компактных моделей записей отчёта. Поля хранятся в слотах (без словаря атрибутов
+    у каждого экземпляра), незаполненные поля в ответ не попадают. Словарь полей создаётся только
+    на время сериализации (см. services.serialization.json_default).
+    """
+    __slots__ = ()
+
+    def as_dict(self):
+        """
+        Метод для получения заполненных полей модели.
+
+        :return: словарь полей
+        """
+        result = {}
+        for field in self.__slots__:
+            value = getattr(self, field, _MISSING)
+            if value is not _MISSING:
+                result[field] = value
+        return result
+
+    def __repr__(self):
+        fields = ', '.join(f'{key}={value!r}' for key, value in self.as_dict().items())
+        return f'{type(self).__name__}({fields})'
+
+
+class Operation(Model):
+    """
+    Операция отчёта. Значения приводятся к виду ответа при заполнении модели:
+    тип операции - bool, сумма и нарастающий остаток (в копейках) - строки денежных сумм.
+    category_path - сохранённый путь категории (список словарей id, name), общий для операций одной категории.
+    """
+    __slots__ = (
+        'id', 'date', 'type', 'description', 'amount', 'category_id', 'category_path', 'categories',
+        'running_balance', 'rank',
+    )
+    CONVERTERS = {
+        'type': bool,
+        'amount': str,
+        'running_balance': money,
+    }
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Метод для создания операции из пар (поле, значение).
+
+        :param items: пары (поле, значение)
+        :return: операция
+        """
+        operation = cls()
+        converters = cls.CONVERTERS
+        for field, value in items:
+            if value is not None and field in converters:
+                value = converters[field](value)
+            setattr(operation, field, value)
+        return operation
+
+    @classmethod
+    def row_factory(cls, cursor, paths):
+        """
+        Метод для получения фабрики строк курсора (sqlite3 row_factory), создающей операции
+        непосредственно из строк выборки, без промежуточных sqlite3.Row и словарей.
+
+        :param cursor: курсор выполненного запроса (по нему определяются поля выборки)
+        :param paths: функция преобразования сохранённого пути категории (JSON) в список категорий
+        :return: фабрика строк
+        """
+        fields = [column[0] for column in cursor.description]
+        index = fields.index('category_path') if 'category_path' in fields else None
+
+        def factory(_, row):
+            if index is not None and row[index] is not None:
+                row = (*row[:index], paths(row[index]), *row[index + 1:])
+            return cls.from_items(zip(fields, row))
+
+        return factory
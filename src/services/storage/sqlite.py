@@ -0,0 +1,605 @@
+import json
+import sqlite3 as sqlite
+
+from database import category_paths
+from services.helper import (
+    insert,
+    update,
+    delete
+)
+from services.storage.base import Storage
+from services.storage.models import Operation
+
+
+class SqliteStorage(Storage):
+    """
+    Хранилище данных в БД SQLite поверх переданного соединения.
+    Управление транзакциями остаётся за вызывающим кодом (with connection).
+
+    Архивы операций, пересекающиеся с периодом запроса, подключаются к соединению (ATTACH)
+    и остаются подключёнными для последующих запросов.
+    """
+    # Ограничение SQLite на количество подключённых БД (SQLITE_MAX_ATTACHED по умолчанию)
+    MAX_ATTACHED = 10
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self.connection.__exit__(*args)
+
+    # Пользователи
+
+    def get_user(self, user_id):
+        cur = self.connection.execute('SELECT id FROM user WHERE id = ?', (user_id,))
+        return self._fetch(cur)
+
+    def get_user_by_email(self, email):
+        cur = self.connection.execute('SELECT id, password FROM user WHERE email = ?', (email,))
+        return self._fetch(cur)
+
+    def add_user(self, data):
+        return insert('user', data, self.connection)
+
+    def set_password(self, user_id, password_hash):
+        self.connection.execute('UPDATE user SET password = ? WHERE id = ?', (password_hash, user_id))
+
+    # Категории
+
+    def get_category(self, category_id):
+        cur = self.connection.execute(
+            f'SELECT {", ".join(self.CATEGORY_COLUMNS)} FROM category WHERE id = ?', (category_id,)
+        )
+        return self._fetch(cur)
+
+    def find_category(self, user_id, name):
+        cur = self.connection.execute(
+            f'SELECT {", ".join(self.CATEGORY_COLUMNS)} FROM category WHERE name = ? AND user_id = ?',
+            (name, user_id),
+        )
+        return self._fetch(cur)
+
+    def list_categories(self, user_id):
+        cur = self.connection.execute('SELECT id, name FROM category WHERE user_id = ?', (user_id,))
+        return [dict(row) for row in cur.fetchall()]
+
+    def add_category(self, data):
+        # Проверка родительской категории и уникальности имени выполняются той же инструкцией.
+        # Дубликат отсекается условием NOT EXISTS (не расходует значение AUTOINCREMENT),
+        # ON CONFLICT срабатывает только при одновременном создании категорий с одним именем
+        # (без цели конфликта - инструкция допустима и в БД, где уникальный индекс ещё не создан).
+        # Путь новой категории - она сама и сохранённый путь родителя (заполняется при инициализации схемы),
+        # поэтому идентификатор выбирается по правилу AUTOINCREMENT в той же инструкции (под блокировкой записи)
+        params = {'name': data.get('name'), 'user_id': data.get('user_id'), 'parent_id': data.get('parent_id')}
+        try:
+            cur = self.connection.execute(
+                '''
+                INSERT INTO category (id, name, user_id, parent_id, path)
+                SELECT new.id, :name, :user_id, :parent_id,
+                       CASE
+                           WHEN :parent_id IS NULL THEN '[' || json_object('id', new.id, 'name', :name) || ']'
+                           ELSE '[' || json_object('id', new.id, 'name', :name) || ', ' || substr(parent.path, 2)
+                       END
+                FROM (
+                    SELECT MAX(
+                        COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'category'), 0),
+                        COALESCE((SELECT MAX(id) FROM category), 0)
+                    ) + 1 AS id
+                ) AS new
+                LEFT JOIN category AS parent ON parent.id = :parent_id AND parent.user_id = :user_id
+                WHERE NOT EXISTS (SELECT 1 FROM category WHERE user_id = :user_id AND name = :name)
+                  AND (:parent_id IS NULL OR parent.id IS NOT NULL)
+                ON CONFLICT DO NOTHING
+                ''',
+                params,
+            )
+        except sqlite.IntegrityError:
+            self.connection.rollback()
+            return None
+        return cur.lastrowid if cur.rowcount else None
+
+    def update_category(self, category_id, data, user_id=None):
+        where = None
+        if user_id is not None:
+            where = f'user_id = {int(user_id)}'
+            if data.get('parent_id') is not None:
+                where += f" AND {self._owned('category', data['parent_id'], user_id)}"
+        return update('category', data, category_id, self.connection, returning=self.CATEGORY_COLUMNS, where=where)
+
+    def delete_category(self, category_id):
+        archives = self._attach_archives(None, None)
+        cur = self.connection.execute('SELECT id, user_id FROM category WHERE parent_id = ?', (category_id,))
+        children = cur.fetchall()
+        # Переделываем все связанные операции в безкатегорийные (в том числе архивные)
+        if not update('operation', {'category_id': None}, category_id, self.connection, 'category_id'):
+            return False
+        for schema, table in archives:
+            self.connection.execute(f'UPDATE {schema}.{table} SET category_id = NULL WHERE category_id = ?',
+                                    (category_id,))
+        # Делаем дочерние категории родительскими
+        if not update('category', {'parent_id': None}, category_id, self.connection, 'parent_id'):
+            return False
+        for child in children:
+            self.refresh_paths(child['user_id'], child['id'])
+        return delete('category', category_id, self.connection)
+
+    def delete_subtree(self, user_id, category_id, reassign_to=None):
+        # Архивы подключаются до начала транзакции (ATTACH внутри транзакции невозможен)
+        archives = self._attach_archives(None, None)
+        subtree = '''
+            WITH RECURSIVE subtree(id) AS (
+                SELECT id FROM category WHERE id = :category_id AND user_id = :user_id
+                UNION
+                SELECT c.id FROM category c, subtree s
+                WHERE c.parent_id = s.id
+            )
+        '''
+        params = {'category_id': category_id, 'user_id': user_id, 'reassign_to': reassign_to}
+        try:
+            self.connection.execute('PRAGMA foreign_keys = ON')
+            self.connection.execute(
+                f'''
+                {subtree}
+                UPDATE operation
+                SET category_id = :reassign_to
+                WHERE category_id IN subtree
+                ''',
+                params,
+            )
+            # Архивные операции переносятся (или становятся безкатегорийными) вместе с операциями БД
+            for schema, table in archives:
+                self.connection.execute(
+                    f'''
+                    {subtree}
+                    UPDATE {schema}.{table}
+                    SET category_id = :reassign_to
+                    WHERE category_id IN subtree
+                    ''',
+                    params,
+                )
+            self.connection.execute(
+                f'{subtree} DELETE FROM category WHERE id IN subtree',
+                params,
+            )
+        except sqlite.IntegrityError:
+            self.connection.rollback()
+            return False
+        else:
+            return True
+
+    def subtree(self, user_id, category_id):
+        return self._walk(user_id, category_id, 'WHERE c.parent_id = sc.id', 'id')
+
+    def category_path(self, user_id, category_id):
+        return self._walk(user_id, category_id, 'WHERE c.id = sc.parent_id', 'id, name')
+
+    def refresh_paths(self, user_id, category_id):
+        cursor = self.connection.execute(
+            '''
+            WITH RECURSIVE sub_category(id, name, parent_id) AS (
+                SELECT id, name, parent_id FROM category WHERE user_id = ? AND id = ?
+                UNION
+                SELECT c.id, c.name, c.parent_id FROM category c, sub_category sc
+                WHERE c.parent_id = sc.id
+            )
+            SELECT id, name, parent_id FROM sub_category
+            ''',
+            (user_id, category_id),
+        )
+        categories = [dict(row) for row in cursor.fetchall()]
+        if not categories:
+            return
+
+        # Путь родителя поддерева не меняется и берётся из БД
+        known = {}
+        parent_id = categories[0]['parent_id']
+        if parent_id is not None:
+            cursor = self.connection.execute('SELECT path FROM category WHERE id = ?', (parent_id,))
+            row = cursor.fetchone()
+            if row is not None and row['path'] is not None:
+                known[parent_id] = json.loads(row['path'])
+
+        paths = category_paths(categories, known)
+        self.connection.executemany(
+            'UPDATE category SET path = ? WHERE id = ?',
+            ((json.dumps(path, ensure_ascii=False), category_id) for category_id, path in paths.items()),
+        )
+
+    def _walk(self, user_id, category_id, bypass_rule, what_to_select):
+        """
+        Метод обхода дерева категорий рекурсивным запросом (UNION - обход завершается
+        и при зацикленной цепочке parent_id).
+
+        :param user_id: идентификатор пользователя
+        :param category_id: идентификатор категории, с которой начинается обход
+        :param bypass_rule: условие перехода между уровнями дерева
+        :param what_to_select: выбираемые поля
+        :return: список категорий в порядке обхода
+        """
+        cursor = self.connection.execute(
+            f'''
+            WITH RECURSIVE sub_category(id, name, parent_id) AS (
+                SELECT id, name, parent_id FROM category WHERE user_id = ? AND id = ?
+                UNION
+                SELECT c.id, c.name, c.parent_id FROM category c, sub_category sc
+                {bypass_rule}
+            )
+            SELECT {what_to_select} FROM sub_category;
+            ''',
+            (user_id, category_id,),
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    # Операции
+
+    def get_operation(self, operation_id):
+        cur = self.connection.execute(
+            f'SELECT {", ".join(self.OPERATION_COLUMNS)} FROM operation WHERE id = ?', (operation_id,)
+        )
+        operation = self._fetch(cur)
+        if operation is not None:
+            return operation
+        # Операция может находиться в архиве (архивы прозрачны для клиентов)
+        for schema, table in self._attach_archives(None, None):
+            cur = self.connection.execute(
+                f'SELECT {", ".join(self.OPERATION_COLUMNS)} FROM {schema}.{table} WHERE id = ?', (operation_id,)
+            )
+            operation = self._fetch(cur)
+            if operation is not None:
+                return operation
+        return None
+
+    def add_operation(self, data):
+        return insert('operation', data, self.connection, returning=self.OPERATION_COLUMNS)
+
+    def update_operation(self, operation_id, data, user_id=None):
+        self._restore_operation(operation_id, user_id)
+        where = None
+        if user_id is not None:
+            where = f'user_id = {int(user_id)}'
+            if data.get('category_id') is not None:
+                where += f" AND {self._owned('category', data['category_id'], user_id)}"
+        return update('operation', data, operation_id, self.connection, returning=self.OPERATION_COLUMNS, where=where)
+
+    def delete_operation(self, operation_id, user_id=None):
+        self._restore_operation(operation_id, user_id)
+        where = f'user_id = {int(user_id)}' if user_id is not None else None
+        return delete('operation', operation_id, self.connection, where=where)
+
+    def _restore_operation(self, operation_id, user_id=None):
+        """
+        Метод для возврата архивной операции в таблицу операций БД перед её изменением или удалением:
+        изменение выполняется обычным путём (проверки принадлежности, триггеры версии данных
+        и полнотекстового индекса), а изменённая дата не нарушает границы годовой таблицы архива.
+        Операция снова попадёт в архив при следующей архивации, если останется старше горизонта.
+        Должен вызываться до начала транзакции (подключение архивов).
+
+        :param operation_id: идентификатор операции
+        :param user_id: идентификатор пользователя - владельца операции (чужие операции не переносятся)
+        :return: nothing
+        """
+        archives = self._attach_archives(None, None)
+        if not archives:
+            return
+        owner = f' AND user_id = {int(user_id)}' if user_id is not None else ''
+        for schema, table in archives:
+            cur = self.connection.execute(f'SELECT 1 FROM {schema}.{table} WHERE id = ?{owner}', (operation_id,))
+            if cur.fetchone() is None:
+                continue
+            # Категории, удалённые после архивации операции, считаются отсутствующими (см. _source)
+            self.connection.execute('PRAGMA foreign_keys = ON')
+            self.connection.execute(
+                f'''
+                INSERT INTO main.operation (id, type, amount, description, date, user_id, category_id)
+                SELECT
+                    id, type, amount, description, date, user_id,
+                    CASE WHEN category_id IN (SELECT id FROM main.category) THEN category_id END
+                FROM {schema}.{table}
+                WHERE id = ?
+                ''',
+                (operation_id,),
+            )
+            self.connection.execute(f'DELETE FROM {schema}.{table} WHERE id = ?', (operation_id,))
+            return
+
+    def add_idempotent_operation(self, data, key, now, expires):
+        created = self.add_operation(data)
+        if created is None:
+            return None
+        # Истёкший, но ещё не удалённый ключ используется повторно
+        cur = self.connection.execute(
+            '''
+            INSERT INTO idempotency_key (user_id, key, operation, expires) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, key) DO UPDATE SET operation = excluded.operation, expires = excluded.expires
+            WHERE idempotency_key.expires <= ?
+            ''',
+            (data['user_id'], key, json.dumps(created), expires, now),
+        )
+        if cur.rowcount:
+            return created
+        # Ключ записан параллельным запросом (после проверки ключа вызывающим кодом)
+        self.connection.rollback()
+        return self.get_idempotent_operation(data['user_id'], key, now)
+
+    def get_idempotent_operation(self, user_id, key, now):
+        cur = self.connection.execute(
+            'SELECT operation FROM idempotency_key WHERE user_id = ? AND key = ? AND expires > ?',
+            (user_id, key, now),
+        )
+        row = cur.fetchone()
+        return json.loads(row['operation']) if row is not None else None
+
+    def purge_idempotency_keys(self, now, grace=0):
+        oldest = self.connection.execute('SELECT MIN(expires) AS expires FROM idempotency_key').fetchone()['expires']
+        if oldest is None or oldest > now - grace:
+            return 0
+        return self.connection.execute('DELETE FROM idempotency_key WHERE expires <= ?', (now,)).rowcount
+
+    @staticmethod
+    def _owned(table, instance_id, user_id):
+        """
+        Утилита для формирования условия принадлежности записи пользователю
+        (проверка выполняется той же инструкцией, что и изменение данных).
+
+        :param table: имя таблицы
+        :param instance_id: идентификатор записи
+        :param user_id: идентификатор пользователя
+        :return: SQL-условие
+        """
+        return f'EXISTS (SELECT 1 FROM {table} WHERE id = {int(instance_id)} AND user_id = {int(user_id)})'
+
+    def report(self, user_id, category_ids, uncategorized, from_date, to_date, limit, offset,
+               running_balance=False, query=None, operation_type=None, min_amount=None, max_amount=None,
+               columns=None, summary=True, stream=False):
+        # Формируем условие
+        clause = ' OR '.join(f'o.category_id = {int(category_id)}' for category_id in category_ids)
+        if uncategorized:
+            clause = f'({clause} OR (o.category_id IS NULL))' if clause else '(o.category_id IS NULL)'
+        elif not clause:
+            clause = '0'
+        clause = f'({clause})'
+        params = {
+            'user_id': user_id,
+            'from_date': from_date,
+            'to_date': to_date,
+            'type': operation_type,
+            'min_amount': min_amount,
+            'max_amount': max_amount,
+        }
+        if from_date:
+            clause = clause + ' AND (o.date >= :from_date)'
+        if to_date:
+            clause = clause + ' AND (o.date < :to_date)'
+        # Фильтры по типу и сумме используют индекс (user_id, type, amount_cents)
+        if operation_type is not None:
+            clause = clause + ' AND (o.type = :type)'
+        if min_amount is not None:
+            clause = clause + ' AND (o.amount_cents >= :min_amount)'
+        if max_amount is not None:
+            clause = clause + ' AND (o.amount_cents <= :max_amount)'
+
+        # Выбираются только запрошенные поля, путь категории берётся из сохранённого в категории снимка
+        columns = [column for column in (columns or self.REPORT_COLUMNS) if column in self.REPORT_COLUMNS]
+        selected = ['o.id', 'o.date']
+        selected.extend(f'o.{column}' for column in columns if column not in ('id', 'date', 'category_path'))
+        joins = ''
+        if 'category_path' in columns:
+            selected.append('c.path AS category_path')
+            joins = 'LEFT JOIN category c ON c.id = o.category_id'
+
+        # Архивы используются, только если запрошенный период их затрагивает
+        schemas = self._attach_archives(from_date, to_date)
+        if query:
+            params['query'] = self._match_expression(query)
+        matches, source, rank = self._source(schemas, bool(query))
+        if rank is not None:
+            selected.append(f'{rank} AS rank')
+        columns = ', '.join(selected)
+
+        # Сумма и операции выгрузки читаются в одной транзакции чтения (после подключения архивов,
+        # которое внутри транзакции невозможно) - до закрытия итератора операций
+        snapshot = stream and not self.connection.in_transaction
+        if snapshot:
+            self.connection.execute('BEGIN')
+
+        # Подсчёт суммы и количества элементов по всему отчёту (требует просмотра всей выборки)
+        if summary:
+            cursor = self.connection.execute(
+                f'''
+                {matches}
+                SELECT
+                    COUNT(*) AS total_items,
+                    IFNULL(SUM(o.amount_cents * (CASE WHEN o.type THEN 1 ELSE -1 END)), 0) AS total
+                FROM {source}
+                WHERE {clause} AND o.user_id = :user_id
+                ''',
+                params,
+            )
+            summary = cursor.fetchone()
+        else:
+            summary = {'total': None, 'total_items': None}
+
+        # формируем основное тело запроса
+        sql_request = f'''
+            {matches}
+            SELECT {columns}
+            FROM {source} {joins}
+            WHERE {clause} AND o.user_id = :user_id
+            ORDER BY o.date ASC, o.id ASC
+        '''
+
+        # Нарастающий остаток считается оконной функцией по всей выборке до применения пагинации,
+        # поэтому первая операция страницы N сразу содержит перенесённый с предыдущих страниц остаток
+        if running_balance:
+            sql_request = f'''
+                {matches}
+                SELECT *
+                FROM (
+                    SELECT
+                        {columns},
+                        SUM(o.amount_cents * (CASE WHEN o.type THEN 1 ELSE -1 END))
+                            OVER (ORDER BY o.date ASC, o.id ASC) AS running_balance
+                    FROM {source} {joins}
+                    WHERE {clause} AND o.user_id = :user_id
+                )
+                ORDER BY date ASC, id ASC
+            '''
+
+        # Добавление в зарос параметров LIMIT и OFFSET для пагинации (LIMIT -1 - без ограничения)
+        sql_request = sql_request + 'LIMIT :limit OFFSET :offset'
+        params.update(limit=limit if limit is not None else -1, offset=offset)
+        cursor = self.connection.execute(sql_request, params)
+        # Операции создаются непосредственно из строк выборки, путь категории разбирается один раз на категорию
+        paths = {}
+
+        def parse_path(path):
+            if path not in paths:
+                paths[path] = json.loads(path)
+            return paths[path]
+
+        cursor.row_factory = Operation.row_factory(cursor, parse_path)
+        operations = self._stream(cursor, snapshot) if stream else cursor.fetchall()
+
+        return {
+            'operations': operations,
+            'total': summary['total'],
+            'total_items': summary['total_items'],
+        }
+
+    def _stream(self, cursor, snapshot):
+        """
+        Генератор операций выгрузки отчёта: операции читаются из курсора по мере обхода,
+        транзакция чтения завершается после обхода или закрытия генератора.
+
+        :param cursor: курсор основного запроса отчёта
+        :param snapshot: открыта ли транзакция чтения для выгрузки
+        :return: генератор операций
+        """
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+            if snapshot:
+                self.connection.rollback()
+
+    @staticmethod
+    def _match_expression(query):
+        """
+        Утилита для формирования выражения полнотекстового поиска: каждое слово запроса
+        берётся в кавычки, поэтому спецсимволы синтаксиса FTS5 не интерпретируются.
+
+        :param query: строка поиска
+        :return: выражение для MATCH
+        """
+        words = query.split()
+        return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words) or '""'
+
+    def operation_columns(self, user_id):
+        _, source, _ = self._source(self._attach_archives(None, None))
+        cur = self.connection.execute(
+            f'''
+            SELECT
+                o.date,
+                o.amount_cents * (CASE WHEN o.type THEN 1 ELSE -1 END),
+                IFNULL(o.category_id, 0)
+            FROM {source}
+            WHERE o.user_id = ?
+            ORDER BY o.date ASC, o.id ASC
+            ''',
+            (user_id,),
+        )
+        return cur.fetchall()
+
+    def data_version(self, user_id):
+        cur = self.connection.execute('SELECT version FROM data_version WHERE user_id = ?', (user_id,))
+        row = cur.fetchone()
+        return row['version'] if row is not None else 0
+
+    def _attach_archives(self, from_date, to_date):
+        """
+        Метод для подключения архивов операций, годовые таблицы которых пересекаются с периодом.
+
+        :param from_date: начало периода (включительно) или None
+        :param to_date: конец периода (не включительно) или None
+        :return: список годовых таблиц архивов (имя схемы, имя таблицы)
+        """
+        cur = self.connection.execute(
+            '''
+            SELECT path, year FROM archive
+            WHERE (:from_date IS NULL OR to_date > :from_date) AND (:to_date IS NULL OR from_date < :to_date)
+            ORDER BY year, path
+            ''',
+            {'from_date': from_date or None, 'to_date': to_date or None},
+        )
+        archives = cur.fetchall()
+        if not archives:
+            return []
+
+        attached = {
+            row['file']: row['name']
+            for row in self.connection.execute('PRAGMA database_list')
+            if row['name'].startswith('archive_')
+        }
+        paths = {row['path'] for row in archives}
+        missing = sorted(paths.difference(attached))
+        if len(attached) + len(missing) > self.MAX_ATTACHED:
+            # Отключение архивов, не нужных текущему запросу
+            for path, name in list(attached.items()):
+                if path not in paths:
+                    self.connection.execute(f'DETACH DATABASE {name}')
+                    del attached[path]
+        for path in missing:
+            names = set(attached.values())
+            name = next(f'archive_{index}' for index in range(len(names) + 1) if f'archive_{index}' not in names)
+            self.connection.execute(f'ATTACH DATABASE ? AS {name}', (path,))
+            attached[path] = name
+        return [(attached[row['path']], f'operation_{row["year"]}') for row in archives]
+
+    @staticmethod
+    def _source(archives, search=False):
+        """
+        Утилита для формирования источника операций: таблица операций БД, либо её объединение
+        с годовыми таблицами подключённых архивов. При поиске по описанию к операциям каждой таблицы
+        присоединяются совпадения её полнотекстового индекса (bm25 недоступна внутри оконных запросов,
+        поэтому совпадения и их релевантность выбираются отдельным подзапросом).
+
+        :param archives: годовые таблицы архивов (имя схемы, имя таблицы)
+        :param search: выполняется ли поиск по описанию (параметр :query)
+        :return: (WITH-часть запроса, источник операций с псевдонимом o, столбец релевантности или None)
+        """
+        if not archives and not search:
+            return '', 'operation o', None
+
+        matches = []
+        parts = []
+        for index, (schema, table) in enumerate([('main', 'operation'), *archives]):
+            category = 'a.category_id'
+            if schema != 'main':
+                # Категории, удалённые после архивации операций, считаются отсутствующими
+                category = '''
+                    CASE WHEN a.category_id IN (SELECT id FROM main.category) THEN a.category_id END AS category_id
+                '''
+            columns = f'a.id, a.type, a.amount, a.amount_cents, a.description, a.date, a.user_id, {category}'
+            if search:
+                matches.append(f'''
+                    matches_{index}(id, rank) AS (
+                        SELECT rowid, bm25({table}_fts) FROM {schema}.{table}_fts WHERE {table}_fts MATCH :query
+                    )
+                ''')
+                parts.append(f'SELECT {columns}, m.rank FROM {schema}.{table} a JOIN matches_{index} m USING (id)')
+            else:
+                parts.append(f'SELECT {columns} FROM {schema}.{table} a')
+
+        with_clause = f'WITH {", ".join(matches)}' if matches else ''
+        if not archives:
+            return with_clause, 'operation o JOIN matches_0 m ON m.id = o.id', 'm.rank'
+        return with_clause, '(' + ' UNION ALL '.join(parts) + ') o', 'o.rank' if search else None
+
+    @staticmethod
+    def _fetch(cursor):
+        row = cursor.fetchone()
+        return dict(row) if row is not None else None
@@ -1,17 +1,17 @@
 import calendar
+from contextlib import closing
 from datetime import datetime, timedelta, date
 from decimal import (
     Decimal,
     ROUND_CEILING
 )
+from itertools import islice
 from math import ceil
+from time import time
 from exceptions import ServiceError
-from flask import url_for
-from services.helper import (
-    insert,
-    update,
-    delete
-)
+from flask import current_app, url_for
+from services.storage import get_storage
+from services.storage.models import money
 
 
 class TransactionsServiceError(ServiceError):
@@ -58,17 +58,46 @@ class TransactionInvalidPeriodError(TransactionsServiceError):
     pass
 
 
+class TransactionInvalidFilterError(TransactionsServiceError):
+    pass
+
+
+class InvalidIdempotencyKey(TransactionsServiceError):
+    pass
+
+
 class TransactionsService:
-    def __init__(self, connection):
-        self.connection = connection
+    # Форматы отчёта: full - путь категорий в каждой операции, compact - словарь категорий страницы
+    REPORT_FORMATS = ('full', 'compact')
+    # Поля операций отчёта, доступные для выборки параметром fields
+    REPORT_FIELDS = ('id', 'date', 'type', 'description', 'amount', 'categories')
+    # Режимы пагинации: pages - с подсчётом страниц отчёта, scroll - без подсчёта (бесконечная прокрутка)
+    REPORT_PAGINATIONS = ('pages', 'scroll')
+    # Максимальная длина ключа идемпотентности
+    IDEMPOTENCY_KEY_LENGTH = 255
 
-    def add_transaction(self, data):
+    def __init__(self, connection, write_queue=None):
+        self.storage = get_storage(connection)
+        self.write_queue = write_queue
+
+    def add_transaction(self, data, idempotency_key=None):
         """
         Метод, реализующий бизнес-логику эндпоинта создания новой операции.
 
         :param data: параметры создаваемой операции
+        :param idempotency_key: ключ идемпотентности запроса: повторный запрос с тем же ключом в течение
+                                IDEMPOTENCY_KEY_TTL секунд возвращает ранее созданную операцию без проверки
+                                и записи данных
         :return: параметры созданной операции
         """
+        if idempotency_key is not None:
+            if not 0 < len(idempotency_key) <= self.IDEMPOTENCY_KEY_LENGTH:
+                raise InvalidIdempotencyKey()
+            now = int(time())
+            stored = self.storage.get_idempotent_operation(data['user_id'], idempotency_key, now)
+            if stored is not None:
+                return self._parse_response(stored)
+
         # Получение/преобразование специфичных данных для дальнейшей работы с ними
         data = self._parse_request(data)
 
@@ -80,22 +109,36 @@ class TransactionsService:
         if data['category_id']:
             self._is_owner_category(data['category_id'], data['user_id'])
 
-        # Вставка в таблицу БД
-        instance_id = insert('operation', data, self.connection)
-        if instance_id is None:
+        # Вставка в таблицу БД (напрямую или через очередь отложенной записи)
+        # Созданная операция возвращается той же инструкцией записи
+        if idempotency_key is not None:
+            # Операция и ключ записываются одной транзакцией, поэтому минуя очередь отложенной записи;
+            # истёкшие ключи удаляются пакетами не чаще раза в IDEMPOTENCY_PURGE_INTERVAL секунд
+            config = current_app.config
+            created = self.storage.add_idempotent_operation(data, idempotency_key, now,
+                                                            now + config['IDEMPOTENCY_KEY_TTL'])
+            self.storage.purge_idempotency_keys(now, config['IDEMPOTENCY_PURGE_INTERVAL'])
+        elif self.write_queue is not None:
+            created = self.write_queue.insert('operation', data, self.storage.OPERATION_COLUMNS)
+        else:
+            created = self.storage.add_operation(data)
+        if created is None:
             raise DataBaseConflictError(data)
 
-        # Запрос на получение созданной операции и возврат преобразованных для ответа данных
-        created = self._get_transaction(instance_id)
+        # Возврат преобразованных для ответа данных
         return self._parse_response(created)
 
-    def get_transaction(self, transaction_filters, user_id):
+    def get_transaction(self, transaction_filters, user_id, links=True, scope=None):
         """
         Метод, реализующий бизнес-логику эндпоинта получения полного отчета
         при заданных пользовательских условиях.
 
         :param transaction_filters: словарь, включаущий в себя query-параметры
         :param user_id: идентификатор авторизованного пользователя
+        :param links: параметр указывающий необходимо ли сформировать ссылки на соседние страницы отчёта
+                      (ссылки формируются только в контексте запроса)
+        :param scope: уже полученные параметры отчёта (см. report_scope), чтобы не разбирать фильтры
+                      и не выбирать категории повторно
         :return:        Полный отчет включает в себя:
                         Список операций, удовлетворяющих пользовательским условиям;
                         Сумму по всему отчёту;
@@ -105,62 +148,187 @@ class TransactionsService:
                         Текущую страницу отчёта;
                         Ссылку на получение следующей страницы отчёта;
                         Ссылку на получение предыдущей страницы отчёта.
+                        В режиме pagination=scroll сумма, количество элементов и страниц отчёта
+                        не подсчитываются (если не указан with_total), ссылка на следующую страницу
+                        формируется по наличию следующей операции.
         """
-        category_id = transaction_filters.get('category_id', None)
-        from_date = transaction_filters.get('from', None)
-        to_date = transaction_filters.get('to', None)
-        period = transaction_filters.get('period', None)
-        page_size = transaction_filters.get('page_size', None)
-        current_page = transaction_filters.get('page', None)
-
-        # Проверка важных входных объектов, при их отсутствии устанавливаются значения по умолчанию
-        if category_id is None:
-            missing_category = True
+        params = scope or self.report_scope(transaction_filters, user_id)
+        current_page = params['page']
+        page_size = params['page_size']
+        offset_param = (current_page-1) * page_size
+        # В режиме scroll сумма и количество элементов отчёта считаются только по запросу (with_total)
+        scroll = params['pagination'] == 'scroll'
+        summary = not scroll or params['with_total']
+
+        report = self._get_transactions(user_id, params['categories'], page_size, offset_param, params['from_date'],
+                                        params['to_date'], params['missing_category'], params['running_balance'],
+                                        params['query'], params['operation_type'], params['min_amount'],
+                                        params['max_amount'], params['compact'], params['fields'], scroll, summary)
+        if scroll:
+            if not report['operations']:
+                raise PageReportNotExist
+            pages = current_page + 1 if report.pop('has_next') else current_page
         else:
-            category_id = int(category_id)
-            missing_category = False
+            pages = ceil(report['total_items'] / page_size)
+            if current_page > pages:
+                raise PageReportNotExist
+
+        if links:
+            links = self._get_links(transaction_filters, current_page, pages)
+            if links['prev_link']:
+                report['prev_page'] = links['prev_link']
+            if links['next_link']:
+                report['next_page'] = links['next_link']
+
+        if summary:
+            report['total_pages'] = ceil(report['total_items'] / page_size)
+        report['page'] = current_page
+        report['page_size'] = page_size
+        return report
 
-        if current_page is None:
-            current_page = 1
-        else:
-            current_page = int(current_page)
+    def check_report_filters(self, transaction_filters, user_id):
+        """
+        Метод для проверки фильтров отчёта без его формирования (например, перед постановкой
+        отчёта в очередь фоновых заданий).
 
-        if page_size is None:
-            page_size = 20
-        else:
-            page_size = int(page_size)
+        :param transaction_filters: словарь фильтров отчёта (как query-параметры get_transaction)
+        :param user_id: идентификатор авторизованного пользователя
+        :return: True or raise exception
+        """
+        try:
+            params = self._parse_report_filters(transaction_filters)
+        except (TypeError, ValueError):
+            raise TransactionInvalidFilterError()
+        if params['page_size'] <= 0:
+            raise TransactionInvalidFilterError(params['page_size'])
+        self.get_categories(user_id, params['category_id'])
+        return True
 
-        if from_date:
-            from_date = int(from_date)
+    def report_pages(self, transaction_filters, user_id):
+        """
+        Генератор всех страниц отчёта (для формирования отчёта целиком, например, в фоновом задании).
+        Сумма и количество элементов подсчитываются один раз, операции всех страниц читаются
+        одной выборкой из одного снимка данных, поэтому страницы согласованы между собой.
 
-        if to_date:
-            to_date = int(to_date)
-        offset_param = (current_page-1) * page_size
+        :param transaction_filters: словарь фильтров отчёта (как query-параметры get_transaction,
+                                    номер страницы и режим пагинации не учитываются)
+        :param user_id: идентификатор авторизованного пользователя
+        :return: генератор страниц отчёта (как get_transaction без ссылок) or raise PageReportNotExist
+        """
+        params = self.report_scope(transaction_filters, user_id)
+        page_size = params['page_size']
+        fields = params['fields'] or self.REPORT_FIELDS
+        report = self.storage.report(
+            user_id,
+            [category['id'] for category in params['categories']],
+            params['missing_category'],
+            params['from_date'],
+            params['to_date'],
+            None,
+            0,
+            params['running_balance'],
+            params['query'],
+            params['operation_type'],
+            params['min_amount'],
+            params['max_amount'],
+            self._report_columns(fields),
+            stream=True,
+        )
+        pages = ceil(report['total_items'] / page_size)
+        with closing(report['operations']) as operations:
+            for current_page in range(1, max(pages, 1) + 1):
+                transactions = list(islice(operations, page_size))
+                if not transactions:
+                    raise PageReportNotExist
+                page = self._render_page(user_id, transactions, report, fields, params['compact'])
+                page['total_pages'] = pages
+                page['page'] = current_page
+                page['page_size'] = page_size
+                yield page
+
+    def report_scope(self, transaction_filters, user_id):
+        """
+        Метод для получения параметров отчёта: разобранных фильтров и категорий отбора.
+        Параметры определяют стоимость формирования отчёта (для допуска запроса до формирования
+        отчёта, см. services.admission) и передаются в get_transaction.
 
-        if period is not None:
-            range = self._get_period(period)
-            from_date = range['from']
-            to_date = range['to']
+        :param transaction_filters: словарь, включаущий в себя query-параметры
+        :param user_id: идентификатор авторизованного пользователя
+        :return: словарь параметров отчёта (см. _parse_report_filters) и categories - список категорий отбора
+        """
+        params = self._parse_report_filters(transaction_filters)
+        params['categories'] = self.get_categories(user_id, params['category_id'])
+        return params
 
-        filtered_categories = self._get_categories(user_id, category_id)
-        report = self._get_transactions(user_id, filtered_categories, page_size, offset_param, from_date, to_date,
-                                        missing_category)
-        pages = ceil(report['total_items'] / page_size)
+    def get_categories(self, user_id, category_id, top_down=True):
+        """
+        Метод получения дерева категорий
+
+        :param user_id: идентификатор пользователя
+        :param category_id: идентификатор категории, по которой проводится выборка
+        :param top_down: параметр, определяющий путь обхода дерева. При True происходит обход от category_id
+                        до конца дерева (т.е. вниз).
+                        При False происходит обход дерева от category_id до корня дерева (т.е. вверх)
+        :return: возвращает список словарей с параметрами категорий в порядке обхода дерева.
+        """
 
-        if current_page > pages:
-            raise PageReportNotExist
+        # Проверка на существование категории, если она указана
+        if category_id:
+            category_exist = self._category_exist(category_id)
+            if not category_exist:
+                raise CategoryDoesNotExistError()
 
-        links = self._get_links(transaction_filters, current_page, pages)
+        if category_id and user_id:
+            self._is_owner_category(category_id, user_id)
 
-        if links['prev_link']:
-            report['prev_page'] = links['prev_link']
-        if links['next_link']:
-            report['next_page'] = links['next_link']
+        if category_id is None and top_down:
+            return self.storage.list_categories(user_id)
+        elif category_id is None and not top_down:
+            raise ValueError  # обход дерева вверх не зная начальной точки
 
-        report['total_pages'] = pages
-        report['page'] = current_page
-        report['page_size'] = page_size
-        return report
+        if top_down:
+            return self.storage.subtree(user_id, category_id)
+        else:
+            return self.storage.category_path(user_id, category_id)
+
+    def get_period(self, period):
+        """
+        Утилита для формирования границ временного интервала по заданному типу периода.
+
+        :param period: тип интервала (week, last_week, month, last_month, quarter, last_quarter, year, last_year)
+        :return: {'from': date_from, 'to': date_to} (стандарт UTC, формат timestamp)
+        """
+        if period == 'week':                    # Период - текущая неделя
+            result = self._week()
+        elif period == 'last_week':             # Период - прошлая неделя
+            shift = datetime.today() + timedelta(-7)
+            result = self._week(shift)
+        elif period == 'month':                 # Период - текущий месяц
+            result = self._month()
+        elif period == 'last_month':            # Период - прошлый месяц
+            now = datetime.today()
+            month_size = calendar.monthrange(now.year, now.month)[1]
+            shift = now + timedelta(days=-month_size)
+            result = self._month(shift)
+        elif period == 'quarter':               # Период - текущий квартал
+            result = self._quarter()
+        elif period == 'last_quarter':          # Период - прошлый квартал
+            result = self._last_quarter()
+        elif period == 'year':                  # Период - текущий год
+            result = self._year()
+        elif period == 'last_year':             # Период - прошлый год
+            now = datetime.today()
+            shift = now.replace(day=1, year=now.year-1)
+            result = self._year(shift)
+        else:
+            raise TransactionInvalidPeriodError
+
+        # Сброс времени и преобразование в UTC timestamp
+        for key in result:
+            result[key] = result[key].replace(hour=0, minute=0, second=0, microsecond=0)
+            result[key] = calendar.timegm(result[key].utctimetuple())
+
+        return result
 
     def patch_transaction(self, transaction_id, user_id, data):
         """
@@ -171,21 +339,18 @@ class TransactionsService:
         :param data: обновляемые данные
         :return: сформированный ответ
         """
-        # Проверка на существование операции и её принадлежность пользователю
-        self._is_owner_transaction(transaction_id, user_id)
-
         # Преобразование специфичных полей данных
         data = self._parse_request(data)
 
-        # Проверка на существование категории и её принадлежность пользователю (если указана)
-        if data['category_id'] is not None:
-            self._is_owner_category(data['category_id'], user_id)
-
-        is_patched = update('operation', data, transaction_id, self.connection)
-        if not is_patched:
+        # Изменение одной инструкцией: операция и её новая категория должны принадлежать пользователю
+        patched = self.storage.update_operation(transaction_id, data, user_id)
+        if patched is None:
+            # Выяснение причины отказа требует дополнительных запросов только в этом случае
+            self._is_owner_transaction(transaction_id, user_id)
+            if data['category_id'] is not None:
+                self._is_owner_category(data['category_id'], user_id)
             raise DataBaseConflictError
         else:
-            patched = self._get_transaction(transaction_id)
             return self._parse_response(patched)
 
     def delete_transaction(self, data):
@@ -198,12 +363,11 @@ class TransactionsService:
         user_id = data.get('user_id')
         transaction_id = data.get('transaction_id')
 
-        # Проверка на существование операции и её принадлежность пользователю
-        self._is_owner_transaction(transaction_id, user_id)
-
-        # Удаляем операцию
-        is_deleted = delete('operation', transaction_id, self.connection)
+        # Удаляем операцию, если она принадлежит пользователю
+        is_deleted = self.storage.delete_operation(transaction_id, user_id)
         if not is_deleted:
+            # Проверка на существование операции и её принадлежность пользователю
+            self._is_owner_transaction(transaction_id, user_id)
             raise DataBaseConflictError
 
     def _get_transaction(self, transaction_id):
@@ -213,12 +377,11 @@ class TransactionsService:
         :param transaction_id: идентификатор операции
         :return: параметры операции
         """
-        cur = self.connection.execute(f'SELECT * FROM operation WHERE id = "{transaction_id}"')
-        transaction = cur.fetchone()
+        transaction = self.storage.get_operation(transaction_id)
         if not transaction:
             raise TransactionDoesNotExistError(transaction_id)
         else:
-            return dict(transaction)
+            return transaction
 
     def _is_owner_transaction(self, transaction_id, user_id):
         """
@@ -241,8 +404,7 @@ class TransactionsService:
         :param category_id: идентификатор категории
         :return: True or raise exception
         """
-        cursor = self.connection.execute(f'SELECT * FROM category WHERE id = {category_id}')
-        instance = cursor.fetchone()
+        instance = self.storage.get_category(category_id)
         if instance is None:
             raise CategoryDoesNotExistError(category_id)
         if instance['user_id'] != user_id:
@@ -256,19 +418,7 @@ class TransactionsService:
         :param category_id: идентификатор категории
         :return: True/False
         """
-        cursor = self.connection.execute(
-            """
-            SELECT *
-            FROM category
-            WHERE id = ?
-            """,
-            (category_id,),
-        )
-        cursor = cursor.fetchone()
-        if cursor is None:
-            return False
-        else:
-            return True
+        return self.storage.get_category(category_id) is not None
 
     @staticmethod
     def _parse_request(data):
@@ -295,6 +445,111 @@ class TransactionsService:
                 raise NegativeValue
         return data
 
+    def _parse_report_filters(self, transaction_filters):
+        """
+        Парсер фильтров отчёта из query-параметров.
+
+        :param transaction_filters: словарь, включаущий в себя query-параметры
+        :return: словарь параметров отчёта
+        """
+        category_id = transaction_filters.get('category_id', None)
+        from_date = transaction_filters.get('from', None)
+        to_date = transaction_filters.get('to', None)
+        period = transaction_filters.get('period', None)
+        page_size = transaction_filters.get('page_size', None)
+        current_page = transaction_filters.get('page', None)
+        running_balance = transaction_filters.get('running_balance', 'false').lower() in ('1', 'true')
+        query = transaction_filters.get('q', None)
+        operation_type = transaction_filters.get('type', None)
+        min_amount = transaction_filters.get('min_amount', None)
+        max_amount = transaction_filters.get('max_amount', None)
+        report_format = transaction_filters.get('format', 'full')
+        fields = transaction_filters.get('fields', None)
+        pagination = transaction_filters.get('pagination', 'pages')
+        with_total = transaction_filters.get('with_total', 'false').lower() in ('1', 'true')
+
+        # Проверка важных входных объектов, при их отсутствии устанавливаются значения по умолчанию
+        if category_id is None:
+            missing_category = True
+        else:
+            category_id = int(category_id)
+            missing_category = False
+
+        if current_page is None:
+            current_page = 1
+        else:
+            current_page = int(current_page)
+
+        if page_size is None:
+            page_size = 20
+        else:
+            page_size = int(page_size)
+
+        if from_date:
+            from_date = int(from_date)
+
+        if to_date:
+            to_date = int(to_date)
+
+        # Фильтры по типу операции и сумме (суммы передаются в рублях, в БД сравниваются в копейках)
+        if operation_type is not None:
+            if operation_type not in ('0', '1'):
+                raise TransactionInvalidFilterError(operation_type)
+            operation_type = int(operation_type)
+        min_amount = self._parse_amount_filter(min_amount)
+        max_amount = self._parse_amount_filter(max_amount)
+        if report_format not in self.REPORT_FORMATS:
+            raise TransactionInvalidFilterError(report_format)
+        if fields is not None:
+            fields = [field.strip() for field in fields.split(',') if field.strip()]
+            if not fields or any(field not in self.REPORT_FIELDS for field in fields):
+                raise TransactionInvalidFilterError(fields)
+        if pagination not in self.REPORT_PAGINATIONS:
+            raise TransactionInvalidFilterError(pagination)
+
+        if period is not None:
+            range = self.get_period(period)
+            from_date = range['from']
+            to_date = range['to']
+
+        return {
+            'category_id': category_id,
+            'missing_category': missing_category,
+            'page': current_page,
+            'page_size': page_size,
+            'from_date': from_date,
+            'to_date': to_date,
+            'running_balance': running_balance,
+            'query': query,
+            'operation_type': operation_type,
+            'min_amount': min_amount,
+            'max_amount': max_amount,
+            'compact': report_format == 'compact',
+            'fields': fields,
+            'pagination': pagination,
+            'with_total': with_total,
+        }
+
+    @staticmethod
+    def _parse_amount_filter(amount):
+        """
+        Парсер фильтра по сумме операции из query-параметра.
+
+        :param amount: сумма в формате "рубли.копейки" или None
+        :return: сумма в копейках или None
+        """
+        if amount is None:
+            return None
+        try:
+            amount = round(Decimal(amount), 2)
+        except ArithmeticError:
+            raise TransactionInvalidFilterError(amount)
+        if not amount.is_finite():
+            raise TransactionInvalidFilterError(amount)
+        if amount < 0:
+            raise NegativeValue
+        return int(amount.scaleb(2))
+
     @staticmethod
     def _parse_response(data):
         """
@@ -311,56 +566,6 @@ class TransactionsService:
             data['amount'] = str(amount)
         return data
 
-    def _get_categories(self, user_id, category_id, top_down=True):
-        """
-        Метод получения дерева категорий
-
-        :param user_id: идентификатор пользователя
-        :param category_id: идентификатор категории, по которой проводится выборка
-        :param top_down: параметр, определяющий путь обхода дерева. При True происходит обход от category_id
-                        до конца дерева (т.е. вниз).
-                        При False происходит обход дерева от category_id до корня дерева (т.е. вверх)
-        :return: возвращает список словарей с параметрами категорий в порядке обхода дерева.
-        """
-
-        # Проверка на существование категории, если она указана
-        if category_id:
-            category_exist = self._category_exist(category_id)
-            if not category_exist:
-                raise CategoryDoesNotExistError()
-
-        if category_id and user_id:
-            self._is_owner_category(category_id, user_id)
-
-        if category_id is None and top_down:
-            cursor = self.connection.execute('SELECT id, name FROM category WHERE user_id = ?', (user_id,))
-            cursor = cursor.fetchall()
-            return [dict(elem) for elem in cursor]
-        elif category_id is None and not top_down:
-            raise ValueError  # обход дерева вверх не зная начальной точки
-
-        if top_down:
-            bypass_rule = 'WHERE c.parent_id = sc.id'
-            what_to_select = 'id'
-        else:
-            bypass_rule = 'WHERE c.id = sc.parent_id'
-            what_to_select = 'id, name'
-
-        cursor = self.connection.execute(
-            f'''
-            WITH RECURSIVE sub_category(id, name, parent_id) AS (
-                SELECT id, name, parent_id FROM category WHERE user_id = ? AND id = ?
-                UNION ALL
-                SELECT c.id, c.name, c.parent_id FROM category c, sub_category sc
-                {bypass_rule}
-            )
-            SELECT {what_to_select} FROM sub_category;
-            ''',
-            (user_id, category_id,),
-        )
-        cursor = cursor.fetchall()
-        return [dict(elem) for elem in cursor]
-
     @staticmethod
     def _get_links(filters, current_page, pages):
         """
@@ -402,7 +607,9 @@ class TransactionsService:
 
         return links
 
-    def _get_transactions(self, user_id, categories, page_size, offset_param, from_date, to_date, missing_category):
+    def _get_transactions(self, user_id, categories, page_size, offset_param, from_date, to_date, missing_category,
+                          running_balance=False, query=None, operation_type=None, min_amount=None, max_amount=None,
+                          compact=False, fields=None, scroll=False, summary=True):
         """
         Метод для получения сортированного списка операций по списку категорий,
         подсчёта суммы отчёта и количества элементов отчёта.
@@ -414,67 +621,123 @@ class TransactionsService:
         :param from_date: параметр указывающий с какой даты делать выборку
         :param to_date: параметр указывающий по какую дату делать выборку
         :param missing_category: параметр указывающий необходимо ли включать в выборку безкатегорийные операции
+        :param running_balance: параметр указывающий необходимо ли добавлять к операциям нарастающий остаток
+        :param query: строка поиска по описанию операций
+        :param operation_type: параметр указывающий тип операций в выборке (1 - доход, 0 - расход)
+        :param min_amount: минимальная сумма операции в копейках
+        :param max_amount: максимальная сумма операции в копейках
+        :param compact: параметр указывающий необходимо ли вместо пути категорий в каждой операции
+                        сформировать словарь категорий страницы (id -> name, parent_id)
+        :param fields: список полей операций в ответе (по умолчанию - все поля)
+        :param scroll: параметр указывающий необходимо ли выбрать лишнюю операцию для определения
+                       наличия следующей страницы (has_next в ответе)
+        :param summary: параметр указывающий необходимо ли подсчитать сумму и количество элементов отчёта
         :return: частично сформированный ответ
         """
-        # Формируем условие
-        clause = ' OR '.join(f'category_id = {category["id"]}' for category in categories)
-        if missing_category:
-            clause = f'({clause} OR (category_id IS NULL))'
-        if from_date:
-            clause = clause + f' AND (date>={from_date})'
-        if to_date:
-            clause = clause + f' AND (date<{to_date})'
-
-        # формируем основное тело запроса
-        sql_request = f'''
-            SELECT id, date, type, description, amount, category_id
-            FROM operation
-            WHERE {clause} AND user_id = {user_id}
-            ORDER BY date ASC
-        '''
-        cursor = self.connection.execute(sql_request)
-        transactions = cursor.fetchall()
-
-        # Проверка на "пустой отчёт"
-        if transactions is None:
-            raise EmptyReportError
-
-        # Инициализация аккумулятора суммы, получение кол-ва элементов
-        total = 0
-        total_items = len(transactions)
-        # Подсчёт суммы по всему отчёту
-        for transaction in transactions:
-            amount = Decimal(transaction['amount'])
-            if bool(transaction['type']):
-                total += amount
-            else:
-                total -= amount
-
-        # Добавление в зарос параметров LIMIT и OFFSET для пагинации
-        sql_request = sql_request + f'LIMIT {page_size} OFFSET {offset_param}'
-        cursor = self.connection.execute(sql_request)
-        transactions = cursor.fetchall()
-        transactions = [dict(transaction) for transaction in transactions]
+        fields = fields or self.REPORT_FIELDS
+        report = self.storage.report(
+            user_id,
+            [category['id'] for category in categories],
+            missing_category,
+            from_date,
+            to_date,
+            page_size + 1 if scroll else page_size,
+            offset_param,
+            running_balance,
+            query,
+            operation_type,
+            min_amount,
+            max_amount,
+            self._report_columns(fields),
+            summary,
+        )
+        transactions = report['operations']
+
+        # Наличие следующей страницы определяется по лишней операции выборки, без подсчёта всей выборки
+        has_next = len(transactions) > page_size
+        del transactions[page_size:]
+
+        return self._render_page(user_id, transactions, report, fields, compact, has_next if scroll else None)
 
+    @staticmethod
+    def _report_columns(fields):
+        """
+        Утилита для получения полей выборки операций отчёта по полям ответа
+        (без категорий не выбирается и не формируется путь категории).
+
+        :param fields: список полей операций в ответе
+        :return: список полей выборки (см. Storage.REPORT_COLUMNS)
+        """
+        columns = [field for field in fields if field != 'categories']
+        if 'categories' in fields:
+            columns.extend(('category_id', 'category_path'))
+        return columns
+
+    def _render_page(self, user_id, transactions, summary, fields, compact, has_next=None):
+        """
+        Метод для приведения операций страницы к виду ответа и формирования страницы отчёта.
+
+        :param user_id: идентификатор пользователя
+        :param transactions: операции страницы (Operation)
+        :param summary: сумма и количество элементов отчёта (total, total_items - None, если не подсчитаны)
+        :param fields: список полей операций в ответе
+        :param compact: параметр указывающий необходимо ли сформировать словарь категорий страницы
+        :param has_next: наличие следующей страницы (для режима scroll)
+        :return: частично сформированный ответ
+        """
+        with_categories = 'categories' in fields
+        categories = {}
+
+        # Операции уже приведены к виду ответа (см. Operation), изменяются на месте
         for transaction in transactions:
-            # Формирование пути по категориям для операций
-            if transaction['category_id'] is not None:
-                category_id = transaction.pop('category_id')
-                category_path = self._get_categories(user_id, category_id, top_down=False)
-                transaction['categories'] = category_path
-            else:
-                transaction.pop('category_id')
-                transaction['categories'] = []
-            # Преобразование специфичных полей операции
-            transaction = self._parse_response(transaction)
-
-        report = {
-            'operations': transactions,
-            'total': str(total),
-            'total_items': total_items
-        }
+            # Идентификатор и дата выбираются всегда (сортировка), но в ответ попадают только по запросу
+            if 'id' not in fields:
+                del transaction.id
+            if 'date' not in fields:
+                del transaction.date
+            if with_categories:
+                self._attach_categories(user_id, transaction, categories if compact else None)
+
+        report = {'operations': transactions}
+        if summary['total_items'] is not None:
+            # Сумма пустого отчёта - '0', как и до перевода сумм в копейки
+            report['total'] = money(summary['total']) if summary['total_items'] else '0'
+            report['total_items'] = summary['total_items']
+        if has_next is not None:
+            report['has_next'] = has_next
+        if compact and with_categories:
+            report['categories'] = categories
         return report
 
+    def _attach_categories(self, user_id, transaction, categories=None):
+        """
+        Метод для добавления к операции пути по категориям (из сохранённого снимка пути категории).
+
+        :param user_id: идентификатор пользователя
+        :param transaction: операция отчёта (Operation)
+        :param categories: словарь категорий страницы для компактного формата отчёта
+                           (операция ссылается на категорию, путь восстанавливается по словарю категорий)
+        :return: nothing
+        """
+        category_path = transaction.category_path
+        del transaction.category_path
+        if transaction.category_id is None:
+            category_path = []
+        elif category_path is None:
+            category_path = self.get_categories(user_id, transaction.category_id, top_down=False)
+
+        if categories is None:
+            del transaction.category_id
+            transaction.categories = category_path
+            return
+
+        for index, category in enumerate(category_path):
+            parent = category_path[index + 1] if index + 1 < len(category_path) else None
+            categories[str(category['id'])] = {
+                'name': category['name'],
+                'parent_id': parent['id'] if parent is not None else None,
+            }
+
     @staticmethod
     def _week(reference=datetime.today()):
         """
@@ -576,42 +839,3 @@ class TransactionsService:
         result['from'] = reference.replace(day=1, month=1)
         result['to'] = reference.replace(day=1, month=1, year=year)
         return result
-
-    def _get_period(self, period):
-        """
-        Утилита для формирования границ временного интервала по заданному типу периода.
-
-        :param period: тип интервала (week, last_week, month, last_month, quarter, last_quarter, year, last_year)
-        :return: {'from': date_from, 'to': date_to} (стандарт UTC, формат timestamp)
-        """
-        if period == 'week':                    # Период - текущая неделя
-            result = self._week()
-        elif period == 'last_week':             # Период - прошлая неделя
-            shift = datetime.today() + timedelta(-7)
-            result = self._week(shift)
-        elif period == 'month':                 # Период - текущий месяц
-            result = self._month()
-        elif period == 'last_month':            # Период - прошлый месяц
-            now = datetime.today()
-            month_size = calendar.monthrange(now.year, now.month)[1]
-            shift = now + timedelta(days=-month_size)
-            result = self._month(shift)
-        elif period == 'quarter':               # Период - текущий квартал
-            result = self._quarter()
-        elif period == 'last_quarter':          # Период - прошлый квартал
-            result = self._last_quarter()
-        elif period == 'year':                  # Период - текущий год
-            result = self._year()
-        elif period == 'last_year':             # Период - прошлый год
-            now = datetime.today()
-            shift = now.replace(day=1, year=now.year-1)
-            result = self._year(shift)
-        else:
-            raise TransactionInvalidPeriodError
-
-        # Сброс времени и преобразование в UTC timestamp
-        for key in result:
-            result[key] = result[key].replace(hour=0, minute=0, second=0, microsecond=0)
-            result[key] = calendar.timegm(result[key].utctimetuple())
-
-        return result